@@ -13,6 +13,7 @@ from glider_dac.utilities import (
 )
 from glider_dac.extensions import db
 from glider_qc.glider_qc import get_redis_connection
+from glider_qc.deployment_stats import DeploymentStats
 from glider_dac.models.user import User
 import json
 import geojson
@@ -24,6 +25,7 @@ from marshmallow_sqlalchemy.convert import ModelConverter
 from rq.job import Job
 from rq.exceptions import NoSuchJobError
 from shutil import rmtree
+import redis
 import os
 import glob
 import hashlib
@@ -101,6 +103,12 @@ class Deployment(db.Model):
         db.session.commit()
 
     def delete_files(self):
+        try:
+            DeploymentStats(get_redis_connection(), self.full_path).delete()
+        except redis.RedisError:
+            current_app.logger.exception(
+                "Could not delete the QC statistics of %s", self.full_path
+            )
         if os.path.exists(self.full_path):
             rmtree(self.full_path)
         if os.path.exists(self.public_erddap_path):
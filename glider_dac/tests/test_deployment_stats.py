@@ -0,0 +1,129 @@
+#!/usr/bin/env python
+"""
+tests/test_deployment_stats.py
+"""
+
+from glider_qc.deployment_stats import (
+    RATE_SIGMA, STATS_TTL, DeploymentStats, RunningStats, VariableStats
+)
+from glider_qc.glider_qc import GliderQC, run_qc
+from glider_qc import engine, reqc
+from unittest import TestCase, mock
+from netCDF4 import Dataset
+from glider_dac.tests.resources import STATIC_FILES
+import fakeredis
+import json
+import os
+import shutil
+import tempfile
+import numpy as np
+
+
+class TestDeploymentStats(TestCase):
+    def setUp(self):
+        self.rc = fakeredis.FakeRedis()
+        rng = np.random.default_rng(0)
+        self.values = rng.normal(20, 2, (3, 50))
+        self.values[1, [4, 17]] = np.nan
+        self.times = np.arange(50).astype("datetime64[s]")
+
+    def test_merge_matches_concatenated_values(self):
+        merged = RunningStats.empty()
+        for row in self.values:
+            stats = engine.threshold_statistics(row, self.times).variable(0)
+            merged = merged.merge(RunningStats.from_threshold_stats(stats))
+
+        values = self.values.ravel()
+        assert merged.count == 148
+        np.testing.assert_almost_equal(merged.mean, np.nanmean(values))
+        np.testing.assert_almost_equal(merged.std, np.nanstd(values))
+
+    def test_update_merges_each_file_once(self):
+        store = DeploymentStats(self.rc, "/data/Murphy-20150809T135508Z")
+        for index, row in enumerate(self.values):
+            stats = engine.threshold_statistics(row, self.times).variable(0)
+            merged = store.update("temperature", f"{index}.nc", stats, row, self.times)
+        # QC'ing a file again does not change the statistics
+        stats = engine.threshold_statistics(self.values[0], self.times).variable(0)
+        again = store.update("temperature", "0.nc", stats, self.values[0], self.times)
+
+        assert again == merged == store.get("temperature")
+        assert merged.values.count == 148
+        assert merged.files == merged.rates.count == 3
+        # the last file's rate of change is taken within the deployment band
+        _, rates = engine.band_max_rate(
+            self.values, self.times, [merged.values.mean] * 3, [merged.values.std] * 3
+        )
+        assert merged.max_rate >= rates[-1]
+        assert merged.rate_threshold <= merged.max_rate
+        assert store.get("salinity") == VariableStats.empty()
+        key = store.key("temperature")
+        assert 0 < self.rc.ttl(key) <= STATS_TTL
+        assert 0 < self.rc.ttl(f"{key}:files") <= STATS_TTL
+
+        # the statistics are removed with the deployment, not the others
+        other = DeploymentStats(self.rc, "/data/Murphy-20150809T135508Z-delayed")
+        other.update("temperature", "0.nc", stats, self.values[0], self.times)
+        store.delete()
+        assert store.get("temperature") == VariableStats.empty()
+        assert other.get("temperature").files == 1
+
+    def test_rate_threshold(self):
+        # a single file with a corrupt rate of change does not set the
+        # threshold of the deployment
+        stats = VariableStats.empty()
+        for rate in [0.1] * 9 + [5.0]:
+            stats = stats._replace(
+                rates=stats.rates.merge(RunningStats.of(rate)),
+                max_rate=max(rate, np.nan_to_num(stats.max_rate)),
+            )
+        rates = np.array([0.1] * 9 + [5.0])
+        np.testing.assert_almost_equal(
+            stats.rate_threshold, rates.mean() + RATE_SIGMA * rates.std()
+        )
+        assert stats.rate_threshold < 5.0
+        assert VariableStats.empty()._replace(
+            rates=RunningStats.of(0.2), max_rate=0.2
+        ).rate_threshold == 0.2
+
+    def test_run_qc_uses_deployment_thresholds(self):
+        tempdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tempdir)
+        deployment_dir = os.path.join(tempdir, "Murphy-20150809T135508Z")
+        os.makedirs(deployment_dir)
+        paths = [
+            shutil.copy(STATIC_FILES["murphy"], os.path.join(deployment_dir, name))
+            for name in ("a.nc", "b.nc")
+        ]
+        with Dataset(paths[1], "r+") as ncfile:
+            ncfile.variables["temperature"][:] += 1.0
+
+        config = GliderQC(None, None)
+        config.load_config()
+        # deployment statistics are opt-in
+        assert config.config["threshold_statistics"] == "file"
+        config.config["threshold_statistics"] = "deployment"
+        with mock.patch(
+            "glider_qc.glider_qc.get_redis_connection", return_value=self.rc
+        ):
+            for path in paths:
+                with Dataset(path, "r+") as ncfile:
+                    run_qc(config.config, ncfile, path)
+
+        with Dataset(STATIC_FILES["murphy"]) as ncfile:
+            temperature = ncfile.variables["temperature"][1:-1]
+        expected_std = np.std(np.concatenate([temperature, temperature + 1.0]))
+        stats = DeploymentStats(self.rc, deployment_dir).get("temperature")
+        assert stats.values.count == 12
+        np.testing.assert_almost_equal(stats.values.std, expected_std)
+        with Dataset(paths[1]) as ncfile:
+            spike_config = json.loads(
+                ncfile.variables["qartod_temperature_spike_flag"].qartod_config
+            )
+        np.testing.assert_almost_equal(spike_config["suspect_threshold"], expected_std)
+        # the statistics the thresholds were derived from are stored with them
+        snapshot = spike_config["threshold_statistics"]
+        assert snapshot["mode"] == "deployment" and snapshot["files"] == 2
+        assert snapshot["count"] == 12
+        # and are not mistaken for a configuration change
+        assert reqc.plan_file(paths[1], config.config) == {}
@@ -0,0 +1,113 @@
+#!/usr/bin/env python
+"""
+tests/test_glider_qartod.py
+"""
+
+from glider_qc import status_index
+from scripts import glider_qartod
+from unittest import TestCase, mock
+import os
+import shutil
+import tempfile
+
+
+class TestGliderQartod(TestCase):
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tempdir)
+        patcher = mock.patch.dict(
+            os.environ, {"QC_STATUS_INDEX": os.path.join(self.tempdir, "index.sqlite")}
+        )
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+        self.root = os.path.join(self.tempdir, "submission")
+        for deployment, names in (("dep1", ["b.nc", "a.nc", "notes.txt"]), ("dep2", ["c.nc"])):
+            os.makedirs(os.path.join(self.root, "user", deployment))
+            for name in names:
+                self.touch(os.path.join(self.root, "user", deployment, name))
+
+    def touch(self, path):
+        with open(path, "w"):
+            pass
+
+    def test_scan_deployments(self):
+        scanned = list(glider_qartod.scan_deployments([self.root]))
+        assert [(d, paths) for d, _, paths in scanned] == [
+            (
+                os.path.join(self.root, "user", "dep1"),
+                [os.path.join(self.root, "user", "dep1", n) for n in ("a.nc", "b.nc")],
+            ),
+            (
+                os.path.join(self.root, "user", "dep2"),
+                [os.path.join(self.root, "user", "dep2", "c.nc")],
+            ),
+        ]
+        assert all(mtime_ns for _, mtime_ns, _ in scanned)
+        assert list(glider_qartod.scan_deployments([self.root + "-delayed"])) == []
+
+    def test_process_tree_skips_unchanged_deployments(self):
+        checked = []
+
+        def check_needs_qc(nc_path):
+            checked.append(os.path.basename(nc_path))
+            needs_qc = nc_path.endswith("c.nc")
+            status_index.record_status(
+                nc_path, status_index.PENDING if needs_qc else status_index.DONE
+            )
+            return needs_qc
+
+        with mock.patch.object(glider_qartod.glider_qc, "check_needs_qc", check_needs_qc), \
+                mock.patch.object(glider_qartod.glider_qc, "qc_deployment_batch", return_value=1) as batch:
+            glider_qartod.process_tree([self.root], "qc_config.yml", sync=True)
+            assert sorted(checked) == ["a.nc", "b.nc", "c.nc"]
+            batch.assert_called_once_with(
+                os.path.join(self.root, "user", "dep2"), ["c.nc"], "qc_config.yml"
+            )
+
+            # dep1 is unchanged, dep2 still has a file to QC
+            checked.clear()
+            glider_qartod.process_tree([self.root], "qc_config.yml", sync=True)
+            assert checked == ["c.nc"]
+
+            # a new file changes the modification time of dep1
+            self.touch(os.path.join(self.root, "user", "dep1", "d.nc"))
+            checked.clear()
+            glider_qartod.process_tree([self.root], "qc_config.yml", sync=True)
+            assert sorted(checked) == ["a.nc", "b.nc", "c.nc", "d.nc"]
+
+            # a file replaced in place with its old modification time, as rsync
+            # -t does, leaves the modification time of dep1 as it was
+            dep1 = os.path.join(self.root, "user", "dep1")
+            a_path = os.path.join(dep1, "a.nc")
+            dep1_stat, a_stat = os.stat(dep1), os.stat(a_path)
+            tmp_path = os.path.join(dep1, ".a.nc.tmp")
+            with open(tmp_path, "w") as f:
+                f.write("new data")
+            os.replace(tmp_path, a_path)
+            os.utime(a_path, ns=(a_stat.st_atime_ns, a_stat.st_mtime_ns))
+            os.utime(dep1, ns=(dep1_stat.st_atime_ns, dep1_stat.st_mtime_ns))
+            checked.clear()
+            glider_qartod.process_tree([self.root], "qc_config.yml", sync=True)
+            assert checked == ["a.nc", "c.nc"]
+
+    def test_dispatch_waits_for_sync_per_batch(self):
+        dep1 = os.path.join(self.root, "user", "dep1")
+        dep2 = os.path.join(self.root, "user", "dep2")
+        calls = mock.Mock()
+        calls.qc_deployment_batch.return_value = 1
+        with mock.patch.object(glider_qartod, "sync_lock", calls.sync_lock), \
+                mock.patch.object(glider_qartod.glider_qc, "qc_deployment_batch",
+                                  calls.qc_deployment_batch), \
+                mock.patch.object(glider_qartod.glider_qc, "QC_BATCH_SIZE", 1):
+            dispatcher = glider_qartod.QCDispatcher("qc_config.yml", sync=True)
+            dispatcher.submit([os.path.join(dep1, "a.nc"), os.path.join(dep1, "b.nc"),
+                               os.path.join(dep2, "c.nc")])
+        assert calls.mock_calls == [
+            mock.call.sync_lock(),
+            mock.call.qc_deployment_batch(dep1, ["a.nc"], "qc_config.yml"),
+            mock.call.sync_lock(),
+            mock.call.qc_deployment_batch(dep1, ["b.nc"], "qc_config.yml"),
+            mock.call.sync_lock(),
+            mock.call.qc_deployment_batch(dep2, ["c.nc"], "qc_config.yml"),
+        ]
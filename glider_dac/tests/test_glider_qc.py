@@ -3,14 +3,23 @@
 tests/test_glider_qc.py
 """
 
-from glider_qc.glider_qc import GliderQC
-from unittest import TestCase
+from glider_qc.glider_qc import (
+    GliderQC,
+    fill_masked,
+    get_converter,
+    parse_deployment_time,
+    run_qc,
+    time_diagnostics,
+)
+from glider_qc.write_plan import FlagWritePlan, storage_options
+from unittest import TestCase, mock
 from netCDF4 import Dataset
 import importlib
 from glider_dac.tests.resources import STATIC_FILES
 import yaml
 import tempfile
 import os
+import shutil
 import numpy as np
 from numpy import ma
 import pandas as pd
@@ -120,6 +129,65 @@ class TestGliderQC(TestCase):
         ancillary_variables = temperature.ancillary_variables
         assert "qartod_temperature_spike_flag" in ancillary_variables
 
+    def test_create_qc_variables_plan(self):
+        copypath = self.copy_ncfile(STATIC_FILES["murphy"])
+        ncfile = Dataset(copypath, "r+")
+        self.addCleanup(ncfile.close)
+
+        qc = GliderQC(ncfile, self.qc_conf_loc)
+        temperature = ncfile.variables["temperature"]
+        plan = FlagWritePlan(ncfile)
+        names = qc.create_qc_variables(temperature, plan)
+        # nothing is written before the commit
+        assert "qartod_temperature_spike_flag" not in ncfile.variables
+        plan.commit()
+        np.testing.assert_equal(ncfile.variables["qartod_temperature_spike_flag"][:], [2] * 8)
+
+        # planning the same variables again updates them
+        qc.create_qc_variables(temperature, plan)
+        plan.set_data("qartod_temperature_spike_flag", np.arange(1, 9))
+        plan.set_attributes("qartod_temperature_spike_flag", {"qartod_test": "spike_test"})
+        with self.assertRaises(KeyError):
+            plan.set_data("qartod_temperature_climatology_flag", np.arange(1, 9))
+        plan.commit()
+
+        spike = ncfile.variables["qartod_temperature_spike_flag"]
+        np.testing.assert_equal(spike[:], np.arange(1, 9))
+        assert spike.qartod_test == "spike_test"
+        np.testing.assert_equal(ncfile.variables["qartod_temperature_primary_flag"][:], [2] * 8)
+        # the flag variables are only listed once, after the existing temperature_qc
+        assert temperature.ancillary_variables.split()[1:] == names
+
+    def test_flag_storage(self):
+        fd, path = tempfile.mkstemp()
+        os.close(fd)
+        self.addCleanup(os.remove, path)
+        nc = Dataset(path, "w", format="NETCDF4")
+        self.addCleanup(nc.close)
+        nc.createDimension("time", 100)
+        temperature = nc.createVariable(
+            "temperature", np.float64, ("time",), zlib=True, complevel=2, shuffle=False, chunksizes=(50,)
+        )
+        temperature.standard_name = "sea_water_temperature"
+
+        qc = GliderQC(nc, {"flag_storage": {"mode": "compress", "complevel": 6}})
+        qc.create_qc_variables(temperature)
+        spike = nc.variables["qartod_temperature_spike_flag"]
+        assert spike.chunking() == [50]
+        assert spike.filters()["complevel"] == 6
+        assert spike.filters()["shuffle"]
+        np.testing.assert_equal(spike[:], [2] * 100)
+
+        match_parent = storage_options(nc, "temperature", {"mode": "match_parent"})
+        assert match_parent == {
+            "chunksizes": [50], "zlib": True, "complevel": 2, "shuffle": False
+        }
+        assert storage_options(nc, "temperature", None) == {}
+
+        # classic files cannot be compressed
+        with Dataset(STATIC_FILES["murphy"]) as classic:
+            assert storage_options(classic, "temperature", {"mode": "compress"}) == {}
+
     def test_apply_qc(self):
         copypath = self.copy_ncfile(STATIC_FILES["murphy"])
         ncfile = Dataset(copypath, "r+")
@@ -396,3 +464,190 @@ class TestGliderQC(TestCase):
         result = qc.check_time(tnp, nc_path)
         print(f"QC result: {result!r}")
         assert 'duplicate timestamps' in result
+
+    def test_time_diagnostics(self):
+        t0 = np.datetime64('2023-05-15T12:00:00', 's')
+        minute = np.timedelta64(1, 'm')
+        tnp = ma.array(
+            [t0, t0 + minute, np.datetime64('NaT'), t0 + minute, t0, t0 + 3 * minute, np.datetime64(0, 's')],
+            mask=[False] * 6 + [True],
+        )
+        diagnostics = time_diagnostics(tnp)
+        assert diagnostics.masked == (1, 6)
+        # the masked zero is not counted as a zero
+        assert diagnostics.zeros == (0, None)
+        assert not diagnostics.zeros
+        assert diagnostics.duplicates == (2, 3)
+        assert diagnostics.inversions == (2, 3)
+        assert str(diagnostics.duplicates) == "(2, first at index 3)"
+
+        diagnostics = time_diagnostics(ma.array([t0, t0 + minute]))
+        assert not any(diagnostics)
+
+    def test_time_report_diagnostics(self):
+        deployment_name = 'unitglider-20230515T120000'
+        nc_file, nc_path = self.create_temp_nc(deployment_name)
+        tnp = ma.array([np.datetime64('2023-05-15T12:00:00', 's')] * 3)
+        with Dataset(nc_file, 'r+') as ncfile:
+            qc = GliderQC(ncfile, self.qc_conf_loc)
+            assert qc.check_time(tnp, nc_path) == 'duplicate timestamps (2, first at index 1)'
+            assert qc.time_diagnostics.inversions == (2, 1)
+
+    def test_parse_deployment_time(self):
+        parse_deployment_time.cache_clear()
+        assert parse_deployment_time('unitglider-20230515T12') == np.datetime64('2023-05-15T12:00:00', 's')
+        assert parse_deployment_time('unitglider-20230515') == np.datetime64('2023-05-15T00:00:00', 's')
+        assert parse_deployment_time('unitglider') is None
+        with self.assertRaises(ValueError):
+            parse_deployment_time('unitglider-20230431T120000')
+        # parsed once per deployment
+        parse_deployment_time('unitglider-20230515T12')
+        assert parse_deployment_time.cache_info().hits == 1
+
+    def test_fill_masked(self):
+        data = ma.array([1.0, 2.0, 3.0, 4.0], mask=[False, True, False, False])
+        values = fill_masked(data)
+        # float64 data is filled in its own buffer
+        assert np.shares_memory(values, ma.getdata(data))
+        np.testing.assert_equal(values, [1.0, np.nan, 3.0, 4.0])
+
+        out = np.empty((2, 3))
+        data = ma.array(np.array([1, 2, 3], dtype=np.int16), mask=[True, False, False])
+        values = fill_masked(data, out=out[1])
+        assert np.shares_memory(values, out)
+        np.testing.assert_equal(out[1], [np.nan, 2.0, 3.0])
+
+    def test_normalize_variable_inplace(self):
+        values = np.array([32.0, 65.0, 100.0])
+        converted, note = GliderQC.normalize_variable(
+            values, "deg_F", "sea_water_temperature", inplace=True
+        )
+        assert converted is values
+        np.testing.assert_almost_equal(np.array([0, 18.3333, 37.777778]), values, 2)
+
+        converted, note = GliderQC.normalize_variable(
+            values, "deg_C", "sea_water_temperature", inplace=True
+        )
+        assert converted is values
+
+    def test_unit_converters(self):
+        # identity conversions do not copy, even without inplace
+        values = np.array([1.0, 2.0])
+        assert get_converter("Celsius", "deg_C").identity
+        converted, note = GliderQC.normalize_variable(values, "Celsius", "sea_water_temperature")
+        assert converted is values
+
+        converter = get_converter("Pa", "dbar")
+        assert get_converter("Pa", "dbar") is converter
+        np.testing.assert_allclose(converter, (1e-4, 0.0))
+        np.testing.assert_allclose(get_converter("degF", "deg_C"), (5 / 9, -160 / 9))
+        # integer values are converted to a new float array
+        np.testing.assert_allclose(converter(np.array([10000, 20000])), [1.0, 2.0])
+
+        converted, note = GliderQC.normalize_variable(
+            np.array([1.0]), "m", "sea_water_temperature"
+        )
+        assert converted is None
+        assert note.startswith("Failed to convert units from m to deg_C")
+
+    def copy_to_deployment(self, ncpath):
+        """
+        Copy a netCDF file into a temporary directory named after its
+        deployment and return the new path.
+        """
+        tempdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tempdir)
+        deployment_dir = os.path.join(
+            tempdir, os.path.basename(os.path.dirname(ncpath))
+        )
+        os.makedirs(deployment_dir)
+        return shutil.copy(ncpath, deployment_dir)
+
+    def test_time_axis(self):
+        fd, fake_file = tempfile.mkstemp()
+        os.close(fd)
+        self.addCleanup(os.remove, fake_file)
+
+        with Dataset(fake_file, "w") as nc:
+            nc.createDimension("time", 3)
+            timevar = nc.createVariable("time", np.float64, ("time",), fill_value=-999.0)
+            timevar.units = "days since 2015-01-01"
+            timevar[:] = ma.array([0.0, 0.5, 0.0], mask=[False, False, True])
+
+        with Dataset(fake_file, "r") as nc:
+            qc = GliderQC(nc, self.qc_conf_loc)
+            time_axis = qc.time_axis
+            # decoded only once
+            assert qc.time_axis is time_axis
+
+        np.testing.assert_equal(time_axis.valid, [True, True, False])
+        np.testing.assert_equal(
+            time_axis.datetimes,
+            np.array(["2015-01-01T00:00:00", "2015-01-01T12:00:00", "NaT"], dtype="datetime64[s]"),
+        )
+        np.testing.assert_equal(time_axis.seconds[:2], [1420070400.0, 1420113600.0])
+        assert np.isnan(time_axis.seconds[2])
+        assert time_axis.masked_datetimes.mask.tolist() == [False, False, True]
+
+    def test_run_qc(self):
+        path = self.copy_to_deployment(STATIC_FILES["murphy"])
+        with Dataset(path, "r+") as ncfile:
+            run_qc(self.qc_conf_loc, ncfile, path)
+
+            assert ncfile.dac_qc_comment == (
+                "Murphy-20150809T135508Z (Murphy-20150809T135508Z_rt.nc: )"
+            )
+            np.testing.assert_equal(
+                ncfile.variables["qartod_temperature_primary_flag"][:],
+                np.array([1, 3, 1, 1, 3, 1, 1, 1], dtype=np.int8),
+            )
+            np.testing.assert_equal(
+                ncfile.variables["qartod_temperature_spike_flag"][:],
+                np.array([2, 1, 1, 1, 1, 1, 1, 2], dtype=np.int8),
+            )
+            assert ncfile.variables["qartod_location_test_flag"][:] == 1
+
+    def test_qc_deployment_batch(self):
+        first = self.copy_to_deployment(STATIC_FILES["murphy"])
+        deployment_dir = os.path.dirname(first)
+        second = shutil.copy(first, os.path.join(deployment_dir, "second.nc"))
+        locked = shutil.copy(first, os.path.join(deployment_dir, "locked.nc"))
+        broken = os.path.join(deployment_dir, "broken.nc")
+        with open(broken, "wb") as f:
+            f.write(b"not a netCDF file")
+
+        def lock_file(path):
+            lock = mock.Mock()
+            lock.acquire.return_value = path != locked
+            return lock
+
+        qc_module = self.qc_module
+        with mock.patch.object(qc_module, "lock_file", side_effect=lock_file), \
+                mock.patch.object(qc_module.yaml, "safe_load", wraps=yaml.safe_load) as load:
+            processed = qc_module.qc_deployment_batch(
+                deployment_dir,
+                [os.path.basename(first), "second.nc", "locked.nc", "broken.nc"],
+                self.qc_conf_loc,
+            )
+
+        # files whose QC failed are not counted
+        assert processed == 2
+        assert os.getxattr(broken, "user.qc_run") == b"error"
+        # the configuration is only parsed once for the whole batch
+        assert load.call_count == 1
+        for path in (first, second):
+            assert os.getxattr(path, "user.qc_run") == b"true"
+            with Dataset(path) as ncfile:
+                assert "qartod_temperature_primary_flag" in ncfile.variables
+        with self.assertRaises(OSError):
+            os.getxattr(locked, "user.qc_run")
+
+        missing_config = os.path.join(deployment_dir, "missing.yml")
+        with self.assertRaisesRegex(qc_module.ProcessError, missing_config):
+            qc_module.qc_deployment_batch(deployment_dir, ["second.nc"], missing_config)
+
+    def test_group_by_deployment(self):
+        batches = self.qc_module.group_by_deployment(
+            ["/data/a/1.nc", "/data/b/1.nc", "/data/a/2.nc", "/data/a/1.nc"]
+        )
+        assert batches == {"/data/a": ["1.nc", "2.nc"], "/data/b": ["1.nc"]}
@@ -0,0 +1,70 @@
+#!/usr/bin/env python
+"""
+tests/test_qc_benchmark.py
+"""
+
+from scripts import qc_benchmark
+from glider_qc import glider_qc
+from unittest import TestCase
+from netCDF4 import Dataset
+import numpy as np
+import os
+import shutil
+import tempfile
+
+
+class TestQCBenchmark(TestCase):
+    qc_conf_loc = os.path.join(os.path.dirname(glider_qc.__file__), "qc_config.yml")
+
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tempdir)
+
+    def test_synthetic_profiles(self):
+        paths = qc_benchmark.generate_files(
+            os.path.join(self.tempdir, "Murphy-20150809T135508Z"),
+            2, 300, ["temperature", "pressure"], seed=1,
+        )
+        with Dataset(paths[0]) as first, Dataset(paths[1]) as second:
+            assert len(second.dimensions["time"]) == 300
+            assert "salinity" not in second.variables
+            assert "salinity_qc" not in second.variables
+            assert second.variables["temperature"].units == "Celsius"
+            assert second.title == first.title
+            # consecutive profiles of the deployment
+            assert second.variables["time"][0] == first.variables["time"][-1] + 10.0
+            assert first.variables["profile_time"][...] == np.mean(first.variables["time"][:])
+
+        config = glider_qc.GliderQC(None, self.qc_conf_loc).config
+        config.update(context_window=0, threshold_statistics="file")
+        assert glider_qc.check_needs_qc(paths[1])
+        with Dataset(paths[1], "r+") as nc:
+            glider_qc.run_qc(config, nc, paths[1])
+        with Dataset(paths[1]) as nc:
+            assert "could not" not in nc.dac_qc_comment.lower()
+            flags = nc.variables["qartod_temperature_gross_range_flag"][:]
+            assert (flags == 1).all()
+            assert "qartod_pressure_primary_flag" in nc.variables
+
+    def test_compare(self):
+        parameters = {"files": 10, "samples": 500, "variables": ["temperature"]}
+        baseline = {
+            "parameters": parameters,
+            "results": {"run_qc": {"files_per_s": 10.0, "peak_rss_mb": 100.0}},
+        }
+        assert qc_benchmark.compare(
+            {"run_qc": {"files_per_s": 8.5, "peak_rss_mb": 115.0}}, baseline, parameters, 0.2
+        ) == []
+        assert qc_benchmark.compare(
+            {"run_qc": {"files_per_s": 7.0, "peak_rss_mb": 130.0}}, baseline, parameters, 0.2
+        ) == [
+            "run_qc: 7.00 files/s, baseline 10.00",
+            "run_qc: peak RSS 130.0 MB, baseline 100.0",
+        ]
+        # runs with other files are not compared
+        assert qc_benchmark.compare(
+            {"run_qc": {"files_per_s": 1.0, "peak_rss_mb": 100.0}},
+            baseline,
+            dict(parameters, samples=8),
+            0.2,
+        ) == []
@@ -0,0 +1,108 @@
+#!/usr/bin/env python
+"""
+tests/test_qc_climatology.py
+"""
+
+from glider_qc import climatology, glider_qc
+from unittest import TestCase
+from glider_dac.tests.resources import STATIC_FILES
+from netCDF4 import Dataset
+import numpy as np
+import os
+import shutil
+import tempfile
+
+
+class TestClimatology(TestCase):
+    qc_conf_loc = os.path.join(os.path.dirname(glider_qc.__file__), "qc_config.yml")
+
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tempdir)
+        self.config = glider_qc.GliderQC(None, self.qc_conf_loc).config
+        self.config.update(context_window=0, threshold_statistics="file")
+        self.addCleanup(climatology.load_index.cache_clear)
+
+    def write_index(self):
+        """
+        Writes a 1 degree temperature climatology of the Gulf of Mexico
+        (18N-31N, 98W-80W), with 0-15-50 dbar bins, where August is 30 +/- 0.1
+        degC at the surface and 29 +/- 0.1 degC below, and the other months
+        12 +/- 1 degC
+        """
+        data = np.full((12, 13, 18, 2, 2), np.nan, dtype=np.float32)
+        data[..., 0], data[..., 1] = 12.0, 1.0
+        data[7, :, :, 0] = 30.0, 0.1
+        data[7, :, :, 1] = 29.0, 0.1
+        # no climatology in the cell of 31N
+        data[:, 12] = np.nan
+        path = os.path.join(self.tempdir, "temperature.npy")
+        index = climatology.ClimatologyIndex(data, (18.0, 1.0), (262.0, 1.0), [0.0, 15.0, 50.0])
+        index.write(path)
+        return path
+
+    def test_lookup(self):
+        path = self.write_index()
+        index = climatology.load_index(path)
+        assert isinstance(index.data, np.memmap)
+        # loaded once per process
+        assert climatology.load_index(path) is index
+
+        datetimes = np.array(["2015-08-09"] * 7, dtype="datetime64[s]")
+        datetimes[2] = np.datetime64("2015-01-01")
+        datetimes[5] = np.datetime64("NaT")
+        mean, std = index.lookup(
+            [27.0, 27.0, 27.0, 31.5, 27.0, 27.0, 40.0],
+            # west longitudes wrap around to the grid
+            [-89.0, -89.0, 271.0, -89.0, -89.0, -89.0, -89.0],
+            [10.0, 20.0, 20.0, 10.0, 60.0, 10.0, 10.0],
+            datetimes,
+        )
+        np.testing.assert_array_equal(mean, [30.0, 29.0, 12.0] + [np.nan] * 4)
+        np.testing.assert_allclose(std, [0.1, 0.1, 1.0] + [np.nan] * 4)
+
+        flags = climatology.climatology_flags(
+            [30.05, 29.5, np.nan, 12.0, 30.0, 12.0, 30.0], mean, std, 3.0, 4.5
+        )
+        assert flags.dtype == np.int8
+        assert flags.tolist() == [1, 4, 9, 2, 2, 2, 2]
+        assert climatology.climatology_flags([30.35], mean[:1], std[:1], 3.0).tolist() == [3]
+
+    def run_qc(self, name, config):
+        deployment_dir = os.path.join(self.tempdir, name, "Murphy-20150809T135508Z")
+        os.makedirs(deployment_dir)
+        nc_path = shutil.copy(STATIC_FILES["murphy"], deployment_dir)
+        with Dataset(nc_path, "r+") as nc:
+            glider_qc.run_qc(config, nc, nc_path)
+        with Dataset(nc_path) as nc:
+            flags = {
+                name: nc.variables[name][:].tolist()
+                for name in nc.variables
+                if name.endswith("_regional_climatology_flag")
+            }
+            return flags, nc.dac_qc_comment
+
+    def test_run_qc(self):
+        assert self.run_qc("none", self.config)[0] == {}
+
+        config = dict(
+            self.config,
+            climatology={"indexes": {"sea_water_temperature": self.write_index()}},
+        )
+        with Dataset(STATIC_FILES["murphy"]) as nc:
+            temperature = nc.variables["temperature"][:]
+            pressure = nc.variables["pressure"][:]
+        expected = np.where(
+            np.abs(temperature - np.where(pressure < 15.0, 30.0, 29.0)) > 0.3, 3, 1
+        ).tolist()
+        assert 1 in expected and 3 in expected
+        flags, comment = self.run_qc("index", config)
+        assert flags == {"qartod_temperature_regional_climatology_flag": expected}
+        assert (
+            f"temperature is outside its regional climatology at {expected.count(3)} samples"
+            in comment
+        )
+
+        # files QC'ed in chunks are flagged the same
+        config["streaming"] = {"min_samples": 1, "chunk_size": 3}
+        assert self.run_qc("chunked", config)[0] == flags
@@ -0,0 +1,81 @@
+#!/usr/bin/env python
+"""
+tests/test_qc_consistency.py
+"""
+
+from glider_qc import glider_qc, seawater
+from unittest import TestCase
+from glider_dac.tests.resources import STATIC_FILES
+from netCDF4 import Dataset
+import numpy as np
+import os
+import shutil
+import tempfile
+
+
+class TestConsistency(TestCase):
+    qc_conf_loc = os.path.join(os.path.dirname(glider_qc.__file__), "qc_config.yml")
+
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tempdir)
+        self.config = glider_qc.GliderQC(None, self.qc_conf_loc).config
+        self.config.update(
+            context_window=0, threshold_statistics="file", consistency={"enabled": True}
+        )
+
+    def test_check_values(self):
+        # UNESCO (1983) check values, with IPTS-68 temperatures
+        t68 = np.array([15.0, 20.0, 40.0]) / 1.00024
+        ratio = np.array([1.0, 1.2, 1.888091])
+        pressure = np.array([0.0, 2000.0, 10000.0])
+        np.testing.assert_allclose(
+            seawater.practical_salinity(ratio * seawater.STANDARD_CONDUCTIVITY, t68, pressure),
+            [35.0, 37.245628, 40.0],
+            atol=1e-5,
+        )
+        np.testing.assert_allclose(
+            seawater.density(
+                [0.0, 35.0, 35.0], np.array([5.0, 5.0, 25.0]) / 1.00024, [0.0, 0.0, 10000.0]
+            ),
+            [999.96675, 1027.67547, 1062.53817],
+            atol=1e-5,
+        )
+        assert seawater.consistency_flags(
+            [35.0, 35.0, np.nan, 35.0], [35.01, 35.2, 35.0, np.nan], 0.05
+        ).tolist() == [1, 3, 9, 9]
+
+    def run_qc(self, name, config, salinity_offset=0.0):
+        deployment_dir = os.path.join(self.tempdir, name, "Murphy-20150809T135508Z")
+        os.makedirs(deployment_dir)
+        nc_path = shutil.copy(STATIC_FILES["murphy"], deployment_dir)
+        with Dataset(nc_path, "r+") as nc:
+            nc.variables["salinity"][2:4] += salinity_offset
+            glider_qc.run_qc(config, nc, nc_path)
+        with Dataset(nc_path) as nc:
+            flags = {
+                name: nc.variables[f"qartod_{name}_consistency_flag"][:].tolist()
+                for name in ("salinity", "density")
+                if f"qartod_{name}_consistency_flag" in nc.variables
+            }
+            return flags, nc.dac_qc_comment
+
+    def test_run_qc(self):
+        flags, comment = self.run_qc("pass", self.config)
+        assert flags == {"salinity": [1] * 8, "density": [1] * 8}
+        assert "inconsistent" not in comment
+
+        # the derived density does not depend on the submitted salinity
+        flags, comment = self.run_qc("suspect", self.config, 0.1)
+        assert flags == {"salinity": [1, 1, 3, 3, 1, 1, 1, 1], "density": [1] * 8}
+        assert (
+            "salinity is inconsistent with temperature, conductivity and pressure at 2 samples"
+            in comment
+        )
+
+        # files QC'ed in chunks are flagged the same
+        config = dict(self.config, streaming={"min_samples": 1, "chunk_size": 3})
+        assert self.run_qc("chunked", config, 0.1)[0] == flags
+
+        config = dict(self.config, consistency={"enabled": False})
+        assert self.run_qc("disabled", config)[0] == {}
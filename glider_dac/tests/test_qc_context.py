@@ -0,0 +1,117 @@
+#!/usr/bin/env python
+"""
+tests/test_qc_context.py
+"""
+
+from glider_qc.context import CONTEXT_FILE, ContextWindow, context_lock
+from glider_qc import glider_qc
+from glider_qc.glider_qc import run_qc
+from unittest import TestCase, mock
+from netCDF4 import Dataset
+from glider_dac.tests.resources import STATIC_FILES
+import importlib
+import os
+import shutil
+import tempfile
+import fakeredis
+import numpy as np
+
+
+class TestContextWindow(TestCase):
+    qc_module = importlib.import_module(run_qc.__module__)
+    qc_conf_loc = os.path.join(os.path.dirname(qc_module.__file__), "qc_config.yml")
+
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tempdir)
+        self.config = glider_qc.GliderQC(None, self.qc_conf_loc).config
+        self.config.update(context_window=5000)
+
+    def test_save_and_load(self):
+        assert len(ContextWindow.load(self.tempdir)) == 0
+
+        seconds = np.arange(0.0, 100.0, 10.0)
+        context = ContextWindow.trailing(
+            seconds, {"temperature": seconds / 10, "salinity": -seconds}, 30
+        )
+        np.testing.assert_equal(context.seconds, [60, 70, 80, 90])
+        context.save(self.tempdir)
+        assert os.listdir(self.tempdir) == [CONTEXT_FILE]
+
+        loaded = ContextWindow.load(self.tempdir)
+        np.testing.assert_equal(loaded.seconds, context.seconds)
+        np.testing.assert_equal(loaded.row("temperature"), [6, 7, 8, 9])
+        np.testing.assert_equal(loaded.row("conductivity"), [np.nan] * 4)
+
+    def test_preceding(self):
+        context = ContextWindow(np.array([60.0, 70.0, 80.0, 90.0]), {"x": np.arange(4.0)})
+        preceding = context.preceding(np.array([100.0, 110.0]), 25)
+        np.testing.assert_equal(preceding.seconds, [80, 90])
+        np.testing.assert_equal(preceding.row("x"), [2, 3])
+        # files older than the context do not get any
+        assert len(context.preceding(np.array([85.0, 95.0]), 25)) == 0
+        assert len(context.preceding(np.array([200.0]), 25)) == 0
+
+    def test_run_qc_with_previous_file(self):
+        deployment_dir = os.path.join(self.tempdir, "Murphy-20150809T135508Z")
+        os.makedirs(deployment_dir)
+        paths = [
+            shutil.copy(STATIC_FILES["murphy"], os.path.join(deployment_dir, name))
+            for name in ("a.nc", "b.nc")
+        ]
+        # b.nc continues the decreasing temperatures of a.nc right after it
+        with Dataset(paths[1], "r+") as ncfile:
+            ncfile.variables["time"][:] += 80
+            ncfile.variables["temperature"][:] -= 0.15
+
+        spike_flags = []
+        for path in paths + paths[:1]:
+            with Dataset(path, "r+") as ncfile:
+                run_qc(self.config, ncfile, path)
+                spike_flags.append(ncfile.variables["qartod_temperature_spike_flag"][:])
+
+        # the first sample of a.nc has no preceding sample, the one of b.nc
+        # is tested against the end of a.nc.  Running a.nc again does not
+        # use the more recent context of b.nc.
+        assert spike_flags[0][0] == 2
+        assert spike_flags[1][0] == 1
+        np.testing.assert_equal(spike_flags[2], spike_flags[0])
+        assert len(spike_flags[1]) == 8
+
+        context = ContextWindow.load(deployment_dir)
+        assert len(context) == 16
+        with Dataset(STATIC_FILES["murphy"]) as ncfile:
+            temperature = ncfile.variables["temperature"][:]
+        np.testing.assert_almost_equal(
+            context.row("temperature"),
+            np.concatenate([temperature, temperature - 0.15]),
+        )
+
+    def test_context_lock(self):
+        rc = fakeredis.FakeRedis()
+        deployment_dir = os.path.join(self.tempdir, "Murphy-20150809T135508Z")
+        os.makedirs(deployment_dir)
+        path = shutil.copy(STATIC_FILES["murphy"], os.path.join(deployment_dir, "a.nc"))
+        key = f"gliderdac:qc_context:{deployment_dir}"
+
+        with context_lock(rc, deployment_dir, 0) as usable:
+            assert usable
+            assert not rc.exists(key)
+
+        # another job of the deployment holds the lock: the file is QC'ed
+        # without context and does not replace it
+        other = rc.lock(key)
+        other.acquire()
+        with mock.patch("glider_qc.glider_qc.get_redis_connection", return_value=rc), \
+                mock.patch("glider_qc.context.CONTEXT_LOCK_WAIT", 0.1):
+            with Dataset(path, "r+") as ncfile:
+                run_qc(self.config, ncfile, path)
+                assert "locked by another job" in ncfile.dac_qc_comment
+        assert not os.path.exists(os.path.join(deployment_dir, CONTEXT_FILE))
+
+        other.release()
+        with mock.patch("glider_qc.glider_qc.get_redis_connection", return_value=rc):
+            with Dataset(path, "r+") as ncfile:
+                run_qc(self.config, ncfile, path)
+        assert len(ContextWindow.load(deployment_dir)) == 8
+        assert not rc.exists(key)
@@ -0,0 +1,225 @@
+#!/usr/bin/env python
+"""
+tests/test_qc_engine.py
+"""
+
+from glider_qc.glider_qc import GliderQC, run_qc
+from glider_qc import engine
+from ioos_qc.qartod import qartod_compare
+from unittest import TestCase, mock
+from netCDF4 import Dataset
+import importlib
+from glider_dac.tests.resources import STATIC_FILES
+import os
+import shutil
+import tempfile
+import numpy as np
+import pandas as pd
+
+
+class TestQCEngine(TestCase):
+    qc_module = importlib.import_module(GliderQC.__module__)
+    qc_conf_loc = os.path.join(os.path.dirname(qc_module.__file__), "qc_config.yml")
+
+    def assert_same_results(self, expected, results):
+        assert list(expected.columns) == list(results)
+        for column in expected.columns:
+            np.testing.assert_equal(np.asarray(results[column]), expected[column].values)
+
+    def test_matches_ioos_qc_streams(self):
+        ncfile = Dataset(STATIC_FILES["murphy"], "r")
+        self.addCleanup(ncfile.close)
+        qc = GliderQC(ncfile, self.qc_conf_loc)
+
+        times = ncfile.variables["time"][:].astype("datetime64[s]")
+        varnames, _ = qc.find_geophysical_variables()
+        for varname in varnames:
+            values = np.ma.filled(ncfile.variables[varname][:], np.nan)
+            varspec = qc.config["contexts"][0]["streams"][varname]["qartod"]
+            configset, _ = qc.update_config(varspec, varname, times, values, None)
+
+            df = pd.DataFrame({"time": times, varname: values})
+            expected = qc.apply_qc(df, varname, configset, ncfile_path=None)
+            results = qc.apply_qc_arrays(times, values, varname, configset)
+            self.assert_same_results(expected, results)
+
+    def test_matches_ioos_qc_missing_values(self):
+        qc = GliderQC(None, self.qc_conf_loc)
+        varspec = qc.config["contexts"][0]["streams"]["temperature"]["qartod"]
+        configset = {"contexts": [{"streams": {"temp": {"qartod": varspec}}}]}
+
+        times = np.arange(
+            "2015-01-01 00:00:00",
+            "2015-01-01 03:30:00",
+            step=np.timedelta64(21, "m"),
+            dtype="datetime64[s]",
+        )
+        values = np.array(
+            [21.7, 22.2, 22.2, 22.2, 22.2, np.nan, 22.2, 22.2, 23.3, np.nan]
+        )
+
+        df = pd.DataFrame({"time": times, "temp": values})
+        expected = qc.apply_qc(df, "temp", configset, ncfile_path=None)
+        results = qc.apply_qc_arrays(times, values, "temp", configset)
+        self.assert_same_results(expected, results)
+
+    def test_rollup_matches_qartod_compare(self):
+        rng = np.random.default_rng(0)
+        flags = [
+            rng.choice(np.array([1, 2, 3, 4, 9], dtype=np.uint8), 500)
+            for _ in range(4)
+        ]
+        np.testing.assert_equal(engine.rollup(flags), qartod_compare(flags))
+
+    def test_failed_test_is_skipped(self):
+        varspec = {
+            # suspect span outside of the fail span makes ioos_qc raise
+            "gross_range_test": {"suspect_span": [0, 50], "fail_span": [0, 40]},
+            "rate_of_change_test": {"threshold": 0.1},
+        }
+        times = np.arange(5).astype("datetime64[s]")
+        results = engine.run_qartod("temp", np.arange(5.0), times, varspec)
+        assert list(results) == ["temp_qartod_rate_of_change_test", "qartod_rollup_qc"]
+
+    def test_threshold_statistics(self):
+        ncfile = Dataset(STATIC_FILES["murphy"], "r")
+        self.addCleanup(ncfile.close)
+        qc = GliderQC(ncfile, self.qc_conf_loc)
+
+        times = ncfile.variables["time"][:].astype("datetime64[s]")
+        temperature = np.ma.filled(ncfile.variables["temperature"][:], np.nan)
+        salinity = np.ma.filled(ncfile.variables["salinity"][:], np.nan)
+        salinity[3] = np.nan
+        stats = qc.threshold_statistics(
+            np.vstack([temperature[1:-1], salinity[1:-1]]), times
+        )
+
+        np.testing.assert_equal(stats.count, [6, 5])
+        np.testing.assert_almost_equal(stats.std[0], 0.02796877229102898)
+        np.testing.assert_almost_equal(
+            qc.get_rate_of_change_threshold(temperature[1:-1], times)[0],
+            stats.max_rate[0],
+        )
+        np.testing.assert_almost_equal(stats.max_rate[0], 0.002418171275745416)
+        # rows are independent of each other
+        single = qc.threshold_statistics(salinity[1:-1], times).variable(0)
+        np.testing.assert_almost_equal(single.max_rate, stats.max_rate[1])
+        np.testing.assert_equal(single.in_band, stats.in_band[1])
+
+    def test_block_is_not_copied(self):
+        block = np.arange(6, dtype=np.float64).reshape(2, 3)
+        assert engine._as_block(block) is block
+        assert np.shares_memory(engine._as_block(block[0]), block)
+        masked = engine._as_block(np.ma.masked_array([1, 2, 3], mask=[0, 1, 0]))
+        np.testing.assert_equal(masked, [[1.0, np.nan, 3.0]])
+
+    def test_threshold_statistics_not_enough_data(self):
+        qc = GliderQC(None, self.qc_conf_loc)
+        times = np.arange(4).astype("datetime64[s]")
+
+        values = np.array([np.nan, 1.0, np.nan, np.nan])
+        suspect, fail, note = qc.get_spike_thresholds(values)
+        assert suspect is None and fail is None
+        assert note == "Not enough valid data for std calculation."
+        threshold, note = qc.get_rate_of_change_threshold(values, times)
+        assert threshold is None
+        assert note == "Not enough valid data points for std and mean calculations."
+
+        # a constant signal has no values strictly within one std of the mean
+        threshold, note = qc.get_rate_of_change_threshold(np.ones(4), times)
+        assert threshold is None
+        assert note.startswith("Insufficient data")
+
+    def test_run_qc_engines_write_same_flags(self):
+        tempdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tempdir)
+        flags = {}
+        for qc_engine in ("ioos_qc", "numpy"):
+            deployment_dir = os.path.join(tempdir, qc_engine, "Murphy-20150809T135508Z")
+            os.makedirs(deployment_dir)
+            path = shutil.copy(STATIC_FILES["murphy"], deployment_dir)
+            with mock.patch.dict(os.environ, {"GLIDER_QC_ENGINE": qc_engine}):
+                with Dataset(path, "r+") as ncfile:
+                    run_qc(self.qc_conf_loc, ncfile, path)
+                    flags[qc_engine] = {
+                        name: ncfile.variables[name][:]
+                        for name in ncfile.variables
+                        if name.startswith("qartod_")
+                    }
+
+        assert len(flags["numpy"]) == 26
+        assert flags["numpy"].keys() == flags["ioos_qc"].keys()
+        for name, expected in flags["ioos_qc"].items():
+            np.testing.assert_equal(flags["numpy"][name], expected)
+
+    def single_pass_flags(self, masks=None):
+        """
+        Returns the flags written with single_pass off and on, after masking
+        the given indices of each variable of a copy of the murphy file
+        """
+        tempdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tempdir)
+        config = GliderQC(None, self.qc_conf_loc).config
+        config.update(context_window=0, threshold_statistics="file")
+        flags = {}
+        for single_pass in (False, True):
+            deployment_dir = os.path.join(tempdir, str(single_pass), "Murphy-20150809T135508Z")
+            os.makedirs(deployment_dir)
+            path = shutil.copy(STATIC_FILES["murphy"], deployment_dir)
+            with mock.patch.object(
+                GliderQC, "apply_qc", autospec=True, side_effect=GliderQC.apply_qc
+            ) as apply_qc:
+                with Dataset(path, "r+") as ncfile:
+                    for var_name, indices in (masks or {}).items():
+                        ncfile.variables[var_name][indices] = np.ma.masked
+                    run_qc(dict(config, single_pass=single_pass), ncfile, path)
+                    flags[single_pass] = {
+                        name: (ncfile.variables[name][:], ncfile.variables[name].__dict__)
+                        for name in ncfile.variables
+                        if name.startswith("qartod_")
+                    }
+            # one stream evaluation instead of one per variable
+            assert apply_qc.call_count == (0 if single_pass else 5)
+        return flags
+
+    def assert_same_flags(self, flags):
+        assert len(flags[True]) == 26
+        assert flags[True].keys() == flags[False].keys()
+        for name, (expected, attributes) in flags[False].items():
+            np.testing.assert_equal(flags[True][name][0], expected)
+            np.testing.assert_equal(flags[True][name][1], attributes)
+
+    def test_single_pass_writes_same_flags(self):
+        self.assert_same_flags(self.single_pass_flags())
+
+    def test_single_pass_writes_same_flags_with_masks_per_variable(self):
+        # each variable misses different samples of the shared time index
+        flags = self.single_pass_flags(
+            {
+                "temperature": [0, 3],
+                "salinity": [1],
+                "pressure": [5, 6],
+                "conductivity": [2, 7],
+            }
+        )
+        self.assert_same_flags(flags)
+        # the masked samples are flagged MISSING in their own variable only
+        missing = {
+            var_name: np.flatnonzero(flags[True][f"qartod_{var_name}_primary_flag"][0] == 9)
+            for var_name in ("temperature", "salinity")
+        }
+        assert missing["temperature"].tolist() == [0, 3]
+        assert missing["salinity"].tolist() == [1]
+
+    def test_single_pass_failure_runs_variables_one_at_a_time(self):
+        ncfile = Dataset(STATIC_FILES["murphy"], "r")
+        self.addCleanup(ncfile.close)
+        qc = GliderQC(ncfile, self.qc_conf_loc)
+        times = ncfile.variables["time"][:].astype("datetime64[s]")
+        values = np.ma.filled(ncfile.variables["temperature"][:], np.nan)
+        varspec = qc.config["contexts"][0]["streams"]["temperature"]["qartod"]
+        configset, _ = qc.update_config(varspec, "temperature", times, values, None)
+        with mock.patch.object(self.qc_module, "PandasStream", side_effect=ValueError):
+            assert qc.apply_qc_combined(
+                times, {"temperature": values}, {"temperature": configset}, "murphy.nc"
+            ) == {}
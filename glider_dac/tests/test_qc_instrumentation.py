@@ -0,0 +1,79 @@
+#!/usr/bin/env python
+"""
+tests/test_qc_instrumentation.py
+"""
+
+from glider_qc import glider_qc, instrumentation
+from unittest import TestCase, mock
+from glider_dac.tests.resources import STATIC_FILES
+import fakeredis
+import os
+import shutil
+import tempfile
+
+
+class TestInstrumentation(TestCase):
+    qc_conf_loc = os.path.join(os.path.dirname(glider_qc.__file__), "qc_config.yml")
+
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tempdir)
+        deployment_dir = os.path.join(self.tempdir, "Murphy-20150809T135508Z")
+        os.makedirs(deployment_dir)
+        self.nc_path = shutil.copy(STATIC_FILES["murphy"], deployment_dir)
+        self.redis = fakeredis.FakeRedis()
+        patcher = mock.patch.object(glider_qc, "get_redis_connection", return_value=self.redis)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_job_record(self):
+        config = glider_qc.GliderQC(None, self.qc_conf_loc).config
+        config.update(
+            context_window=0,
+            threshold_statistics="file",
+            instrumentation={"redis_stream": True},
+            result_cache={"enabled": True},
+        )
+        with mock.patch("os.getxattr", side_effect=OSError), mock.patch("os.setxattr"):
+            with self.assertLogs(instrumentation.log, "INFO") as logs:
+                glider_qc.qc_locked_file(self.nc_path, config)
+                # the same data is QC'ed again from the result cache
+                glider_qc.qc_locked_file(self.nc_path, config)
+
+        records = instrumentation.read_stream(self.redis)
+        assert instrumentation.read_log(logs.output) == records
+        assert len(records) == 2
+        record, cached = records
+        assert record["deployment"] == "Murphy-20150809T135508Z"
+        assert record["outcome"] == "done" and not record["cached"]
+        assert {
+            "check_time", "check_location", "read", "normalize_variable",
+            "statistics", "update_config", "apply_qc", "write", "cache",
+        } <= record["stages"].keys()
+        assert record["variables"]["temperature"] == {"samples": 8, "bytes_read": 64}
+        assert record["bytes_read"] == 5 * 64
+        # 25 flag variables of 8 samples and the scalar location flag
+        assert record["bytes_written"] == 25 * 8 + 1
+        assert cached["cached"] and "apply_qc" not in cached["stages"]
+        assert cached["bytes_written"] == record["bytes_written"]
+
+    def test_stage_latencies(self):
+        records = [
+            {"deployment": "a", "total": float(i), "stages": {"apply_qc": i / 10}}
+            for i in range(1, 101)
+        ]
+        records.append({"deployment": "b", "total": 2.0, "stages": {}})
+        latencies = instrumentation.stage_latencies(records)
+        assert latencies["a"]["total"] == {"jobs": 100, "p50": 50.5, "p95": 95.05}
+        assert latencies["a"]["apply_qc"]["jobs"] == 100
+        assert latencies["b"] == {"total": {"jobs": 1, "p50": 2.0, "p95": 2.0}}
+
+        # records in a log file, among other messages
+        lines = ["INFO Running IOOS QARTOD tests\n"]
+        lines += [
+            f"INFO {instrumentation.RECORD_MARKER} {{\"deployment\": \"b\", \"total\": {t}}}\n"
+            for t in (1.0, 3.0)
+        ]
+        assert instrumentation.stage_latencies(instrumentation.read_log(lines)) == {
+            "b": {"total": {"jobs": 2, "p50": 2.0, "p95": 2.9}}
+        }
@@ -0,0 +1,77 @@
+#!/usr/bin/env python
+"""
+tests/test_qc_location.py
+"""
+
+from glider_qc import location
+from glider_qc.glider_qc import GliderQC
+from unittest import TestCase
+from glider_dac.tests.resources import STATIC_FILES
+from netCDF4 import Dataset
+import numpy as np
+import os
+import shutil
+import tempfile
+
+
+class TestLocation(TestCase):
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tempdir)
+
+    def test_haversine_miles(self):
+        # one degree of latitude
+        np.testing.assert_allclose(
+            location.haversine_miles(10.0, 20.0, 11.0, 20.0), location.MILES_PER_DEG_LAT
+        )
+        # across the antimeridian
+        np.testing.assert_allclose(
+            location.haversine_miles(0.0, 179.99, 0.0, -179.99),
+            0.02 * location.MILES_PER_DEG_LAT,
+        )
+
+    def test_location_flags(self):
+        deg = 1.0 / location.MILES_PER_DEG_LAT
+        profile_lat = np.ma.array(
+            [27.0 + deg, 27.0 + 3 * deg, np.nan, 27.0, 27.0], mask=[0, 0, 0, 1, 0]
+        )
+        profile_lon = np.array([-89.0, -89.0, -89.0, -89.0, -89.0])
+        flags = location.location_flags(profile_lat, profile_lon, 27.0, -89.0)
+        assert flags.dtype == np.int8
+        assert flags.tolist() == [1, 4, 9, 9, 1]
+        # an undefined track center fails
+        assert location.location_flags(profile_lat, profile_lon, np.nan, -89.0).tolist() == [
+            4, 4, 9, 9, 4
+        ]
+
+    def copy(self, name, profile_lat=None):
+        path = shutil.copy(STATIC_FILES["murphy"], os.path.join(self.tempdir, name))
+        if profile_lat is not None:
+            with Dataset(path, "r+") as nc:
+                nc.variables["profile_lat"][...] = profile_lat
+        return path
+
+    def test_deployment_location_flags(self):
+        paths = [
+            self.copy("pass.nc"),
+            self.copy("fail.nc", 27.2),
+            self.copy("missing.nc", np.ma.masked),
+        ]
+        flags = location.deployment_location_flags(paths)
+        assert {os.path.basename(p): f.tolist() for p, f in flags.items()} == {
+            "pass.nc": [1],
+            "fail.nc": [4],
+            "missing.nc": [9],
+        }
+
+        # same flags as the per-file test
+        for path in paths:
+            with Dataset(path, "r+") as nc:
+                report = GliderQC(nc, None).check_location()
+                assert nc.variables["qartod_location_test_flag"][...] == flags[path][0]
+                if "fail" in path:
+                    assert report == "error in glider track lat/lon"
+                elif "missing" in path:
+                    assert report.endswith("are missing")
+                else:
+                    assert report == ""
@@ -0,0 +1,110 @@
+#!/usr/bin/env python
+"""
+tests/test_qc_queues.py
+"""
+
+from glider_qc import glider_qc, queues
+from unittest import TestCase
+import fakeredis
+
+
+class TestQCQueues(TestCase):
+    def setUp(self):
+        self.connection = fakeredis.FakeStrictRedis()
+        self.realtime = queues.get_qc_queue(False, connection=self.connection)
+        self.delayed = queues.get_qc_queue(True, connection=self.connection)
+
+    def test_is_delayed_mode(self):
+        assert queues.is_delayed_mode("/data/user/Murphy-20150809T135508Z-delayed")
+        assert queues.is_delayed_mode("/data/user/Murphy-20150809T135508Z-delayed/")
+        assert not queues.is_delayed_mode("/data/user/Murphy-20150809T135508Z")
+        assert self.realtime.name == queues.QC_REALTIME_QUEUE
+        assert self.delayed.name == queues.QC_DELAYED_QUEUE
+
+    def dequeue_order(self, worker, count):
+        order = []
+        for _ in range(count):
+            job, queue = worker.dequeue_job_and_maintain_ttl(timeout=None)
+            order.append(queue.name)
+        return order
+
+    def test_realtime_jobs_pass_delayed_backlog(self):
+        for i in range(50):
+            self.delayed.enqueue(print, f"delayed {i}")
+        for i in range(8):
+            self.realtime.enqueue(print, f"realtime {i}")
+
+        worker = queues.QCWorker(
+            [self.realtime, self.delayed], connection=self.connection, delayed_share=4
+        )
+        order = self.dequeue_order(worker, 12)
+        # one delayed mode job after every 4 realtime jobs
+        assert order == ([queues.QC_REALTIME_QUEUE] * 4 + [queues.QC_DELAYED_QUEUE]) * 2 + [
+            queues.QC_DELAYED_QUEUE
+        ] * 2
+
+        # the wait of every job was recorded
+        metrics = queues.queue_metrics(self.connection)
+        assert metrics[queues.QC_REALTIME_QUEUE]["jobs"] == 8
+        assert metrics[queues.QC_REALTIME_QUEUE]["depth"] == 0
+        assert metrics[queues.QC_DELAYED_QUEUE]["jobs"] == 4
+        assert metrics[queues.QC_DELAYED_QUEUE]["depth"] == 46
+        assert metrics[queues.QC_DELAYED_QUEUE]["max_wait"] >= 0
+
+    def test_strict_priority(self):
+        for i in range(3):
+            self.delayed.enqueue(print, f"delayed {i}")
+            self.realtime.enqueue(print, f"realtime {i}")
+        worker = queues.QCWorker(
+            [self.realtime, self.delayed], connection=self.connection, delayed_share=0
+        )
+        assert self.dequeue_order(worker, 6) == (
+            [queues.QC_REALTIME_QUEUE] * 3 + [queues.QC_DELAYED_QUEUE] * 3
+        )
+
+    def test_queue_metrics(self):
+        for wait in (3.0, 1.0, 2.0):
+            queues.record_wait(self.connection, queues.QC_REALTIME_QUEUE, wait)
+        metrics = queues.queue_metrics(self.connection)
+        assert metrics[queues.QC_REALTIME_QUEUE]["jobs"] == 3
+        assert metrics[queues.QC_REALTIME_QUEUE]["mean_wait"] == 2.0
+        assert metrics[queues.QC_REALTIME_QUEUE]["max_wait"] == 3.0
+        assert metrics[queues.QC_DELAYED_QUEUE]["mean_wait"] is None
+
+    def test_realtime_wait_is_bounded_in_files(self):
+        # a delayed mode deployment of 30 files is queued before realtime
+        # files arrive
+        delayed_dir = "/data/user/Murphy-20150809T135508Z-delayed"
+        glider_qc.enqueue_qc_batches(
+            self.delayed,
+            [f"{delayed_dir}/{i:03d}.nc" for i in range(30)],
+            "qc_config.yml",
+            batch_size=queues.batch_size(True),
+        )
+        realtime_dir = "/data/user/Murphy-20150809T135508Z"
+        for i in range(12):
+            glider_qc.enqueue_qc_batches(
+                self.realtime,
+                [f"{realtime_dir}/{i:03d}.nc"],
+                "qc_config.yml",
+                batch_size=queues.batch_size(False),
+            )
+
+        share = 4
+        worker = queues.QCWorker(
+            [self.realtime, self.delayed], connection=self.connection, delayed_share=share
+        )
+        delayed_files = []
+        waits = []
+        while len(waits) < 12:
+            job, queue = worker.dequeue_job_and_maintain_ttl(timeout=None)
+            deployment_dir, file_names, _ = job.args
+            if queue.name == queues.QC_DELAYED_QUEUE:
+                delayed_files.append(len(file_names))
+            else:
+                waits.append(sum(delayed_files))
+        # the n-th realtime job waits for at most one delayed mode job, of
+        # QC_DELAYED_BATCH_SIZE files, per share realtime jobs before it
+        for n, wait in enumerate(waits):
+            assert wait <= (n // share) * queues.QC_DELAYED_BATCH_SIZE
+        assert max(delayed_files) == queues.QC_DELAYED_BATCH_SIZE == 1
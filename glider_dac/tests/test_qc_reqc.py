@@ -0,0 +1,119 @@
+#!/usr/bin/env python
+"""
+tests/test_qc_reqc.py
+"""
+
+from glider_qc import glider_qc, reqc
+from unittest import TestCase, mock
+from glider_dac.tests.resources import STATIC_FILES
+from netCDF4 import Dataset
+import copy
+import fakeredis
+import json
+import os
+import shutil
+import tempfile
+
+
+class TestReQC(TestCase):
+    qc_conf_loc = os.path.join(os.path.dirname(glider_qc.__file__), "qc_config.yml")
+
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tempdir)
+        self.config = glider_qc.GliderQC(None, self.qc_conf_loc).config
+        self.config.update(context_window=0, threshold_statistics="file")
+        patcher = mock.patch.object(
+            glider_qc, "get_redis_connection", return_value=fakeredis.FakeRedis()
+        )
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def qc_file(self, name, config):
+        deployment_dir = os.path.join(self.tempdir, name, "Murphy-20150809T135508Z")
+        os.makedirs(deployment_dir)
+        nc_path = shutil.copy(STATIC_FILES["murphy"], deployment_dir)
+        with Dataset(nc_path, "r+") as nc:
+            glider_qc.run_qc(config, nc, nc_path)
+        return nc_path
+
+    def read_flags(self, nc_path):
+        with Dataset(nc_path) as nc:
+            return {
+                name: (
+                    nc.variables[name][:].tolist(),
+                    json.loads(getattr(nc.variables[name], "qartod_config", "null")),
+                )
+                for name in nc.variables
+                if name.startswith("qartod_")
+            }
+
+    def new_config(self):
+        config = copy.deepcopy(self.config)
+        streams = config["contexts"][0]["streams"]
+        streams["salinity"]["qartod"]["gross_range_test"] = {
+            "suspect_span": [36.378, 38], "fail_span": [0, 42]
+        }
+        del streams["temperature"]["qartod"]["flat_line_test"]
+        # the spike thresholds are derived from the data, changing them in the
+        # configuration has no effect
+        streams["pressure"]["qartod"]["spike_test"]["suspect_threshold"] = 1
+        return config
+
+    def write_config(self, config):
+        path = os.path.join(self.tempdir, "qc_config.yml")
+        with open(path, "w") as f:
+            json.dump(config, f)
+        return path
+
+    def test_affected_tests(self):
+        nc_path = self.qc_file("old", self.config)
+        assert reqc.plan_file(nc_path, self.config) == {}
+        assert reqc.plan_file(nc_path, self.new_config()) == {
+            "salinity": ["gross_range_test"],
+            "temperature": ["flat_line_test"],
+        }
+
+    def test_requalify(self):
+        new_config = self.new_config()
+        expected = self.read_flags(self.qc_file("new", new_config))
+        nc_path = self.qc_file("old", self.config)
+        before = self.read_flags(nc_path)
+
+        with Dataset(nc_path, "r+") as nc:
+            reqc.requalify(nc, new_config, reqc.affected_tests(nc, new_config))
+        after = self.read_flags(nc_path)
+        changed = {name for name in after if after[name] != before[name]}
+        assert changed == {
+            "qartod_salinity_gross_range_flag",
+            "qartod_salinity_primary_flag",
+            "qartod_temperature_flat_line_flag",
+            "qartod_temperature_primary_flag",
+        }
+        # the flags and configurations of a full QC with the new configuration
+        assert after == expected
+        assert reqc.plan_file(nc_path, new_config) == {}
+
+    def test_resume(self):
+        nc_paths = [self.qc_file(name, self.config) for name in ("a", "b")]
+        config_path = self.write_config(self.new_config())
+        checkpoint_path = os.path.join(self.tempdir, "reqc.sqlite")
+        checkpoint = reqc.ReQCCheckpoint(checkpoint_path)
+
+        planned = reqc.plan_archive(nc_paths, config_path, checkpoint)
+        assert [path for path, _ in planned] == nc_paths
+        queue = mock.Mock()
+        reqc.enqueue_reqc(queue, planned[:1], config_path, checkpoint_path)
+        queue.enqueue.assert_called_once_with(
+            reqc.reqc_task, nc_paths[0], config_path, planned[0][1], checkpoint_path
+        )
+        # interrupted after the first file was enqueued, the files are not
+        # planned again and only the second one is left to enqueue
+        with mock.patch.object(reqc, "plan_file") as plan_file:
+            assert reqc.plan_archive(nc_paths, config_path, checkpoint) == planned[1:]
+            plan_file.assert_not_called()
+
+        for nc_path, tests in planned:
+            assert reqc.reqc_task(nc_path, config_path, tests, checkpoint_path) == tests
+        assert reqc.plan_archive(nc_paths, config_path, checkpoint) == []
+        assert checkpoint.counts(glider_qc.status_index.config_hash(config_path)) == {"done": 2}
@@ -0,0 +1,152 @@
+#!/usr/bin/env python
+"""
+tests/test_qc_result_cache.py
+"""
+
+from glider_qc import glider_qc
+from glider_qc.result_cache import QCResultCache, content_digest, dumps, loads
+from glider_qc.write_plan import apply_flags, collect_flags
+from unittest import TestCase, mock
+from glider_dac.tests.resources import STATIC_FILES
+from netCDF4 import Dataset
+import fakeredis
+import numpy as np
+import os
+import shutil
+import tempfile
+
+
+class TestQCResultCache(TestCase):
+    qc_conf_loc = os.path.join(os.path.dirname(glider_qc.__file__), "qc_config.yml")
+
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tempdir)
+        self.deployment_dir = os.path.join(self.tempdir, "Murphy-20150809T135508Z")
+        os.makedirs(self.deployment_dir)
+        self.nc_path = os.path.join(self.deployment_dir, "Murphy-20150809T135508Z_rt.nc")
+        self.connection = fakeredis.FakeRedis()
+        self.config = glider_qc.GliderQC(None, self.qc_conf_loc).config
+        # no deployment context or statistics, so that every run is alike
+        self.config.update(
+            context_window=0, threshold_statistics="file", result_cache={"enabled": True}
+        )
+
+    def upload(self):
+        shutil.copy(STATIC_FILES["murphy"], self.nc_path)
+
+    def qc(self):
+        with Dataset(self.nc_path, "r+") as nc:
+            return glider_qc.run_cached_qc(self.config, nc, self.nc_path)
+
+    def read_flags(self):
+        with Dataset(self.nc_path) as nc:
+            flags = {
+                name: nc.variables[name][:].tolist()
+                for name in nc.variables
+                if name.startswith("qartod_")
+            }
+            return flags, nc.dac_qc_comment, nc.variables["temperature"].ancillary_variables
+
+    def test_content_digest(self):
+        self.upload()
+        with Dataset(self.nc_path, "r+") as nc:
+            digest = content_digest(nc, self.nc_path)
+            assert digest == content_digest(nc, self.nc_path)
+            assert digest != content_digest(nc, os.path.join(self.tempdir, "other.nc"))
+            # attributes and flags do not change the digest
+            nc.variables["temperature"].comment = "changed"
+            nc.createVariable("qartod_temperature_spike_flag", np.int8, ("time",))
+            assert digest == content_digest(nc, self.nc_path)
+            nc.variables["temperature"][0] = 12.0
+            assert digest != content_digest(nc, self.nc_path)
+            # variables are hashed a block at a time
+            with mock.patch("glider_qc.result_cache.DIGEST_BLOCK", 3):
+                assert content_digest(nc, self.nc_path) == content_digest(nc, self.nc_path)
+
+    def test_reupload_uses_cached_flags(self):
+        with mock.patch.object(glider_qc, "get_redis_connection", return_value=self.connection):
+            self.upload()
+            assert self.qc() is False
+            expected = self.read_flags()
+            assert len(expected[0]) == 26
+
+            # the same data uploaded again is not QC'ed again
+            self.upload()
+            with mock.patch.object(glider_qc, "run_qc", side_effect=AssertionError):
+                assert self.qc() is True
+            assert self.read_flags() == expected
+
+            # a different configuration runs QC
+            self.upload()
+            self.config["contexts"][0]["streams"]["temperature"]["qartod"]["gross_range_test"][
+                "fail_span"
+            ] = [30.1, 40]
+            assert self.qc() is False
+            flags, _, _ = self.read_flags()
+            assert flags["qartod_temperature_gross_range_flag"] != expected[0][
+                "qartod_temperature_gross_range_flag"
+            ]
+
+    def test_no_redis(self):
+        connection = mock.Mock()
+        connection.get.side_effect = glider_qc.redis.ConnectionError
+        with mock.patch.object(glider_qc, "get_redis_connection", return_value=connection):
+            self.upload()
+            assert self.qc() is False
+        connection.set.assert_not_called()
+        assert len(self.read_flags()[0]) == 26
+
+    def test_apply_creates_variables(self):
+        self.upload()
+        cache = QCResultCache(self.connection, "digest", self.config)
+        assert cache.get() is None
+        with Dataset(self.nc_path, "r+") as nc:
+            glider_qc.run_qc(self.config, nc, self.nc_path)
+            cache.store(nc)
+        expected = self.read_flags()
+
+        self.upload()
+        with Dataset(self.nc_path, "r+") as nc:
+            apply_flags(nc, cache.get())
+        assert self.read_flags() == expected
+
+    def test_serialization(self):
+        self.upload()
+        with Dataset(self.nc_path, "r+") as nc:
+            glider_qc.run_qc(self.config, nc, self.nc_path)
+            flags = collect_flags(nc)
+        blob = dumps(flags)
+        loaded = loads(blob)
+        assert loaded["comment"] == flags["comment"]
+        for expected, actual in zip(flags["variables"], loaded["variables"]):
+            assert actual[:2] == expected[:2] and actual[3] == expected[3]
+            assert actual[2].keys() == expected[2].keys()
+            for name, value in expected[2].items():
+                np.testing.assert_equal(actual[2][name], value)
+            np.testing.assert_equal(actual[4], expected[4])
+            assert actual[4].dtype == expected[4].dtype
+
+        # results over max_bytes are not stored, unreadable entries ignored
+        cache = QCResultCache(self.connection, "digest", self.config, max_bytes=len(blob) - 1)
+        with Dataset(self.nc_path) as nc:
+            assert not cache.store(nc)
+        assert cache.get() is None
+        self.connection.set(cache.key, b"not an npz")
+        assert cache.get() is None
+
+    def test_bypassed(self):
+        self.upload()
+        with mock.patch.object(glider_qc, "get_redis_connection", return_value=self.connection), \
+                mock.patch("glider_qc.result_cache.content_digest", side_effect=AssertionError):
+            # results depending on the previous files of the deployment, or
+            # a disabled cache, are neither looked up nor stored
+            for settings in (
+                {"threshold_statistics": "deployment"},
+                {"context_window": 5000},
+                {"result_cache": {"enabled": False}},
+            ):
+                config = dict(self.config, **settings)
+                with Dataset(self.nc_path, "r+") as nc:
+                    assert glider_qc.run_cached_qc(config, nc, self.nc_path) is False
+        assert not list(self.connection.scan_iter("gliderdac:qc_cache:*"))
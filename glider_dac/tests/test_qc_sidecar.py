@@ -0,0 +1,110 @@
+#!/usr/bin/env python
+"""
+tests/test_qc_sidecar.py
+"""
+
+from glider_qc import glider_qc, sidecar
+from unittest import TestCase, mock
+from glider_dac.tests.resources import STATIC_FILES
+from netCDF4 import Dataset
+import fakeredis
+import hashlib
+import os
+import shutil
+import tempfile
+
+
+class TestQCSidecar(TestCase):
+    qc_conf_loc = os.path.join(os.path.dirname(glider_qc.__file__), "qc_config.yml")
+
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tempdir)
+        self.deployment_dir = os.path.join(self.tempdir, "Murphy-20150809T135508Z")
+        os.makedirs(self.deployment_dir)
+        self.nc_path = shutil.copy(STATIC_FILES["murphy"], self.deployment_dir)
+        self.config = glider_qc.GliderQC(None, self.qc_conf_loc).config
+        self.config.update(context_window=0, threshold_statistics="file")
+        patcher = mock.patch.object(
+            glider_qc, "get_redis_connection", return_value=fakeredis.FakeRedis()
+        )
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def md5(self):
+        with open(self.nc_path, "rb") as f:
+            return hashlib.md5(f.read()).hexdigest()
+
+    def in_place_flags(self):
+        in_place = os.path.join(self.tempdir, "in_place", "Murphy-20150809T135508Z")
+        os.makedirs(in_place)
+        nc_path = shutil.copy(STATIC_FILES["murphy"], in_place)
+        with Dataset(nc_path, "r+") as nc:
+            glider_qc.run_qc(self.config, nc, nc_path)
+        return self.read_flags(nc_path)
+
+    def read_flags(self, nc_path):
+        with Dataset(nc_path) as nc:
+            return (
+                {
+                    name: nc.variables[name][:].tolist()
+                    for name in nc.variables
+                    if name.startswith("qartod_")
+                },
+                {
+                    name: ncvariable.ancillary_variables
+                    for name, ncvariable in nc.variables.items()
+                    if "ancillary_variables" in ncvariable.ncattrs()
+                },
+            )
+
+    def test_sidecar_without_merge(self):
+        checksum = self.md5()
+        assert glider_qc.qc_sidecar(self.config, self.nc_path, merge=False)
+        # the provider file is only read
+        assert self.md5() == checksum
+        sidecar_path = sidecar.sidecar_path(self.nc_path)
+        assert os.path.basename(sidecar_path) == ".Murphy-20150809T135508Z_rt.nc.qc"
+        assert sorted(os.listdir(self.deployment_dir)) == [
+            os.path.basename(sidecar_path),
+            os.path.basename(self.nc_path),
+        ]
+
+        flags = sidecar.read_sidecar(sidecar_path)
+        assert len(flags["variables"]) == 26
+        assert flags["comment"].startswith("Murphy-20150809T135508Z (")
+        with mock.patch("os.getxattr", side_effect=OSError):
+            assert not glider_qc.check_needs_qc(self.nc_path)
+
+    def test_sidecar_merge(self):
+        config = dict(self.config, qc_output={"mode": "sidecar"})
+        os.chmod(self.nc_path, 0o640)
+        try:
+            os.setxattr(self.nc_path, "user.provider", b"glider")
+        except OSError:
+            self.skipTest("extended attributes are not supported")
+        inode = os.stat(self.nc_path).st_ino
+        assert glider_qc.qc_locked_file(self.nc_path, config)
+        # the file is replaced by the merged copy, which keeps the mode and
+        # the extended attributes of the file, and gets user.qc_run
+        assert os.stat(self.nc_path).st_ino != inode
+        assert os.stat(self.nc_path).st_mode & 0o777 == 0o640
+        assert os.getxattr(self.nc_path, "user.provider") == b"glider"
+        assert os.getxattr(self.nc_path, "user.qc_run") == b"true"
+        assert os.listdir(self.deployment_dir) == [os.path.basename(self.nc_path)]
+        flags, ancillary_variables = self.read_flags(self.nc_path)
+        assert (flags, ancillary_variables) == self.in_place_flags()
+        assert ancillary_variables["profile_lat"] == "qartod_location_test_flag"
+        assert ancillary_variables["profile_lon"] == "qartod_location_test_flag"
+
+    def test_merge_changed_source(self):
+        state = sidecar.file_state(self.nc_path)
+        assert glider_qc.qc_sidecar(self.config, self.nc_path, merge=False)
+        # the provider uploads the file again
+        with open(self.nc_path, "ab") as f:
+            f.write(b"\0")
+        checksum = self.md5()
+        with self.assertRaises(sidecar.SourceChangedError):
+            sidecar.merge_sidecar(self.nc_path, state)
+        assert self.md5() == checksum
+        assert not any(name.endswith(".tmp") for name in os.listdir(self.deployment_dir))
@@ -0,0 +1,95 @@
+#!/usr/bin/env python
+"""
+tests/test_qc_status_index.py
+"""
+
+from glider_qc import status_index
+from glider_qc.glider_qc import GliderQC, check_needs_qc, qc_locked_file
+from unittest import TestCase, mock
+from glider_dac.tests.resources import STATIC_FILES
+import fakeredis
+import importlib
+import os
+import shutil
+import sqlite3
+import tempfile
+
+
+class TestQCStatusIndex(TestCase):
+    qc_module = importlib.import_module(check_needs_qc.__module__)
+    qc_conf_loc = os.path.join(os.path.dirname(qc_module.__file__), "qc_config.yml")
+
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tempdir)
+        patcher = mock.patch.dict(os.environ, {"DATA_ROOT": self.tempdir})
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        deployment_dir = os.path.join(self.tempdir, "Murphy-20150809T135508Z")
+        os.makedirs(deployment_dir)
+        self.nc_path = shutil.copy(STATIC_FILES["murphy"], deployment_dir)
+
+    def test_record_and_lookup(self):
+        index = status_index.get_status_index()
+        assert index.path == os.path.join(self.tempdir, status_index.STATUS_INDEX_FILE)
+        assert index.lookup(self.nc_path) is None
+
+        index.record(self.nc_path, status_index.ERROR, "abc", "failed")
+        assert index.lookup(self.nc_path) == ("error", "abc", "failed")
+
+        # a modified file is not indexed anymore
+        with open(self.nc_path, "ab") as f:
+            f.write(b"\0")
+        assert index.lookup(self.nc_path) is None
+
+    def test_config_hash(self):
+        assert status_index.config_hash({"a": 1, "b": 2}) == status_index.config_hash({"b": 2, "a": 1})
+        assert status_index.config_hash({"a": 1}) != status_index.config_hash({"a": 2})
+        assert len(status_index.config_hash(self.qc_conf_loc)) == 40
+        # a configuration file and the dictionary loaded from it hash the same
+        config = GliderQC(None, self.qc_conf_loc).config
+        assert status_index.config_hash(self.qc_conf_loc) == status_index.config_hash(config)
+
+    def test_check_needs_qc_uses_index(self):
+        with mock.patch("os.getxattr", side_effect=OSError):
+            assert check_needs_qc(self.nc_path)
+        assert status_index.lookup_status(self.nc_path).state == status_index.PENDING
+
+        # the file is not opened again once it is indexed
+        with mock.patch("glider_qc.glider_qc.Dataset", side_effect=AssertionError):
+            assert check_needs_qc(self.nc_path)
+
+        redis = mock.patch(
+            "glider_qc.glider_qc.get_redis_connection", return_value=fakeredis.FakeRedis()
+        )
+        with redis, mock.patch("os.getxattr", side_effect=OSError):
+            qc_locked_file(self.nc_path, self.qc_conf_loc)
+        status = status_index.lookup_status(self.nc_path)
+        assert status.state == status_index.DONE
+        assert status.config_hash == status_index.config_hash(self.qc_conf_loc)
+        with mock.patch("glider_qc.glider_qc.Dataset", side_effect=AssertionError):
+            assert not check_needs_qc(self.nc_path)
+
+    def test_journal_mode(self):
+        mounts = (
+            "/dev/sda1 / ext4 rw 0 0\n"
+            "server:/data /data nfs4 rw 0 0\n"
+            "/dev/sdb1 /data/local\\040disk xfs rw 0 0\n"
+        )
+        with mock.patch("builtins.open", mock.mock_open(read_data=mounts)):
+            assert status_index.filesystem_type("/data/deployments") == "nfs4"
+            assert status_index.journal_mode("/data/.qc_status.sqlite") == "DELETE"
+            assert status_index.journal_mode("/data/local disk/index.sqlite") == "WAL"
+            assert status_index.journal_mode("/var/lib/index.sqlite") == "WAL"
+        with mock.patch("builtins.open", side_effect=OSError):
+            assert status_index.journal_mode("/var/lib/index.sqlite") == "DELETE"
+
+    def test_close_status_index(self):
+        index = status_index.get_status_index()
+        assert status_index.get_status_index() is index
+        status_index.close_status_index()
+        with self.assertRaises(sqlite3.ProgrammingError):
+            index.lookup(self.nc_path)
+        # the next use opens the index again
+        assert status_index.get_status_index() is not index
+        status_index.close_status_index()
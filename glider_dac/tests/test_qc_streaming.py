@@ -0,0 +1,181 @@
+#!/usr/bin/env python
+"""
+tests/test_qc_streaming.py
+"""
+
+from glider_qc import glider_qc, streaming
+from collections.abc import Mapping
+from unittest import TestCase, mock
+from netCDF4 import Dataset
+import json
+import numpy as np
+import os
+import shutil
+import tempfile
+
+
+class TestStreamingQC(TestCase):
+    qc_conf_loc = os.path.join(os.path.dirname(glider_qc.__file__), "qc_config.yml")
+    size = 4000
+
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tempdir)
+        self.config = glider_qc.GliderQC(None, self.qc_conf_loc).config
+        self.config.update(context_window=0, threshold_statistics="file")
+
+    def create_file(self, name):
+        deployment_dir = os.path.join(self.tempdir, name, "unitglider-20230515T000000-delayed")
+        os.makedirs(deployment_dir)
+        path = os.path.join(deployment_dir, "unitglider-20230515T000000-delayed.nc")
+        rng = np.random.default_rng(42)
+        # irregular sampling, so that the flat line window depends on the
+        # median time step of the whole file
+        steps = rng.choice([5.0, 10.0, 20.0], size=self.size, p=[0.3, 0.5, 0.2])
+        seconds = 1684108800.0 + 60.0 + np.cumsum(steps)
+        temperature = 15.0 + np.cumsum(rng.normal(0, 0.05, self.size))
+        temperature[[100, 1500, 2999, 3000]] += [3.0, -4.0, 2.5, 2.5]
+        # a flat line across chunk boundaries, and missing data
+        temperature[1900:2600] = temperature[1900]
+        temperature[700:720] = np.nan
+        pressure = np.abs(np.cumsum(rng.normal(0, 0.5, self.size))) * 1e4
+
+        with Dataset(path, "w") as nc:
+            nc.createDimension("time", self.size)
+            time = nc.createVariable("time", "f8", ("time",))
+            time.units = "seconds since 1970-01-01T00:00:00Z"
+            time[:] = seconds
+            for name, value in (("lat", 27.0), ("lon", -89.0)):
+                nc.createVariable(name, "f8", ("time",))[:] = np.full(self.size, value)
+                nc.createVariable(f"profile_{name}", "f8", ())[...] = value
+            for name, standard_name, units, values in (
+                ("temperature", "sea_water_temperature", "Celsius", temperature),
+                ("pressure", "sea_water_pressure", "Pa", pressure),
+            ):
+                var = nc.createVariable(name, "f8", ("time",), fill_value=-999.0)
+                var.standard_name = standard_name
+                var.units = units
+                var[:] = np.ma.masked_invalid(values)
+        return path
+
+    def run_qc(self, path, **streaming_config):
+        config = dict(self.config, streaming=streaming_config)
+        with Dataset(path, "r+") as nc:
+            glider_qc.run_qc(config, nc, path)
+        with Dataset(path) as nc:
+            flags = {
+                name: (nc.variables[name][:].tolist(), nc.variables[name].__dict__)
+                for name in nc.variables
+                if name.startswith("qartod_")
+            }
+            return flags, nc.dac_qc_comment
+
+    def rounded(self, qartod_config):
+        return json.loads(qartod_config, parse_float=lambda x: float(f"{float(x):.12g}"))
+
+    def test_chunks(self):
+        assert list(streaming.chunks(10, 4)) == [(0, 4), (4, 8), (8, 10)]
+        assert streaming.chunk_size({}, 10) is None
+        assert streaming.chunk_size({"streaming": {"min_samples": 5, "chunk_size": 3}}, 10) == 3
+        interval = np.timedelta64(10, "s").astype("timedelta64[ns]")
+        varspec = {
+            "gross_range_test": {},
+            "spike_test": {},
+            "flat_line_test": {"suspect_threshold": 300, "fail_threshold": 500},
+        }
+        assert streaming.overlap(varspec, interval) == (50, 1)
+
+    def test_chunked_flags_match_in_memory(self):
+        expected, expected_comment = self.run_qc(self.create_file("in_memory"))
+        assert len(expected) == 11
+        flat_line = np.array(expected["qartod_temperature_flat_line_flag"][0])
+        assert (flat_line[1900:2600] == 4).any()
+
+        path = self.create_file("chunked")
+        with mock.patch.object(streaming, "run_chunked_qc", wraps=streaming.run_chunked_qc) as run:
+            flags, comment = self.run_qc(path, min_samples=1000, chunk_size=333)
+            run.assert_called_once()
+        assert comment == expected_comment
+        assert flags.keys() == expected.keys()
+        for name in expected:
+            assert flags[name][0] == expected[name][0], name
+            assert flags[name][1].keys() == expected[name][1].keys(), name
+            for attribute, value in expected[name][1].items():
+                if attribute == "qartod_config":
+                    # thresholds merged chunk by chunk may differ in the last digit
+                    assert self.rounded(flags[name][1][attribute]) == self.rounded(value), name
+                else:
+                    np.testing.assert_equal(flags[name][1][attribute], value)
+
+    def test_chunked_without_cache_or_sidecar(self):
+        path = self.create_file("cached")
+        config = dict(
+            self.config,
+            streaming={"min_samples": 1000, "chunk_size": 333},
+            result_cache={"enabled": True},
+            qc_output={"mode": "sidecar", "merge": True},
+        )
+        reads = []
+
+        class RecordingVariable(object):
+            def __init__(self, ncvariable):
+                self.__dict__["ncvariable"] = ncvariable
+
+            def __getattr__(self, name):
+                return getattr(self.ncvariable, name)
+
+            def __setattr__(self, name, value):
+                setattr(self.ncvariable, name, value)
+
+            def __len__(self):
+                return len(self.ncvariable)
+
+            def __getitem__(self, key):
+                values = self.ncvariable[key]
+                reads.append((self.ncvariable.name, np.size(values)))
+                return values
+
+            def __setitem__(self, key, value):
+                self.ncvariable[key] = value
+
+        class RecordingVariables(Mapping):
+            def __init__(self, variables):
+                self.variables = variables
+
+            def __getitem__(self, name):
+                return RecordingVariable(self.variables[name])
+
+            def __iter__(self):
+                return iter(self.variables)
+
+            def __len__(self):
+                return len(self.variables)
+
+        class RecordingDataset(object):
+            def __init__(self, nc):
+                self.__dict__["nc"] = nc
+
+            @property
+            def variables(self):
+                return RecordingVariables(self.nc.variables)
+
+            def __getattr__(self, name):
+                return getattr(self.nc, name)
+
+            def __setattr__(self, name, value):
+                setattr(self.nc, name, value)
+
+        fail = mock.Mock(side_effect=AssertionError)
+        with mock.patch("glider_qc.result_cache.content_digest", fail), \
+                mock.patch("glider_qc.result_cache.collect_flags", fail), \
+                mock.patch.object(glider_qc, "qc_sidecar", fail), \
+                mock.patch("glider_qc.location.TRACK_BLOCK", 1000):
+            with Dataset(path, "r+") as nc:
+                assert glider_qc.run_cached_qc(config, RecordingDataset(nc), path) is False
+            # in sidecar mode, a chunked file is QC'ed in place
+            with mock.patch("os.getxattr", side_effect=OSError), mock.patch("os.setxattr"):
+                assert glider_qc.qc_locked_file(path, config)
+
+        # only the time axis is read whole
+        assert {name for name, size in reads if size == self.size} == {"time"}
+        assert max(size for name, size in reads if name == "temperature") < self.size
@@ -6,10 +6,10 @@ import os
 import argparse
 import glob
 import sys
-from rq import Queue
+import threading
 
 # from flask import current_app
-from glider_qc import glider_qc
+from glider_qc import glider_qc, queues
 import logging
 from netCDF4 import Dataset
 from glider_dac import create_app
@@ -26,15 +26,28 @@ from watchdog.observers import Observer
 
 log = logging.getLogger(__name__)
 
+# Seconds new profile files of a deployment are held back before QC is
+# enqueued, so that a burst of uploads is QC'ed in a single batch job
+QC_BATCH_DELAY = 10
+
 
 class HandleDeploymentDB(FileSystemEventHandler):
     def __init__(self, base, flagsdir, app):
         self.base = base
         self.flagsdir = flagsdir  # path to ERDDAP flags folder
-        # TODO: possibly create multiple priority queues depending on whether
-        # or not delayed mode datasets are used.
-        self.queue = Queue("gliderdac", connection=glider_qc.get_redis_connection())
+        # realtime and delayed mode QC queues, by delayed mode
+        self.queues = {
+            delayed_mode: queues.get_qc_queue(delayed_mode)
+            for delayed_mode in (False, True)
+        }
         self.app = app
+        self.qc_config = os.path.join(
+            os.path.dirname(os.path.realpath(__file__)), "glider_qc/qc_config.yml"
+        )
+        # deployment directory -> (time first file was seen, file paths,
+        # delayed mode) waiting to be enqueued as one QC batch
+        self.qc_pending = {}
+        self.qc_pending_lock = threading.Lock()
 
     def file_moved_or_created(self, event):
         log.info("%s %s", self.base, event.src_path)
@@ -161,21 +174,13 @@ class HandleDeploymentDB(FileSystemEventHandler):
                         file_path = event.src_path
                     else:
                         file_path = event.dest_path
-                    # TODO: DRY/refactor with batch QARTOD job?
                     try:
-                        if self.queue.connection.exists(f"gliderdac:{file_path}"):
+                        if glider_qc.get_redis_connection().exists(f"gliderdac:{file_path}"):
                             log.info(f"File {file_path} already has lock in Redis")
                             return
                         if glider_qc.check_needs_qc(file_path):
-                            log.info("Enqueueing QARTOD job for file %s", file_path)
-                            self.queue.enqueue(
-                                glider_qc.qc_task,
-                                file_path,
-                                os.path.join(
-                                    os.path.dirname(os.path.realpath(__file__)),
-                                    "glider_qc/qc_config.yml",
-                                ),
-                            )
+                            log.info("Scheduling QARTOD job for file %s", file_path)
+                            self.schedule_qc(file_path, deployment.delayed_mode)
                         else:
                             log.info(f"File {file_path} already has QC")
                     except OSError:
@@ -186,6 +191,44 @@ class HandleDeploymentDB(FileSystemEventHandler):
                             file_path,
                         )
 
+    def schedule_qc(self, file_path, delayed_mode=False):
+        """
+        Adds a file to its deployment's pending QC batch
+        """
+        deployment_dir = os.path.dirname(file_path)
+        with self.qc_pending_lock:
+            _, file_paths, _ = self.qc_pending.setdefault(
+                deployment_dir, (time.monotonic(), [], bool(delayed_mode))
+            )
+            if file_path not in file_paths:
+                file_paths.append(file_path)
+
+    def flush_qc_batches(self, delay=QC_BATCH_DELAY):
+        """
+        Enqueues a QC batch job for every deployment whose oldest pending file
+        has waited at least delay seconds, on the realtime or delayed mode
+        queue
+        """
+        now = time.monotonic()
+        with self.qc_pending_lock:
+            ready = [
+                deployment_dir
+                for deployment_dir, (since, _, _) in self.qc_pending.items()
+                if now - since >= delay
+            ]
+            batches = [self.qc_pending.pop(deployment_dir)[1:] for deployment_dir in ready]
+
+        for file_paths, delayed_mode in batches:
+            try:
+                glider_qc.enqueue_qc_batches(
+                    self.queues[delayed_mode],
+                    file_paths,
+                    self.qc_config,
+                    batch_size=queues.batch_size(delayed_mode),
+                )
+            except Exception:
+                log.exception("Could not enqueue QARTOD batch for %s", file_paths)
+
     def touch_erddap(self, deployment_name):
         """
         Creates a flag file for ERDDAP's file monitoring thread so that it reloads
@@ -258,6 +301,7 @@ def main(handler):
     try:
         while True:
             time.sleep(1)
+            handler.flush_qc_batches()
     except KeyboardInterrupt:
         observer.stop()
 
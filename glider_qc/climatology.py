@@ -0,0 +1,170 @@
+#!/usr/bin/env python
+"""
+Regional climatology test: samples are compared with the mean and standard
+deviation of a gridded climatology indexed by latitude, longitude, depth
+bin and month.  The climatology is a memory-mapped .npy array, loaded once
+per process and shared with the other workers through the page cache.
+glider_qc/climatology.py
+"""
+import json
+import logging
+import os
+from functools import lru_cache
+
+import numpy as np
+
+log = logging.getLogger(__name__)
+
+PASS = np.int8(1)
+NOT_EVALUATED = np.int8(2)
+SUSPECT = np.int8(3)
+FAIL = np.int8(4)
+MISSING = np.int8(9)
+
+# Standard deviations from the climatology mean beyond which a sample is
+# suspect, and failed (None never fails)
+SUSPECT_SIGMA = 3.0
+FAIL_SIGMA = None
+
+
+def grid_path(path):
+    """
+    Returns the path of the JSON file describing the grid of a climatology
+    array
+    """
+    return os.path.splitext(path)[0] + ".json"
+
+
+class ClimatologyIndex(object):
+    """
+    Climatology of a variable on a regular latitude/longitude grid, depth
+    bins and months.  The data is a (month, lat, lon, depth, 2) float32 array
+    of the mean and standard deviation of every cell, NaN where there is no
+    climatology.  The samples of a profile share their month and mostly their
+    cell, so their lookups fall in a few contiguous pages of the array.
+
+    :ivar data: numpy array, usually memory-mapped
+    :ivar lat: tuple of the southern edge and the step of the latitude cells
+    :ivar lon: tuple of the western edge and the step of the longitude cells,
+               which wrap around the globe
+    :ivar depth_edges: numpy float64 array of the depth bin edges, in dbar
+    """
+
+    def __init__(self, data, lat, lon, depth_edges):
+        self.data = data
+        self.lat = tuple(float(v) for v in lat)
+        self.lon = tuple(float(v) for v in lon)
+        self.depth_edges = np.asarray(depth_edges, dtype=np.float64)
+
+    @classmethod
+    def load(cls, path):
+        """
+        Memory-maps a climatology array and reads its grid
+
+        :param path: string defining path to the .npy array
+        """
+        with open(grid_path(path)) as f:
+            grid = json.load(f)
+        data = np.load(path, mmap_mode="r")
+        return cls(data, grid["lat"], grid["lon"], grid["depth_edges"])
+
+    def write(self, path):
+        """
+        Writes the array and its grid, the grid next to the array
+        """
+        np.save(path, np.asarray(self.data, dtype=np.float32))
+        with open(grid_path(path), "w") as f:
+            json.dump(
+                {"lat": self.lat, "lon": self.lon, "depth_edges": self.depth_edges.tolist()}, f
+            )
+
+    def lookup(self, lat, lon, depth, datetimes):
+        """
+        Returns the climatology mean and standard deviation of samples, with a
+        single gather from the array
+
+        :param lat: latitudes, broadcast to the samples
+        :param lon: longitudes, broadcast to the samples
+        :param depth: array of sample depths (sea pressure in dbar)
+        :param datetimes: numpy datetime64 array of the sample times
+        :return: tuple of float64 arrays of the mean and standard deviation,
+                 NaN for samples outside of the climatology
+        """
+        depth = np.asarray(depth, dtype=np.float64)
+        datetimes = np.asarray(datetimes).astype("datetime64[M]")
+        lat, lon = np.broadcast_arrays(
+            np.asarray(lat, dtype=np.float64), np.asarray(lon, dtype=np.float64), depth
+        )[:2]
+        _, nlat, nlon, ndepth, _ = self.data.shape
+        with np.errstate(invalid="ignore"):
+            i_lat = np.floor((lat - self.lat[0]) / self.lat[1])
+            i_lon = np.floor(np.mod(lon - self.lon[0], 360.0) / self.lon[1])
+            i_depth = np.searchsorted(self.depth_edges, depth, side="right") - 1
+            valid = (
+                (i_lat >= 0) & (i_lat < nlat)
+                & (i_lon >= 0) & (i_lon < nlon)
+                & (i_depth >= 0) & (i_depth < ndepth)
+                & ~np.isnan(depth)
+                & ~np.isnat(datetimes)
+            )
+        # invalid samples gather the first cell and are discarded after
+        i_month = np.where(valid, datetimes.astype(np.int64) % 12, 0)
+        cells = self.data[
+            i_month,
+            np.where(valid, i_lat, 0).astype(np.intp),
+            np.where(valid, i_lon, 0).astype(np.intp),
+            np.where(valid, i_depth, 0),
+        ]
+        mean = np.where(valid, cells[..., 0], np.nan)
+        std = np.where(valid, cells[..., 1], np.nan)
+        return mean, std
+
+
+@lru_cache(maxsize=None)
+def load_index(path):
+    """
+    Returns the ClimatologyIndex of a path, loaded on first use in the
+    process.  Only the pages of the array that lookups touch are read, and
+    they are shared through the page cache by every process mapping the
+    file.
+    """
+    log.info("Loading the climatology index %s", path)
+    return ClimatologyIndex.load(path)
+
+
+def preload(config):
+    """
+    Loads the climatology indexes of a configuration, e.g. in an rq worker
+    before it forks a work horse per job, so that the jobs inherit them
+    """
+    for path in ((config or {}).get("climatology") or {}).get("indexes", {}).values():
+        try:
+            load_index(path)
+        except (OSError, ValueError, KeyError) as e:
+            log.warning("Could not load the climatology index %s: %s", path, e)
+
+
+def climatology_flags(values, mean, std, suspect_sigma=SUSPECT_SIGMA, fail_sigma=FAIL_SIGMA):
+    """
+    Returns the climatology test flags of samples: MISSING if the value is
+    NaN, NOT_EVALUATED without a climatology, FAIL if it is more than
+    fail_sigma standard deviations from the mean, SUSPECT if more than
+    suspect_sigma, PASS otherwise
+
+    :param values: array of sample values
+    :param mean: array of the climatology means of the samples
+    :param std: array of the climatology standard deviations of the samples
+    :param suspect_sigma: float number of standard deviations
+    :param fail_sigma: float number of standard deviations, or None
+    :return: int8 array of flags
+    """
+    values = np.asarray(values, dtype=np.float64)
+    known = ~(np.isnan(mean) | np.isnan(std))
+    with np.errstate(invalid="ignore"):
+        deviation = np.abs(values - mean)
+        flags = np.where(known, PASS, NOT_EVALUATED).astype(np.int8)
+        flags[known & (deviation > suspect_sigma * std)] = SUSPECT
+        if fail_sigma is not None:
+            flags[known & (deviation > fail_sigma * std)] = FAIL
+    flags[np.isnan(values)] = MISSING
+    return flags
@@ -0,0 +1,183 @@
+#!/usr/bin/env python
+"""
+Cross-file QC context: the trailing samples of each variable of a
+deployment, kept next to the deployment so that the next profile file can be
+QC'ed as a continuation of the previous one.
+glider_qc/context.py
+"""
+import logging
+import os
+import tempfile
+from contextlib import contextmanager
+
+import numpy as np
+import redis
+
+log = logging.getLogger(__name__)
+
+# Name of the context file in the deployment directory.  Dotfiles are
+# ignored by the watchdog and by the deployment checksum.
+CONTEXT_FILE = ".qc_context.npz"
+# Upper bound of the number of samples kept, whatever the window length
+CONTEXT_MAX_SAMPLES = 10000
+# Seconds a job waits for the context lock of its deployment, and seconds
+# after which the lock of a job that died expires
+CONTEXT_LOCK_WAIT = 120
+CONTEXT_LOCK_TIMEOUT = 600
+
+
+@contextmanager
+def context_lock(connection, deployment_dir, window):
+    """
+    Holds the context lock of a deployment from loading its context until the
+    next one is saved, so that concurrent jobs of the deployment (realtime and
+    delayed queues, several workers) do not QC against a context another job
+    is about to replace.  Yields whether the context can be used: False if
+    another job kept the lock for CONTEXT_LOCK_WAIT seconds, in which case
+    the file is QC'ed without context and does not save one.  Without Redis
+    the context is used unlocked.
+
+    :param connection: redis connection
+    :param deployment_dir: string defining path to the deployment directory
+    :param window: number of seconds of context, no lock is taken if 0
+    """
+    if not window:
+        yield True
+        return
+    lock = connection.lock(
+        f"gliderdac:qc_context:{os.path.normpath(deployment_dir)}",
+        timeout=CONTEXT_LOCK_TIMEOUT,
+        blocking_timeout=CONTEXT_LOCK_WAIT,
+    )
+    try:
+        acquired = lock.acquire()
+    except redis.RedisError as e:
+        log.warning("Could not lock the QC context of %s: %s", deployment_dir, e)
+        yield True
+        return
+    if not acquired:
+        log.warning("The QC context of %s is locked by another job", deployment_dir)
+        yield False
+        return
+    try:
+        yield True
+    finally:
+        try:
+            lock.release()
+        except redis.RedisError as e:
+            log.warning("Could not release the QC context lock of %s: %s", deployment_dir, e)
+
+
+class ContextWindow(object):
+    """
+    Bounded window of the trailing samples of a deployment's variables, on a
+    shared time axis.
+
+    :ivar seconds: numpy float64 array of seconds since 1970-01-01
+    :ivar values: dict of variable name to numpy float64 array, NaN where missing
+    """
+
+    def __init__(self, seconds=None, values=None):
+        self.seconds = np.empty(0) if seconds is None else seconds
+        self.values = values or {}
+
+    def __len__(self):
+        return len(self.seconds)
+
+    @property
+    def datetimes(self):
+        return self.seconds.astype("datetime64[s]")
+
+    @property
+    def end(self):
+        """
+        Time of the last sample, NaN if the window is empty
+        """
+        return self.seconds[-1] if len(self) else np.nan
+
+    def row(self, varname):
+        """
+        Returns the values of a variable, NaN if the window does not have it
+
+        :param varname: string defining the variable name
+        """
+        return self.values.get(varname, np.full(len(self), np.nan))
+
+    @classmethod
+    def load(cls, deployment_dir):
+        """
+        Loads the context of a deployment, or an empty one if there is none
+        or it cannot be read
+
+        :param deployment_dir: string defining path to the deployment directory
+        """
+        path = os.path.join(deployment_dir, CONTEXT_FILE)
+        try:
+            with np.load(path, allow_pickle=False) as npz:
+                values = {
+                    name[len("var_"):]: npz[name]
+                    for name in npz.files
+                    if name.startswith("var_")
+                }
+                return cls(npz["seconds"], values)
+        except FileNotFoundError:
+            pass
+        except Exception:
+            log.exception("Could not read QC context %s, ignoring it", path)
+        return cls()
+
+    def save(self, deployment_dir):
+        """
+        Atomically replaces the context file of a deployment
+
+        :param deployment_dir: string defining path to the deployment directory
+        """
+        arrays = {f"var_{name}": values for name, values in self.values.items()}
+        fd, tmp_path = tempfile.mkstemp(
+            prefix=CONTEXT_FILE, suffix=".tmp", dir=deployment_dir
+        )
+        try:
+            with os.fdopen(fd, "wb") as f:
+                np.savez(f, seconds=self.seconds, **arrays)
+            os.replace(tmp_path, os.path.join(deployment_dir, CONTEXT_FILE))
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
+
+    def preceding(self, seconds, window):
+        """
+        Returns the part of the window within window seconds before the first
+        of the given times.  The result is empty if the window does not end
+        before the first time, e.g. when an older file is QC'ed again.
+
+        :param seconds: numpy float64 array of the next file's times
+        :param window: number of seconds of context to keep
+        """
+        start = np.nanmin(seconds) if len(seconds) else np.nan
+        if not len(self) or not self.end < start:
+            return ContextWindow()
+        keep = self.seconds >= start - window
+        return ContextWindow(
+            self.seconds[keep],
+            {name: values[keep] for name, values in self.values.items()},
+        )
+
+    @classmethod
+    def trailing(cls, seconds, values, window):
+        """
+        Returns the samples within window seconds of the last time, at most
+        CONTEXT_MAX_SAMPLES of them
+
+        :param seconds: numpy float64 array of times
+        :param values: dict of variable name to numpy array of values
+        :param window: number of seconds of context to keep
+        """
+        valid = np.flatnonzero(np.isfinite(seconds))
+        if not valid.size:
+            return cls()
+        keep = valid[seconds[valid] >= seconds[valid[-1]] - window]
+        keep = keep[-CONTEXT_MAX_SAMPLES:]
+        return cls(
+            seconds[keep].copy(),
+            {name: np.array(row[keep], dtype=np.float64) for name, row in values.items()},
+        )
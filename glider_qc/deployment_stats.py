@@ -0,0 +1,244 @@
+#!/usr/bin/env python
+"""
+Deployment-wide running statistics for the spike and rate of change test
+thresholds, updated incrementally as each profile file is QC'ed.
+glider_qc/deployment_stats.py
+"""
+import logging
+import math
+import os
+import re
+from collections import namedtuple
+
+import numpy as np
+
+from glider_qc import engine
+
+log = logging.getLogger(__name__)
+
+
+# The rate of change threshold of a deployment is RATE_SIGMA standard
+# deviations above the mean of the per-file maximum rates, and at most the
+# largest of them, so that a single corrupt file cannot raise it for the
+# rest of the deployment
+RATE_SIGMA = 2.0
+# Seconds the statistics of a deployment are kept after its last update
+STATS_TTL = 90 * 24 * 3600
+
+
+class RunningStats(namedtuple("RunningStats", "count mean m2")):
+    """
+    Mergeable moments of a variable (Welford/Chan et al.), so that the
+    statistics of a whole deployment can be updated one file at a time.
+
+        - count: number of valid samples
+        - mean: mean of the valid samples
+        - m2: sum of the squared differences from the mean
+    """
+
+    @classmethod
+    def empty(cls):
+        return cls(0, math.nan, 0.0)
+
+    @classmethod
+    def from_threshold_stats(cls, stats):
+        """
+        Returns the running statistics of a single variable's
+        engine.ThresholdStats
+
+        :param stats: engine.ThresholdStats of a single variable
+        """
+        count = int(stats.count)
+        if count == 0:
+            return cls.empty()
+        return cls(count, float(stats.mean), float(stats.std) ** 2 * count)
+
+    @classmethod
+    def of(cls, value):
+        """
+        Returns the running statistics of a single value, empty if it is NaN
+        """
+        if math.isnan(value):
+            return cls.empty()
+        return cls(1, float(value), 0.0)
+
+    @property
+    def std(self):
+        """
+        Population standard deviation, matching numpy.nanstd
+        """
+        if self.count == 0:
+            return math.nan
+        return math.sqrt(self.m2 / self.count)
+
+    def merge(self, other):
+        """
+        Returns the statistics of the union of both sets of samples
+
+        :param other: RunningStats
+        """
+        if other.count == 0:
+            return self
+        if self.count == 0:
+            return other
+        count = self.count + other.count
+        delta = other.mean - self.mean
+        mean = self.mean + delta * other.count / count
+        m2 = self.m2 + other.m2 + delta ** 2 * self.count * other.count / count
+        return RunningStats(count, mean, m2)
+
+
+class VariableStats(namedtuple("VariableStats", "values rates max_rate files")):
+    """
+    Statistics of a variable over the files of a deployment QC'ed so far
+
+        - values: RunningStats of the samples
+        - rates: RunningStats of the maximum in-band rate of change of each
+          file
+        - max_rate: largest maximum rate of change of a file, NaN if none
+        - files: number of files merged
+    """
+
+    @classmethod
+    def empty(cls):
+        return cls(RunningStats.empty(), RunningStats.empty(), math.nan, 0)
+
+    @property
+    def rate_threshold(self):
+        """
+        Rate of change threshold of the deployment, NaN without rates
+        """
+        if self.rates.count == 0:
+            return math.nan
+        return min(self.rates.mean + RATE_SIGMA * self.rates.std, self.max_rate)
+
+    def snapshot(self):
+        """
+        Returns the statistics the thresholds of a file were derived from,
+        stored with its test configurations
+        """
+        return {
+            "mode": "deployment",
+            "files": self.files,
+            "count": self.values.count,
+            "mean": self.values.mean,
+            "std": self.values.std,
+            "rate_threshold": self.rate_threshold,
+        }
+
+
+class DeploymentStats(object):
+    """
+    Running statistics of every QC'ed variable of a deployment, kept in Redis
+    so that all of the workers share them.  Each variable is a hash holding
+    the VariableStats fields, next to the set of file names already merged
+    into it so that re-running QC on a file does not count it twice.  Both
+    expire STATS_TTL seconds after the last update of the variable.
+
+    The statistics a file is QC'ed with depend on the files of the
+    deployment QC'ed before it, so QC'ing the same file again later can
+    give other spike and rate of change flags.
+    """
+    KEY_PREFIX = "gliderdac:qc_stats"
+
+    def __init__(self, connection, deployment_dir):
+        """
+        :param connection: redis.Redis connection
+        :param deployment_dir: string defining path to the deployment directory
+        """
+        self.connection = connection
+        self.deployment_dir = os.path.normpath(deployment_dir)
+
+    def key(self, varname):
+        return f"{self.KEY_PREFIX}:{self.deployment_dir}:{varname}"
+
+    @staticmethod
+    def _decode(fields, files=0):
+        if not fields:
+            return VariableStats.empty()
+        return VariableStats(
+            RunningStats(int(fields[b"count"]), float(fields[b"mean"]), float(fields[b"m2"])),
+            RunningStats(
+                int(fields[b"rate_count"]), float(fields[b"rate_mean"]), float(fields[b"rate_m2"])
+            ),
+            float(fields[b"rate_max"]),
+            int(files),
+        )
+
+    @staticmethod
+    def _encode(stats):
+        values, rates = stats.values, stats.rates
+        return {
+            "count": repr(values.count),
+            "mean": repr(values.mean),
+            "m2": repr(values.m2),
+            "rate_count": repr(rates.count),
+            "rate_mean": repr(rates.mean),
+            "rate_m2": repr(rates.m2),
+            "rate_max": repr(stats.max_rate),
+        }
+
+    def get(self, varname):
+        """
+        Returns the VariableStats of a variable over the files merged so far
+
+        :param varname: string defining the variable name
+        """
+        key = self.key(varname)
+        return self._decode(
+            self.connection.hgetall(key), self.connection.scard(f"{key}:files")
+        )
+
+    def update(self, varname, file_name, stats, values, times):
+        """
+        Merges the statistics of one file into the deployment's running
+        statistics of a variable and returns the result.  The file's
+        rate of change is measured within one std of the deployment-wide mean,
+        so only the file's own values are needed.
+
+        :param varname: string defining the variable name
+        :param file_name: string defining the netCDF file name
+        :param stats: engine.ThresholdStats of the file's values
+        :param values: numpy array of the file's values
+        :param times: numpy array of the file's times
+        :return: VariableStats of the deployment including the file
+        """
+        key = self.key(varname)
+        files_key = f"{key}:files"
+        file_stats = RunningStats.from_threshold_stats(stats)
+
+        def merge(pipe):
+            current = self._decode(pipe.hgetall(key), pipe.scard(files_key))
+            if pipe.sismember(files_key, file_name):
+                return current
+            merged = current.values.merge(file_stats)
+            _, max_rate = engine.band_max_rate(
+                values, times, [merged.mean], [merged.std]
+            )
+            merged = VariableStats(
+                merged,
+                current.rates.merge(RunningStats.of(max_rate[0])),
+                float(np.fmax(current.max_rate, max_rate[0])),
+                current.files + 1,
+            )
+            pipe.multi()
+            pipe.hset(key, mapping=self._encode(merged))
+            pipe.sadd(files_key, file_name)
+            pipe.expire(key, STATS_TTL)
+            pipe.expire(files_key, STATS_TTL)
+            return merged
+
+        return self.connection.transaction(
+            merge, key, files_key, value_from_callable=True
+        )
+
+    def delete(self):
+        """
+        Deletes the statistics of every variable of the deployment, e.g. when
+        the deployment is removed
+        """
+        # the directory is matched literally
+        prefix = re.sub(r"([*?\[\]\\])", r"\\\1", self.key(""))
+        keys = list(self.connection.scan_iter(match=prefix + "*"))
+        if keys:
+            self.connection.delete(*keys)
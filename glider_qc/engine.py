@@ -0,0 +1,253 @@
+#!/usr/bin/env python
+"""
+Direct-array QARTOD engine. Calls the ioos_qc kernels on NumPy arrays
+without the PandasStream/PandasStore round trips.
+glider_qc/engine.py
+"""
+import inspect
+import logging
+import os
+import warnings
+from collections import namedtuple
+from functools import lru_cache
+
+import numpy as np
+from ioos_qc import qartod
+from ioos_qc.qartod import QartodFlags
+from ioos_qc.utils import cf_safe_name
+
+log = logging.getLogger(__name__)
+
+ROLLUP_COLUMN = cf_safe_name("qartod.rollup_qc")
+
+# Flag precedence used by ioos_qc.qartod.qartod_compare, lowest first.  A
+# flag's rank is its position in this list (1-based), anything else ranks 0.
+_PRIORITIES = [
+    QartodFlags.MISSING,
+    QartodFlags.UNKNOWN,
+    QartodFlags.GOOD,
+    QartodFlags.SUSPECT,
+    QartodFlags.FAIL,
+]
+_RANK = np.zeros(256, dtype=np.int8)
+for _rank, _flag in enumerate(_PRIORITIES, start=1):
+    _RANK[_flag] = _rank
+_FLAG_BY_RANK = np.array([QartodFlags.MISSING] + _PRIORITIES, dtype=np.uint8)
+
+
+def get_qc_engine():
+    """
+    Returns the name of the QARTOD engine used by run_qc. Set per worker
+    through the GLIDER_QC_ENGINE environment variable:
+
+        - "ioos_qc" (default): ioos_qc PandasStream/PandasStore
+        - "numpy": the direct-array engine in this module
+    """
+    return os.environ.get("GLIDER_QC_ENGINE", "ioos_qc")
+
+
+def result_column(varname, testname):
+    """
+    Returns the results column name ioos_qc's PandasStore uses for a test
+
+    :param varname: string defining the variable name
+    :param testname: string defining the qartod test name, e.g. spike_test
+    """
+    return cf_safe_name(f"{varname}.qartod.{testname}")
+
+
+@lru_cache(maxsize=None)
+def _qartod_test(testname):
+    """
+    Returns the qartod test function and the keyword arguments it accepts
+    """
+    func = getattr(qartod, testname)
+    parameters = inspect.signature(func).parameters.values()
+    accepted = frozenset(
+        p.name for p in parameters if p.kind == p.POSITIONAL_OR_KEYWORD
+    )
+    return func, accepted
+
+
+def flag_variable_name(varname, column):
+    """
+    Returns the name of the QARTOD flag variable a results column is written
+    to, and the name of its test (None for the primary rollup)
+
+    :param varname: string defining the variable name
+    :param column: string defining the results column name
+    """
+    if column == ROLLUP_COLUMN:
+        return f"qartod_{varname}_primary_flag", None
+    testname = column.split("qartod_")[-1]
+    return f"qartod_{varname}_{testname.split('_test')[0]}_flag", testname
+
+
+def rollup(flag_arrays):
+    """
+    Vectorized equivalent of ioos_qc.qartod.qartod_compare: for each sample,
+    keep the flag with the highest precedence (FAIL > SUSPECT > GOOD >
+    UNKNOWN > MISSING) across all of the test results.
+
+    :param flag_arrays: list of equal length flag arrays
+    :return: numpy uint8 array of aggregated flags
+    """
+    rank = np.zeros(len(flag_arrays[0]), dtype=np.int8)
+    for flags in flag_arrays:
+        np.maximum(rank, _RANK[np.asarray(flags, dtype=np.intp)], out=rank)
+    return _FLAG_BY_RANK[rank]
+
+
+def run_qartod(varname, values, times, varspec, test_times=None):
+    """
+    Runs the QARTOD tests configured for a variable directly on arrays and
+    computes the primary rollup. The returned columns match the ones
+    GliderQC.apply_qc gets back from PandasStore.save, flag for flag.
+
+    :param varname: string defining the variable name
+    :param values: numpy float64 array of values, missing data as NaN
+    :param times: numpy datetime64 array of times
+    :param varspec: dictionary with the variable's "qartod" config specs
+    :param test_times: dict of test name to the times passed to that test
+                       instead of times (optional)
+    :return: dict of results column name to numpy flag array
+    """
+    test_times = test_times or {}
+    results = {}
+    for testname, kwargs in varspec.items():
+        try:
+            func, accepted = _qartod_test(testname)
+        except AttributeError:
+            log.warning('No ioos_qc method "qartod.%s" was found, skipping', testname)
+            continue
+
+        inputs = {"inp": values, "tinp": test_times.get(testname, times)}
+        testkwargs = {**(kwargs or {}), **inputs}
+        testkwargs = {k: v for k, v in testkwargs.items() if k in accepted}
+        try:
+            flags = func(**testkwargs)
+        except Exception as e:
+            log.error(f'Could not run "qartod.{testname}" on {varname}: {e}')
+            continue
+        results[result_column(varname, testname)] = np.ma.getdata(flags)
+
+    if results:
+        results[ROLLUP_COLUMN] = rollup(list(results.values()))
+
+    return results
+
+
+class ThresholdStats(
+    namedtuple("ThresholdStats", "size count mean std in_band max_rate")
+):
+    """
+    Per-variable statistics used to derive the spike and rate of change test
+    thresholds. Each field holds one entry (or row) per variable.
+
+        - size: number of samples
+        - count: number of valid (non-NaN) samples
+        - mean, std: NaN-aware mean and standard deviation
+        - in_band: boolean mask of samples strictly within one std of the mean
+        - max_rate: maximum absolute rate of change between consecutive
+          in-band samples, NaN when fewer than two samples are in band
+    """
+
+    def variable(self, index):
+        """
+        Returns the statistics of a single variable
+
+        :param index: integer row of the variable
+        """
+        return ThresholdStats(*(field[index] for field in self))
+
+
+def _as_block(values):
+    """
+    Returns values as a 2-D (variables, samples) float64 array, NaN where
+    masked.  A plain float64 array is returned as it is, or as a 2-D view of
+    it, without a copy.
+    """
+    if type(values) is not np.ndarray or values.dtype != np.float64:
+        values = np.ma.filled(np.ma.asarray(values, dtype=np.float64), np.nan)
+    return np.atleast_2d(values)
+
+
+def _as_seconds(times, size):
+    """
+    Returns the first size times as float64 seconds
+    """
+    times = np.ma.getdata(times)[:size]
+    if np.issubdtype(times.dtype, np.datetime64):
+        times = times.astype("datetime64[s]").astype(np.int64)
+    return times.astype(np.float64)
+
+
+def threshold_statistics(values, times):
+    """
+    Computes the threshold statistics of every variable in one vectorized
+    pass. Rows of values share the time axis, samples are paired with times by
+    index.
+
+    :param values: 2-D (variables, samples) array of values, masked or NaN
+                   values are treated as missing. A 1-D array is one variable.
+    :param times: numpy array of datetime64 or float seconds
+    :return: ThresholdStats with one row per variable
+    """
+    values = _as_block(values)
+    nvars, size = values.shape
+
+    count = np.count_nonzero(~np.isnan(values), axis=1)
+    with warnings.catch_warnings():
+        # all-NaN rows get a NaN mean and std
+        warnings.simplefilter("ignore", category=RuntimeWarning)
+        mean = np.nanmean(values, axis=1)
+        std = np.nanstd(values, axis=1)
+
+    in_band, max_rate = band_max_rate(values, times, mean, std)
+
+    return ThresholdStats(
+        np.full(nvars, size), count, mean, std, in_band, max_rate
+    )
+
+
+def band_max_rate(values, times, mean, std):
+    """
+    Computes the maximum absolute rate of change between consecutive samples
+    strictly within one std of the mean, for every variable at once.
+
+    :param values: 2-D (variables, samples) array of values, masked or NaN
+                   values are treated as missing. A 1-D array is one variable.
+    :param times: numpy array of datetime64 or float seconds
+    :param mean: numpy array with the band center of each variable
+    :param std: numpy array with the band half-width of each variable
+    :return: tuple of the in-band mask and the max_rate of each variable
+    """
+    values = _as_block(values)
+    nvars, size = values.shape
+    times = _as_seconds(times, size)
+    mean = np.asarray(mean, dtype=np.float64).reshape(nvars, 1)
+    std = np.asarray(std, dtype=np.float64).reshape(nvars, 1)
+
+    with np.errstate(invalid="ignore"):
+        in_band = (values > mean - std) & (values < mean + std)
+
+    # Pair every in-band sample with the closest preceding in-band sample of
+    # the same variable: carry the last in-band index forward along each row
+    # and shift it by one sample.
+    max_rate = np.full(nvars, np.nan)
+    last = np.maximum.accumulate(
+        np.where(in_band, np.arange(size), -1), axis=1
+    )
+    previous = np.full_like(last, -1)
+    previous[:, 1:] = last[:, :-1]
+    rows, cols = np.nonzero(in_band & (previous >= 0))
+    if rows.size:
+        prev_cols = previous[rows, cols]
+        with np.errstate(divide="ignore", invalid="ignore"):
+            rate = np.abs(
+                (values[rows, cols] - values[rows, prev_cols])
+                / (times[cols] - times[prev_cols])
+            )
+        np.fmax.at(max_rate, rows, rate)
+
+    return in_band, max_rate
@@ -3,8 +3,10 @@
 Runs IOOS QARTOD tests on a netCDF file
 glider_qc/glider_qc.py
 """
+import copy
 import re
-from typing import Optional
+from collections import namedtuple
+from functools import lru_cache
 import datetime
 from datetime import timezone
 import numpy as np
@@ -18,37 +20,373 @@ from ioos_qc.config import Config
 import numpy as np
 import pandas as pd
 import json
-import math
 import yaml
 import logging
 import redis
 import os
-from shapely.geometry import Point, Polygon
 from pathlib import Path
+from glider_qc import climatology, engine, instrumentation, location, seawater, streaming
+from glider_qc.context import ContextWindow, context_lock
+from glider_qc.deployment_stats import DeploymentStats
+from glider_qc import sidecar, status_index
+from glider_qc import result_cache
+from glider_qc.result_cache import QCResultCache
+from glider_qc.write_plan import FlagWritePlan, apply_flags, storage_options
 log = logging.getLogger(__name__)
 __RCONN = None
 
+# Maximum number of files per qc_deployment_batch job and the rq timeout
+# (in seconds) of such a job
+QC_BATCH_SIZE = 200
+QC_BATCH_JOB_TIMEOUT = 3600
+
+# Key of the deployment statistics snapshot in the stored configuration of
+# the tests whose thresholds are derived from them
+STATISTICS_SNAPSHOT = "threshold_statistics"
+SNAPSHOT_TESTS = ("spike_test", "rate_of_change_test")
+
+# Standard names of the measurements salinity and density are derived from,
+# and of the submitted variables checked against them
+CONSISTENCY_INPUTS = (
+    "sea_water_temperature",
+    "sea_water_electrical_conductivity",
+    "sea_water_pressure",
+)
+CONSISTENCY_TARGETS = {
+    "sea_water_practical_salinity": "salinity",
+    "sea_water_salinity": "salinity",
+    "sea_water_density": "density",
+}
+
 
 class ProcessError(ValueError):
     pass
 
 
+@lru_cache(maxsize=None)
+def get_unit(units):
+    """
+    Returns the cf_units.Unit for a units string, parsed once per process
+    :param units: string defining units
+    """
+    return Unit(units)
+
+
+class UnitConverter(namedtuple("UnitConverter", "scale offset")):
+    """
+    Affine conversion of values between two units, value * scale + offset,
+    precomputed once from cf_units.  The identity conversion (scale 1,
+    offset 0) returns the values as they are.
+    """
+
+    @property
+    def identity(self):
+        return self.scale == 1.0 and self.offset == 0.0
+
+    def __call__(self, values, inplace=False):
+        """
+        Returns the converted values
+
+        :param values: numpy array of values
+        :param inplace: boolean, convert a floating point values array in
+                        place instead of copying it
+        """
+        if self.identity:
+            return values
+        if not (inplace and values.dtype.kind == "f"):
+            return values * self.scale + self.offset
+        values *= self.scale
+        values += self.offset
+        return values
+
+
+@lru_cache(maxsize=None)
+def get_converter(source, target):
+    """
+    Returns the UnitConverter from source to target units, built once per
+    process.  Raises ValueError if the units cannot be converted.
+
+    :param source: string defining the units of the values
+    :param target: string defining the units to convert to
+    """
+    source_unit, target_unit = get_unit(source), get_unit(target)
+    if source_unit == target_unit:
+        return UnitConverter(1.0, 0.0)
+    offset, one, two = source_unit.convert(np.array([0.0, 1.0, 2.0]), target_unit)
+    converter = UnitConverter(float(one - offset), float(offset))
+    # all of the units QC converts between are affine, e.g. degF to deg_C
+    if not np.isclose(converter.scale * 2.0 + converter.offset, two, rtol=1e-9, atol=1e-12):
+        raise ValueError(f"Units {source} are not an affine transform of {target}")
+    return converter
+
+
+class TimeAxis(object):
+    """
+    Time coordinate of a netCDF file, read and decoded once so that every QC
+    stage can share it.
+
+    :ivar seconds: numpy float64 array of seconds since 1970-01-01, NaN where invalid
+    :ivar datetimes: numpy datetime64[s] array, NaT where invalid
+    :ivar valid: numpy boolean array, False for masked or non-finite times
+    :ivar units: string defining the units the times were decoded from
+    """
+    EPOCH_UNITS = "seconds since 1970-01-01T00:00:00Z"
+
+    def __init__(self, seconds, valid, units=EPOCH_UNITS):
+        self.seconds = seconds
+        self.valid = valid
+        self.units = units
+        self.datetimes = np.full(seconds.shape, np.datetime64("NaT"), dtype="datetime64[s]")
+        self.datetimes[valid] = seconds[valid].astype("datetime64[s]")
+
+    def __len__(self):
+        return len(self.seconds)
+
+    @classmethod
+    def from_variable(cls, ncvariable):
+        """
+        Reads and decodes a netCDF time variable using its units and calendar
+
+        :param ncvariable: netCDF4.Variable
+        :return: TimeAxis
+        """
+        units = getattr(ncvariable, "units", cls.EPOCH_UNITS)
+        seconds = fill_masked(ncvariable[:])
+        valid = np.isfinite(seconds)
+        seconds[~valid] = np.nan
+
+        epoch = Unit(cls.EPOCH_UNITS, calendar="standard")
+        source = Unit(units, calendar=getattr(ncvariable, "calendar", "standard"))
+        if source != epoch:
+            seconds = source.convert(seconds, epoch, inplace=True)
+
+        return cls(seconds, valid, units)
+
+    @property
+    def masked_datetimes(self):
+        """
+        Returns the datetimes as a masked array with the invalid times masked
+        """
+        return np.ma.array(self.datetimes, mask=~self.valid)
+
+
+# Deployment name timestamp: 8 digits optionally followed by T + 2/4/6
+# digits, optional trailing Z/z
+DEPLOYMENT_TIMESTAMP = re.compile(r'(?<!\d)(\d{8}(?:[Tt]\d{2}(?:\d{2}(?:\d{2})?)?)?[Zz]?)(?!\d)')
+# the first ocean sea trials / deployment of a glider
+DEPLOYMENT_MIN_YEAR = 1998
+
+
+@lru_cache(maxsize=1024)
+def parse_deployment_time(deployment_name):
+    """
+    Returns the deployment time in the name of a deployment directory as a
+    numpy datetime64[s], or None if the name has no timestamp.  The timestamp
+    is padded to YYYYmmddTHHMMSS ('YYYYmmdd' -> 'YYYYmmddT000000', etc.).
+    Parsed once per deployment and process.
+
+    :param deployment_name: string defining the deployment directory name
+    :raises ValueError: if the timestamp is not a valid date and time between
+                        DEPLOYMENT_MIN_YEAR and the current year
+    """
+    m = DEPLOYMENT_TIMESTAMP.search(Path(deployment_name).name)
+    if not m:
+        return None
+    token = m.group(1).upper().rstrip('Z')
+    date, _, time_part = token.partition('T')
+    if len(time_part) not in (0, 2, 4, 6):
+        return None
+    normalized = f"{date}T{time_part.ljust(6, '0')}"
+
+    # strptime validates all component ranges AND calendar correctness (e.g. April 31)
+    try:
+        dt = datetime.datetime.strptime(normalized, "%Y%m%dT%H%M%S")
+    except ValueError:
+        raise ValueError(f"Invalid date/time values in token: {normalized!r}")
+
+    # Enforce custom year bounds (strptime does not check these)
+    max_year = datetime.datetime.now().year
+    if dt.year < DEPLOYMENT_MIN_YEAR:
+        raise ValueError(f"Year {dt.year} is less than minimum allowed {DEPLOYMENT_MIN_YEAR}.")
+    if dt.year > max_year:
+        raise ValueError(f"Year {dt.year} is greater than maximum allowed {max_year}.")
+
+    posix = dt.replace(tzinfo=timezone.utc).timestamp()
+    return np.datetime64(int(posix), 's')
+
+
+class TimeIssue(namedtuple("TimeIssue", "count first_index")):
+    """
+    Number of offending timestamps of a time axis check, and the index of the
+    first one (None if there is none)
+    """
+
+    def __bool__(self):
+        return self.count > 0
+
+    def __str__(self):
+        return f"({self.count}, first at index {self.first_index})"
+
+
+class TimeDiagnostics(namedtuple("TimeDiagnostics", "masked zeros duplicates inversions")):
+    """
+    TimeIssue of each time axis check:
+
+        - masked: masked timestamps
+        - zeros: timestamps equal to 1970-01-01T00:00:00
+        - duplicates: timestamps equal to an earlier timestamp
+        - inversions: timestamps not after the preceding valid timestamp
+    """
+
+
+def _time_issue(offending):
+    """
+    Returns the TimeIssue of an array of offending indices
+    """
+    if not len(offending):
+        return TimeIssue(0, None)
+    return TimeIssue(int(len(offending)), int(offending.min()))
+
+
+def time_diagnostics(tnp):
+    """
+    Checks a time axis for masked, zero, duplicate and non-ascending
+    timestamps in one vectorized pass.  Duplicates are found by sorting, and
+    NaT timestamps are ignored by the duplicate and ordering checks.
+
+    :param tnp: time array (numpy.ma.core.MaskedArray of datetime64)
+    :return: TimeDiagnostics
+    """
+    masked = np.ma.getmaskarray(tnp)
+    values = np.ma.getdata(tnp)
+    valid_index = np.flatnonzero(~(masked | np.isnat(values)))
+    valid = values[valid_index]
+
+    zeros = np.flatnonzero(~masked & (values == np.datetime64(0, "s")))
+
+    # a stable sort keeps equal timestamps in their original order, so every
+    # timestamp equal to its predecessor in the sorted array is a repeat
+    order = np.argsort(valid, kind="stable")
+    repeats = order[1:][valid[order][1:] == valid[order][:-1]]
+    inversions = np.flatnonzero(np.diff(valid) <= np.timedelta64(0, "s")) + 1
+
+    return TimeDiagnostics(
+        masked=_time_issue(np.flatnonzero(masked)),
+        zeros=_time_issue(zeros),
+        duplicates=_time_issue(valid_index[repeats]),
+        inversions=_time_issue(valid_index[inversions]),
+    )
+
+
 class GliderQC(object):
-    def __init__(self, ncfile, config_file=None):
+    def __init__(self, ncfile, config_file=None, timings=None):
         """
         Initializes an instance of the class with a netCDF file and an optional config file.
 
         :param ncfile: The netCDF file to be used (required).
-        :param config_file: The path to a configuration file (optional).
+        :param config_file: The path to a configuration file, or an already
+                            loaded configuration dictionary (optional).
+        :param timings: The instrumentation.JobTimings the QC stages are
+                        timed in (optional).
         """
         self.ncfile = ncfile
-
-        if config_file is not None:
+        self._time_axis = None
+        self.timings = timings if timings is not None else instrumentation.JobTimings()
+
+        if isinstance(config_file, dict):
+            # update_config modifies the variable specs, keep the caller's
+            # configuration intact so it can be reused for other files
+            self.config = copy.deepcopy(config_file)
+        elif config_file is not None:
             try:
                 self.load_config(config_file)
             except Exception as e:
                 log.error("Error loading config file %s: %s", config_file, str(e))
 
+    @property
+    def time_axis(self):
+        """
+        Returns the TimeAxis of the file, decoded from the time variable on
+        first access
+        """
+        if self._time_axis is None:
+            self._time_axis = TimeAxis.from_variable(self.ncfile.variables["time"])
+        return self._time_axis
+
+    @property
+    def flag_storage(self):
+        """
+        Returns the flag_storage policy of the configuration, if any
+        """
+        return (getattr(self, "config", None) or {}).get("flag_storage")
+
+    @property
+    def qc_output(self):
+        """
+        Returns the qc_output settings of the configuration: the mode
+        ("in_place" or "sidecar") and whether sidecars are merged
+        """
+        output = {"mode": "in_place", "merge": True}
+        output.update((getattr(self, "config", None) or {}).get("qc_output") or {})
+        return output
+
+    @property
+    def instrumentation(self):
+        """
+        Returns the instrumentation settings of the configuration: whether
+        job records are added to the Redis stream and its length
+        """
+        settings = {
+            "redis_stream": False,
+            "stream_maxlen": instrumentation.TIMINGS_STREAM_MAXLEN,
+        }
+        settings.update((getattr(self, "config", None) or {}).get("instrumentation") or {})
+        return settings
+
+    @property
+    def consistency(self):
+        """
+        Returns the consistency check settings of the configuration: whether
+        the submitted salinity and density are checked and their tolerances
+        """
+        settings = {
+            "enabled": False,
+            "salinity_tolerance": seawater.SALINITY_TOLERANCE,
+            "density_tolerance": seawater.DENSITY_TOLERANCE,
+        }
+        settings.update((getattr(self, "config", None) or {}).get("consistency") or {})
+        return settings
+
+    @property
+    def result_cache(self):
+        """
+        Returns the QC result cache settings of the configuration: whether
+        results are cached, the size of the largest result cached and how
+        long results are kept
+        """
+        settings = {
+            "enabled": False,
+            "max_bytes": result_cache.MAX_BYTES,
+            "ttl": result_cache.CACHE_TTL,
+        }
+        settings.update((getattr(self, "config", None) or {}).get("result_cache") or {})
+        return settings
+
+    @property
+    def climatology(self):
+        """
+        Returns the regional climatology test settings of the configuration:
+        the climatology index paths by standard name and the standard
+        deviations beyond which samples are suspect or failed
+        """
+        settings = {
+            "indexes": {},
+            "suspect_sigma": climatology.SUSPECT_SIGMA,
+            "fail_sigma": climatology.FAIL_SIGMA,
+        }
+        settings.update((getattr(self, "config", None) or {}).get("climatology") or {})
+        return settings
+
     def needs_qc(self, ncvariable):
         """
         Returns True if the variable has no associated QC variables
@@ -98,11 +436,14 @@ class GliderQC(object):
 
         return valid_variables
 
-    def create_qc_variables(self, ncvariable):
+    def create_qc_variables(self, ncvariable, plan=None):
         """
         Returns a list of variable names for the newly created variables for QC flags
 
         :param ncvariable: netCDF4.Variable
+        :param plan: FlagWritePlan the variables are added to (optional).  If
+                     not provided, the variables are written right away with
+                     NOT_EVALUATED flags.
         """
         name_value = ncvariable.name
         standard_name_value = ncvariable.standard_name
@@ -137,36 +478,36 @@ class GliderQC(object):
         }
 
         qcvariables = []
+        commit = plan is None
+        if commit:
+            plan = FlagWritePlan(self.ncfile, self.flag_storage)
 
         for tname, template in list(templates.items()):
             variable_name = template["name"].format(name=name_value)
-
-            if variable_name not in self.ncfile.variables:
-                ncvar = self.ncfile.createVariable(
-                    variable_name, np.int8, dims, fill_value=np.int8(-128)
-                )
-            else:
-                ncvar = self.ncfile.variables[variable_name]
-
-            ncvar[:] = np.full(len(ncvariable[:]), 2)
-            ncvar.units = "1"
-            ncvar.standard_name = template["standard_name"]
-            ncvar.long_name = template["long_name"].format(
-                standard_name=standard_name_value
+            plan.add_variable(
+                variable_name,
+                dims,
+                {
+                    "units": "1",
+                    "standard_name": template["standard_name"],
+                    "long_name": template["long_name"].format(
+                        standard_name=standard_name_value
+                    ),
+                    "flag_values": np.array([1, 2, 3, 4, 9], dtype=np.int8),
+                    "valid_min": np.int8(1),
+                    "valid_max": np.int8(9),
+                    "flag_meanings": "PASS NOT_EVALUATED SUSPECT FAIL MISSING",
+                    "references": "https://cdn.ioos.noaa.gov/media/2017/12/Manual-for-QC-of-Glider-Data_05_09_16.pdf",
+                    "qartod_package": "https://github.com/ioos/ioos_qc/blob/main/ioos_qc/qartod.py",
+                    "dac_comment": "QARTOD TEST RUN",
+                    "ioos_category": "Quality",
+                },
+                parent=name_value,
             )
-            ncvar.flag_values = np.array([1, 2, 3, 4, 9], dtype=np.int8)
-            ncvar.valid_min = np.int8(1)
-            ncvar.valid_max = np.int8(9)
-            ncvar.flag_meanings = "PASS NOT_EVALUATED SUSPECT FAIL MISSING"
-            ncvar.references = "https://cdn.ioos.noaa.gov/media/2017/12/Manual-for-QC-of-Glider-Data_05_09_16.pdf"
-            ncvar.qartod_package = (
-                "https://github.com/ioos/ioos_qc/blob/main/ioos_qc/qartod.py"
-            )
-            ncvar.dac_comment = "QARTOD TEST RUN"
-            ncvar.ioos_category = "Quality"
-
             qcvariables.append(variable_name)
-            self.append_ancillary_variable(ncvariable, ncvar)
+
+        if commit:
+            plan.commit()
 
         return qcvariables
 
@@ -230,7 +571,60 @@ class GliderQC(object):
 
         return variables, " ".join(report_list)
 
-    def get_rate_of_change_threshold(self, values, times):
+    def threshold_statistics(self, values, times):
+        """
+        Returns the statistics used for the spike and rate of change test
+        thresholds, computed in one vectorized pass for every variable.
+
+        :param values: 2-D numpy array with one row of values per variable
+        :param times: numpy array of times shared by the variables
+
+        :return: engine.ThresholdStats with one row per variable
+        """
+        return engine.threshold_statistics(values, times)
+
+    def deployment_threshold_statistics(self, ncfile_path, varnames, values, times, stats):
+        """
+        Merges the file's threshold statistics into the deployment-wide running
+        statistics and returns the latter, so that the thresholds of every file
+        of a deployment come from all of its files QC'ed so far.  Falls back
+        to the file's own statistics if Redis cannot be reached.  The
+        thresholds therefore depend on the files QC'ed before, the snapshot of
+        the statistics is stored with the spike and rate of change test
+        configurations.
+
+        :param ncfile_path: string defining path to the netCDF file
+        :param varnames: list of variable names, one per row of values
+        :param values: 2-D numpy array with one row of values per variable
+        :param times: numpy array of times shared by the variables
+        :param stats: engine.ThresholdStats of values
+
+        :return: tuple of the engine.ThresholdStats with one row per variable
+                 and a dict of variable name to its statistics snapshot
+        """
+        deployment_dir, file_name = os.path.split(ncfile_path)
+        store = DeploymentStats(get_redis_connection(), deployment_dir)
+        try:
+            merged = [
+                store.update(varname, file_name, stats.variable(index), values[index], times)
+                for index, varname in enumerate(varnames)
+            ]
+        except redis.RedisError as e:
+            log.warning(
+                "Could not update the deployment statistics of %s, "
+                "using the file's statistics: %s", ncfile_path, e
+            )
+            return stats, {}
+
+        stats = stats._replace(
+            count=np.array([m.values.count for m in merged]),
+            mean=np.array([m.values.mean for m in merged]),
+            std=np.array([m.values.std for m in merged]),
+            max_rate=np.array([m.rate_threshold for m in merged]),
+        )
+        return stats, {varname: m.snapshot() for varname, m in zip(varnames, merged)}
+
+    def get_rate_of_change_threshold(self, values, times, stats=None):
         """
         Return the threshold used for the rate of change test
         This function calculates the maximum rate of change between consecutive values
@@ -238,6 +632,7 @@ class GliderQC(object):
 
         :param values: numpy array of values
         :param times: numpy array of times
+        :param stats: engine.ThresholdStats of values (optional), computed if not provided
 
         :return: float value representing the maximum rate of change
         :return: string of report_list of encountered issues
@@ -252,24 +647,18 @@ class GliderQC(object):
             )
             return None, " ".join(report_list)
 
-        if np.sum(~np.isnan(values)) > 1:  # Check if there are at least 2 valid values
-            std = np.nanstd(values)
-            mean = np.nanmean(values)
-        else:
+        if stats is None:
+            stats = self.threshold_statistics(values, times).variable(0)
+
+        if stats.count < 2:  # Check if there are at least 2 valid values
             report_list.append(
                 "Not enough valid data points for std and mean calculations."
             )
             return None, " ".join(report_list)
 
-        list_values = []
-        list_times = []
-        for nn, xx in enumerate(values):
-            if (xx > (mean - std)) and (xx < (mean + std)):
-                list_values.append(values[nn])
-                list_times.append(times[nn])
-
-        # Ensure there are enough data points to compute the rate of change
-        if len(list_values) < 2:
+        # Ensure there were enough data points within one standard deviation
+        # to compute the rate of change
+        if np.isnan(stats.max_rate):
             log.info(
                 "Insufficient data: both 'values' and 'times' must have at least two elements."
             )
@@ -278,38 +667,32 @@ class GliderQC(object):
             )
             return None, " ".join(report_list)
 
-        # Calculate the rate of change as absolute difference between consecutive values
-        roc = np.abs(np.diff(list_values) / np.diff(list_times).astype(float))
-
         # Return the maximum rate of change
-        threshold = np.max(roc)
+        threshold = stats.max_rate
 
         return threshold, " ".join(report_list)
 
-    def get_spike_thresholds(self, values):
+    def get_spike_thresholds(self, values, stats=None):
         """
         Return the min/max thresholds used for the spike test.
 
         :param values: numpy array of values
+        :param stats: engine.ThresholdStats of values (optional), computed if not provided
 
         :return: tuple of (suspect_threshold, fail_threshold) as np.float64
         :return: string of report_list of encountered issues
         """
         report_list = []
-        # If values is not a numpy array, convert it to one
-        if not isinstance(values, np.ndarray):
-            values = np.asarray(values)
+        if stats is None:
+            stats = self.threshold_statistics(values, np.arange(len(values))).variable(0)
 
         # Check if there are at least 2 valid values
-        # remove nan
-        valid_values = [x for x in values if not np.isnan(x)]
-
-        if len(valid_values) < 2:
+        if stats.count < 2:
             log.info("Not enough valid data for variance calculation.")
             report_list.append("Not enough valid data for std calculation.")
             return None, None, " ".join(report_list)
         else:
-            std = np.nanstd(valid_values)
+            std = stats.std
 
         # Define the suspect and fail thresholds
         suspect_threshold = np.float64(1.0 * std)
@@ -318,7 +701,7 @@ class GliderQC(object):
         return suspect_threshold, fail_threshold, " ".join(report_list)
 
     @classmethod
-    def normalize_variable(cls, values, units, standard_name):
+    def normalize_variable(cls, values, units, standard_name, inplace=False):
         """
         Returns an array of values that are converted into a standard set of
         units. The motivation behind this is so that we compare values of the
@@ -327,6 +710,7 @@ class GliderQC(object):
         :param values: numpy array of values
         :param units: string defining units
         :param standard_name: string defining the variable's CF compliant name
+        :param inplace: boolean, convert a float64 values array in place instead of copying it
 
         :return report_list: a string logging issues encountered
         :return converted: numpy array of converted values
@@ -358,8 +742,8 @@ class GliderQC(object):
         # Get the target unit for conversion
         target_unit = mapping[standard_name]
         try:
-            # Perform the unit conversion (make sure the `Unit` class and its method are correct)
-            converted = Unit(units).convert(values, target_unit)
+            # Perform the unit conversion with the cached converter
+            converted = get_converter(units, target_unit)(values, inplace=inplace)
         except Exception as e:
             # log in error if conversion fails
             log.info(
@@ -394,7 +778,7 @@ class GliderQC(object):
         # Save the updated list back as a space-separated string
         parent.ancillary_variables = " ".join(ancillary_variables)
 
-    def update_config(self, varspec, varname, times, values, time_units):
+    def update_config(self, varspec, varname, times, values, time_units, stats=None):
         """
         Update the input config file with specs values for the spike
         and the gross range test methods
@@ -404,6 +788,8 @@ class GliderQC(object):
         :param times: numpy array of times
         :param values: numpy array of values
         :param time_units: string defining time units
+        :param stats: engine.ThresholdStats of values[1:-1] (optional),
+                      computed if not provided
 
         :return dictionary with configuration specs for qc
         :return string report_list with encountered issues
@@ -412,7 +798,11 @@ class GliderQC(object):
         # Calculate the spike test threshold
         # do not use the 1st and last data values in calculation
         values = values[1:-1]
-        (suspect_threshold, fail_threshold, inote) = self.get_spike_thresholds(values)
+        if stats is None:
+            stats = self.threshold_statistics(values, times).variable(0)
+        (suspect_threshold, fail_threshold, inote) = self.get_spike_thresholds(
+            values, stats
+        )
         if suspect_threshold is None or fail_threshold is None:
             report_list.append(f"spike_test dropped for {varname}: {inote}")
             if "spike_test" in varspec:
@@ -426,7 +816,7 @@ class GliderQC(object):
             varspec["spike_test"]["fail_threshold"] = np.float64(fail_threshold)
 
         # Calculate the rate of change test threshold
-        threshold, inote = self.get_rate_of_change_threshold(values, times)
+        threshold, inote = self.get_rate_of_change_threshold(values, times, stats)
         if threshold is None:
             report_list.append(f"rate_of_change_test dropped for {varname}: {inote}")
             if "rate_of_change_test" in varspec:
@@ -491,6 +881,69 @@ class GliderQC(object):
 
         return results_store
 
+    def apply_qc_combined(self, times, normalized, configsets, ncfile_path):
+        """
+        Pass the configurations of several variables sharing a time axis to
+        ioos_qc at once, in a single DataFrame, Config and PandasStream run.
+        The results are split back per variable, each with its own rollup,
+        as apply_qc would have returned them one variable at a time.
+
+        :param times: numpy datetime64 array of times
+        :param normalized: dict of variable name to numpy array of values
+        :param configsets: dict of variable name to the configuration
+                           returned by update_config
+        :param ncfile_path: string defining path to the netCDF file
+        :return: dict of variable name to a dict of results column name to
+                 numpy flag array, empty if the run failed
+        """
+        streams = {
+            varname: configset["contexts"][0]["streams"][varname]
+            for varname, configset in configsets.items()
+        }
+        try:
+            df = pd.DataFrame(
+                {"time": times, **{varname: normalized[varname] for varname in streams}},
+                copy=False,
+            )
+            qc_x = PandasStream(df)
+            store = PandasStore(qc_x.run(Config({"contexts": [{"streams": streams}]})))
+            # the rollup is per variable, not over every stream of the store
+            results_store = store.save(write_data=False, write_axes=False)
+        except Exception as e:
+            log.error(f"Error running combined QC tests on {ncfile_path}: {e}")
+            return {}
+
+        results = {}
+        for varname, stream in streams.items():
+            columns = {}
+            for testname in stream["qartod"]:
+                column = engine.result_column(varname, testname)
+                if column in results_store:
+                    columns[column] = results_store[column].to_numpy()
+            if columns:
+                columns[engine.ROLLUP_COLUMN] = engine.rollup(list(columns.values()))
+            results[varname] = columns
+        return results
+
+    def apply_qc_arrays(self, times, values, varname, configset):
+        """
+        Generate QC test results for a variable with the direct-array engine.
+        Returns the same results columns as apply_qc without building a
+        DataFrame, Config, PandasStream or PandasStore.
+
+        :param times: numpy datetime64 array of times
+        :param values: numpy array of values
+        :param varname: string defining the variable name
+        :param configset: dictionary with variable config specs for each QARTOD test
+        :return: dict of results column name to numpy flag array
+        """
+        varspec = configset["contexts"][0]["streams"][varname]["qartod"]
+        try:
+            return engine.run_qartod(varname, values, times, varspec)
+        except Exception as e:
+            log.error(f"Error running QC tests on {varname}: {e}")
+            return {}
+
     def _classify_single_unique_value(self, inp, unique_vals):
         """
         Classify a single unique value in a variable array.
@@ -519,18 +972,20 @@ class GliderQC(object):
 
         return None
 
-    def check_geophysical_variables(self, var_name):
+    def check_geophysical_variables(self, var_name, data=None):
         """
         Check the data array for the specified geophysical variable.
 
         :param var_name: variable name (str)
+        :param data: masked array already read from the variable (optional)
         :return: report_list (str) containing encountered issues
         """
         report_list = []
 
         # Access the variable
         inp = self.ncfile.variables[var_name]
-        data = inp[:]
+        if data is None:
+            data = inp[:]
 
         # Check if valid_min and valid_max exist and are correctly ordered
         valid_min = getattr(inp, "valid_min", None)
@@ -564,12 +1019,272 @@ class GliderQC(object):
 
         return " ".join(report_list)
 
+    def consistency_variables(self, variables):
+        """
+        Returns the variables of the consistency check: a tuple of the
+        temperature, conductivity and pressure variable names, and a dict of
+        the salinity and density variable names to the name of their
+        consistency flag variable.  Returns None if any of them is missing.
+
+        :param variables: list of the normalized variable names
+        """
+        by_standard_name = {}
+        for varname in variables:
+            standard_name = getattr(self.ncfile.variables[varname], "standard_name", None)
+            by_standard_name.setdefault(standard_name, []).append(varname)
+        if not all(name in by_standard_name for name in CONSISTENCY_INPUTS):
+            return None
+        inputs = tuple(by_standard_name[name][0] for name in CONSISTENCY_INPUTS)
+        targets = {
+            varname: f"qartod_{varname}_consistency_flag"
+            for name in CONSISTENCY_TARGETS
+            for varname in by_standard_name.get(name, [])
+        }
+        if not targets:
+            return None
+        return inputs, targets
+
+    def create_consistency_variables(self, targets, plan):
+        """
+        Plans the consistency flag variables of the salinity and density
+        variables
+
+        :param targets: dict of variable name to flag variable name, see
+                        consistency_variables
+        :param plan: FlagWritePlan the variables are added to
+        """
+        settings = self.consistency
+        for varname, flagname in targets.items():
+            ncvariable = self.ncfile.variables[varname]
+            tolerance = settings[f"{CONSISTENCY_TARGETS[ncvariable.standard_name]}_tolerance"]
+            plan.add_variable(
+                flagname,
+                ncvariable.dimensions,
+                {
+                    "units": "1",
+                    "standard_name": "quality_flag",
+                    "long_name": (
+                        f"Consistency Flag for {ncvariable.standard_name} with "
+                        "temperature, conductivity and pressure"
+                    ),
+                    "flag_values": np.array([1, 2, 3, 4, 9], dtype=np.int8),
+                    "valid_min": np.int8(1),
+                    "valid_max": np.int8(9),
+                    "flag_meanings": "PASS NOT_EVALUATED SUSPECT FAIL MISSING",
+                    "references": "UNESCO Technical Papers in Marine Science 44 (1983)",
+                    "dac_comment": (
+                        "The SUSPECT flag is applied if the value differs by more "
+                        f"than {tolerance} from the PSS-78 practical salinity or "
+                        "EOS-80 density derived from the temperature, conductivity "
+                        "and pressure"
+                    ),
+                    "ioos_category": "Quality",
+                },
+                parent=varname,
+            )
+
+    def consistency_flags(self, inputs, targets, values):
+        """
+        Returns the consistency flags of the salinity and density variables,
+        derived from the temperature, conductivity and pressure in one
+        vectorized pass
+
+        :param inputs: tuple of the temperature, conductivity and pressure
+                       variable names, see consistency_variables
+        :param targets: dict of the salinity and density variable names to
+                        their flag variable name
+        :param values: dict of variable name to the normalized values
+        :return: dict of variable name to int8 array of flags
+        """
+        settings = self.consistency
+        temperature, conductivity, pressure = (values[name] for name in inputs)
+        salinity = seawater.practical_salinity(conductivity, temperature, pressure)
+        derived = {
+            "salinity": salinity,
+            "density": seawater.density(salinity, temperature, pressure),
+        }
+        flags = {}
+        for varname in targets:
+            ncvariable = self.ncfile.variables[varname]
+            kind = CONSISTENCY_TARGETS[ncvariable.standard_name]
+            submitted = values[varname]
+            if kind == "salinity":
+                # practical salinity is dimensionless, its values are on the
+                # PSS-78 scale whatever the units label ("1", "1e-3" or "psu")
+                # normalize_variable scaled them by
+                units = "1" if ncvariable.units == "psu" else ncvariable.units
+                submitted = submitted / get_converter(units, "1").scale
+            flags[varname] = seawater.consistency_flags(
+                derived[kind], submitted, settings[f"{kind}_tolerance"]
+            )
+        return flags
+
+    def check_consistency(self, values, plan):
+        """
+        Flags the submitted salinity and density as SUSPECT where they differ
+        from the values derived from the temperature, conductivity and
+        pressure by more than their tolerance
+
+        :param values: dict of variable name to the normalized values
+        :param plan: FlagWritePlan the flags are added to
+        :return: string report of the inconsistent variables
+        """
+        variables = self.consistency_variables(list(values))
+        if variables is None:
+            return ""
+        inputs, targets = variables
+        self.create_consistency_variables(targets, plan)
+        report_list = []
+        for varname, flags in self.consistency_flags(inputs, targets, values).items():
+            plan.set_data(targets[varname], flags)
+            suspect = np.count_nonzero(flags == seawater.SUSPECT)
+            if suspect:
+                report_list.append(
+                    f"{varname} is inconsistent with temperature, conductivity "
+                    f"and pressure at {suspect} samples"
+                )
+        return " ".join(report_list)
+
+    def climatology_variables(self, variables):
+        """
+        Returns the variables of the regional climatology test: the pressure
+        variable name the depth bins are looked up with, and a dict of the
+        variables with a climatology index to the name of their flag
+        variable.  Returns None if either is missing.
+
+        :param variables: list of the normalized variable names
+        """
+        indexes = self.climatology["indexes"] or {}
+        pressure, targets = None, {}
+        for varname in variables:
+            standard_name = getattr(self.ncfile.variables[varname], "standard_name", None)
+            if standard_name == "sea_water_pressure" and pressure is None:
+                pressure = varname
+            if standard_name in indexes:
+                targets[varname] = f"qartod_{varname}_regional_climatology_flag"
+        if pressure is None or not targets:
+            return None
+        return pressure, targets
+
+    def create_climatology_variables(self, targets, plan):
+        """
+        Plans the regional climatology flag variables
+
+        :param targets: dict of variable name to flag variable name, see
+                        climatology_variables
+        :param plan: FlagWritePlan the variables are added to
+        """
+        settings = self.climatology
+        for varname, flagname in targets.items():
+            ncvariable = self.ncfile.variables[varname]
+            index_path = settings["indexes"][ncvariable.standard_name]
+            plan.add_variable(
+                flagname,
+                ncvariable.dimensions,
+                {
+                    "units": "1",
+                    "standard_name": "climatology_test_quality_flag",
+                    "long_name": f"Regional Climatology Flag for {ncvariable.standard_name}",
+                    "flag_values": np.array([1, 2, 3, 4, 9], dtype=np.int8),
+                    "valid_min": np.int8(1),
+                    "valid_max": np.int8(9),
+                    "flag_meanings": "PASS NOT_EVALUATED SUSPECT FAIL MISSING",
+                    "references": "https://cdn.ioos.noaa.gov/media/2017/12/Manual-for-QC-of-Glider-Data_05_09_16.pdf",
+                    "dac_comment": (
+                        "The SUSPECT flag is applied if the value is more than "
+                        f"{settings['suspect_sigma']} standard deviations from the mean "
+                        f"of the {os.path.basename(index_path)} climatology for the "
+                        "position, pressure bin and month of the sample"
+                    ),
+                    "ioos_category": "Quality",
+                },
+                parent=varname,
+            )
+
+    def sample_positions(self, start=0, stop=None):
+        """
+        Returns the latitudes and longitudes of the samples [start:stop], the
+        profile position where they are missing
+
+        :return: tuple of numpy float64 arrays (or scalars without lat/lon
+                 time series)
+        """
+        positions = []
+        for name in ("lat", "lon"):
+            profile = self.ncfile.variables.get(f"profile_{name}")
+            fill = np.nan
+            if profile is not None and profile.size == 1:
+                fill = fill_masked(np.ma.atleast_1d(profile[...]))[0]
+            ncvariable = self.ncfile.variables.get(name)
+            if ncvariable is not None and ncvariable.dimensions == ("time",):
+                values = fill_masked(ncvariable[start:stop])
+                values[np.isnan(values)] = fill
+            else:
+                values = fill
+            positions.append(values)
+        return tuple(positions)
+
+    def climatology_flags(self, pressure, targets, values, datetimes, positions):
+        """
+        Returns the regional climatology flags of the variables, looked up in
+        their memory-mapped climatology index with one gather per variable
+
+        :param pressure: pressure variable name, see climatology_variables
+        :param targets: dict of the variable names to their flag variable name
+        :param values: dict of variable name to the normalized values
+        :param datetimes: numpy datetime64 array of the sample times
+        :param positions: tuple of the sample latitudes and longitudes, see
+                          sample_positions
+        :return: dict of variable name to int8 array of flags
+        """
+        settings = self.climatology
+        lat, lon = positions
+        flags = {}
+        for varname in targets:
+            standard_name = self.ncfile.variables[varname].standard_name
+            index = climatology.load_index(settings["indexes"][standard_name])
+            mean, std = index.lookup(lat, lon, values[pressure], datetimes)
+            flags[varname] = climatology.climatology_flags(
+                values[varname], mean, std, settings["suspect_sigma"], settings["fail_sigma"]
+            )
+        return flags
+
+    def check_climatology(self, values, datetimes, plan):
+        """
+        Flags the samples of the variables with a climatology index that are
+        far from the climatology of their position, depth and month
+
+        :param values: dict of variable name to the normalized values
+        :param datetimes: numpy datetime64 array of the sample times
+        :param plan: FlagWritePlan the flags are added to
+        :return: string report of the variables outside their climatology
+        """
+        variables = self.climatology_variables(list(values))
+        if variables is None:
+            return ""
+        pressure, targets = variables
+        self.create_climatology_variables(targets, plan)
+        report_list = []
+        flags = self.climatology_flags(
+            pressure, targets, values, datetimes, self.sample_positions()
+        )
+        for varname, varflags in flags.items():
+            plan.set_data(targets[varname], varflags)
+            outside = np.count_nonzero(
+                (varflags == climatology.SUSPECT) | (varflags == climatology.FAIL)
+            )
+            if outside:
+                report_list.append(
+                    f"{varname} is outside its regional climatology at {outside} samples"
+                )
+        return " ".join(report_list)
+
     def create_location_flag_variable(self, ndim, flag):
         """
         Create a location test variable for the lon and lat coordinates.
 
         :param ndim: tuple or list, the dimensions of the netCDF variable (e.g., (time, lat, lon)).
-        :param flag: integer, the flag value to assign to the location test variable.
+        :param flag: integer or array of flags to assign to the location test variable.
 
         :returns: netCDF variable, the created location test flag variable.
         """
@@ -577,11 +1292,16 @@ class GliderQC(object):
 
         # Create the variable with int8 type and given dimensions
         ncvar = self.ncfile.createVariable(
-            ncvar_name, np.int8, ndim, fill_value=np.int8(-128)
+            ncvar_name,
+            np.int8,
+            ndim,
+            fill_value=np.int8(-128),
+            **storage_options(self.ncfile, "profile_lat", self.flag_storage),
         )
 
-        # Assign flag value to the whole array (assuming flag is a scalar)
-        ncvar[:] = flag
+        # Assign the flags, a scalar flag is assigned to the whole array
+        ncvar[...] = flag
+        self.timings.written(ncvar.size)
 
         # Set additional attributes
         ncvar.units = "1"
@@ -610,48 +1330,35 @@ class GliderQC(object):
 
     def check_location(self):
         """
-        Check the glider track lon and lat coordinates for outliers.
-        If an outlier is detected:
-            - Copy the profile_lat/lon variables onto new variables to preserve the original data.
-            - Replace the profile_lat/lon data with the median of the lat or lon arrays.
+        Check the glider track lon and lat coordinates for outliers: every
+        profile_(lat, lon) position is flagged FAIL if it is 2 miles or more
+        (great-circle distance) from the mean of the lat/lon arrays, and
+        MISSING if it is NaN or masked.
 
         :return: report_list: string statement reporting on issues
         """
         report_list = []
-        profile_lat = self.ncfile.variables["profile_lat"][0]
-        profile_lon = self.ncfile.variables["profile_lon"][0]
-        lat = self.ncfile.variables["lat"][:]
-        lon = self.ncfile.variables["lon"][:]
-
-        # Check if lat/lon are not NaN or masked
-        if not (
-            np.isnan(profile_lat)
-            or np.ma.is_masked(profile_lat)
-            or np.isnan(profile_lon)
-            or np.ma.is_masked(profile_lon)
-        ):
-            poly = self.watch_circle(
-                np.nanmean(lat), np.nanmean(lon), 2.0, num_points=72
-            )
-            set_flag = self.is_point_outside_polygon(profile_lat, profile_lon, poly)
+        profile_lat, profile_lon, center_lat, center_lon = location.read_track(
+            self.ncfile
+        )
+        flags = location.location_flags(profile_lat, profile_lon, center_lat, center_lon)
 
-            if set_flag:
-                flag = 4  # FAIL
-                log.info(
-                    f"profile_lat={profile_lat}, profile_lon={profile_lon} are outside the polygon"
-                )
-                report_list.append("error in glider track lat/lon")
-            else:
-                flag = 1  # PASS
-        else:
-            flag = 9  # MISSING
+        if (flags == location.FAIL).any():
+            log.info(
+                f"profile_lat={profile_lat}, profile_lon={profile_lon} are outside the watch circle"
+            )
+            report_list.append("error in glider track lat/lon")
+        missing = flags == location.MISSING
+        if missing.any():
             report_list.append(
-                f"profile_lat={profile_lat}, profile_lon={profile_lon} are missing"
+                f"profile_lat={profile_lat[missing][0]}, profile_lon={profile_lon[missing][0]} are missing"
             )
 
         # Create location test variable to store the test flag
         ndim = self.ncfile.variables["profile_lat"].dimensions
-        location_flag_variable = self.create_location_flag_variable(ndim, flag)
+        location_flag_variable = self.create_location_flag_variable(
+            ndim, flags.reshape(self.ncfile.variables["profile_lat"].shape)
+        )
 
         # Store location test variable under the ancillary_variables attribute
         self.ncfile.variables[
@@ -663,156 +1370,39 @@ class GliderQC(object):
 
         return " ".join(report_list)
 
-    def watch_circle(self, center_lat, center_lon, radius_miles, num_points=128):
-        """
-        Approximate a small geodesic circle around (center_lat, center_lon).
-        Returns list of (lat, lon) tuples (closed: first == last).
-        Suitable for small radii like 2 miles.
-        """
-        # 1 degree latitude ≈ 69.172 miles
-        miles_per_deg_lat = 69.172
-        delta_lat_deg = radius_miles / miles_per_deg_lat
-
-        lat_rad = math.radians(center_lat)
-        cos_lat = math.cos(lat_rad)
-        # avoid zero
-        miles_per_deg_lon = miles_per_deg_lat * max(abs(cos_lat), 1e-12)
-        delta_lon_deg = radius_miles / miles_per_deg_lon
-
-        points = []
-        for i in range(num_points):
-            theta = 2 * math.pi * i / num_points
-            dlat = delta_lat_deg * math.sin(theta)
-            dlon = delta_lon_deg * math.cos(theta)
-            lat = center_lat + dlat
-            lon = center_lon + dlon
-            # normalize lon
-            if lon > 180:
-                lon -= 360
-            if lon < -180:
-                lon += 360
-            points.append((lat, lon))
-        points.append(points[0])
-        return points
-
-    def is_point_outside_polygon(self, point_lat, point_lon, polygon_points):
-        """
-        polygon_points: list of (lat, lon) tuples (closed: first==last or not)
-        shapely expects (lon, lat) ordering
-        """
-        poly = Polygon([(lon, lat) for lat, lon in polygon_points])
-        pt = Point(point_lon, point_lat)
-        return not poly.contains(pt)
-
     def check_time(self, tnp, nc_path):
         """
         Check the time array for data start time inconsistent with the deployment start time,
         invalid timestamps, duplicate timestamps, and non-ascending timestamps.
+        The diagnostics of the checks are kept in the time_diagnostics attribute.
 
         :param tnp: time array (numpy.ma.core.MaskedArray)
         :param nc_path: netCDF file path (str)
         :return: report_list: string statement reporting on issues
         """
-
         report_list = []
+        diagnostics = self.time_diagnostics = time_diagnostics(tnp)
+        if any(diagnostics):
+            log.info("Time axis diagnostics of %s: %s", nc_path, diagnostics)
+
         # Check if any timestamps are masked
-        if np.any(tnp.mask):
+        if diagnostics.masked:
             log.info("Timestamps are masked")
-            report_list.append("masked timestamps")
+            report_list.append(f"masked timestamps {diagnostics.masked}")
             return ' '.join(report_list)
 
-        # Regex: 8 digits optionally followed by T + 2/4/6 digits, optional trailing Z/z
-        pat = re.compile(r'(?<!\d)(\d{8}(?:[Tt]\d{2}(?:\d{2}(?:\d{2})?)?)?[Zz]?)(?!\d)')
-
-        DEFAULT_MIN_YEAR = 1998 # the first ocean sea trials / deployment of a glider.
-        DEFAULT_MAX_YEAR = datetime.datetime.now().year  # use "now" at runtime
-
-        def extract_normalized_no_z(filename: str) -> Optional[str]:
-            """
-            Return normalized timestamp 'YYYYmmddTHHMMSS' (no trailing Z).
-            Padding:
-              - 'YYYYmmdd' -> 'YYYYmmddT000000'
-              - 'YYYYmmddTHH' -> 'YYYYmmddTHH0000'
-              - 'YYYYmmddTHHMM' -> 'YYYYmmddTHHMM00'
-              - 'YYYYmmddTHHMMSS' -> unchanged
-            """
-            name = Path(filename).name
-            m = pat.search(name)
-            if not m:
-                return None
-            token = m.group(1).upper()
-            if token.endswith('Z'):
-                token = token[:-1]
-            if 'T' not in token:
-                return f"{token}T000000"
-            date, time_part = token.split('T', 1)
-            if len(time_part) == 2:      # HH -> HH0000
-                time_part = time_part + '0000'
-            elif len(time_part) == 4:    # HHMM -> HHMM00
-                time_part = time_part + '00'
-            elif len(time_part) == 6:    # HHMMSS -> ok
-                pass
-            else:
-                return None
-            return f"{date}T{time_part}"
-
-        def validate_and_enforce_ranges(norm_no_z: str, min_year: int, max_year: int) -> datetime.datetime:
-            """
-            Validate normalized 'YYYYmmddTHHMMSS' with datetime.strptime, and enforce year bounds:
-              - min_year <= year <= max_year
-            All other range and calendar checks (month, day, hour, minute, second, e.g. April 31)
-            are handled automatically by strptime.
-            Returns timezone-aware datetime (UTC) on success.
-            Raises ValueError with a descriptive message on failure.
-            """
-            if len(norm_no_z) != 15 or norm_no_z[8] != 'T':
-                raise ValueError(f"Normalized token not in expected format YYYYmmddTHHMMSS: {norm_no_z!r}")
-
-            # strptime validates all component ranges AND calendar correctness (e.g. April 31)
-            try:
-                dt = datetime.datetime.strptime(norm_no_z, "%Y%m%dT%H%M%S")
-            except ValueError:
-                raise ValueError(f"Invalid date/time values in token: {norm_no_z!r}")
-
-            # Enforce custom year bounds (strptime does not check these)
-            if dt.year < min_year:
-                raise ValueError(f"Year {dt.year} is less than minimum allowed {min_year}.")
-            if dt.year > max_year:
-                raise ValueError(f"Year {dt.year} is greater than maximum allowed {max_year}.")
-
-            # Return UTC-aware datetime
-            return dt.replace(tzinfo=timezone.utc)
-
-        def to_posix_and_np_dt(dt_utc: datetime.datetime):
-            """
-            Convert a UTC-aware datetime object to a POSIX timestamp and a NumPy datetime64.
-
-            :param dt_utc: A timezone-aware datetime object in UTC.
-            :type dt_utc: datetime.datetime
-            :returns: A tuple containing:
-                - **posix** (*float*): POSIX timestamp (seconds since Unix epoch, 1970-01-01T00:00:00Z).
-                - **np_dt** (*numpy.datetime64*): Equivalent timestamp as a NumPy datetime64 with second precision.
-            :rtype: tuple[float, numpy.datetime64]
-            """
-            posix = dt_utc.timestamp()
-            np_dt = np.datetime64(int(posix), 's')
-            return posix, np_dt
-
         deployment_name = nc_path.split('/')[-2]
-        normalized = extract_normalized_no_z(deployment_name)
-        if not normalized:
-            log.info("No timestamp found in deployment_name.")
-            report_list.append("deployment name missing valid timestamp: " + deployment_name)
-            return ' '.join(report_list)
-
         try:
-            deployment_time_utc = validate_and_enforce_ranges(normalized, DEFAULT_MIN_YEAR, DEFAULT_MAX_YEAR)
-            posix_sec, dp_time_dt = to_posix_and_np_dt(deployment_time_utc)
+            dp_time_dt = parse_deployment_time(deployment_name)
         except ValueError as exc:
             time_err = "Deployment time missing or invalid"
             log.exception(f"{time_err}: {str(exc)}")
             report_list.append(f"{time_err}: {str(exc)}")
             return ' '.join(report_list)
+        if dp_time_dt is None:
+            log.info("No timestamp found in deployment_name.")
+            report_list.append("deployment name missing valid timestamp: " + deployment_name)
+            return ' '.join(report_list)
 
         # Check if the first timestamp in the data is before the deployment time
         if dp_time_dt > tnp[0]:
@@ -821,53 +1411,70 @@ class GliderQC(object):
             return ' '.join(report_list)
 
         # Check for invalid timestamps (e.g., timestamps with value 0)
-        if np.any(tnp[:] == np.datetime64(0, 's')):
+        if diagnostics.zeros:
             log.info("Invalid timestamps (t == 0)")
-            report_list.append("timestamps assigned a value of 0")
+            report_list.append(f"timestamps assigned a value of 0 {diagnostics.zeros}")
             return " ".join(report_list)
 
-        # Only consider valid (unmasked) values
-        valid_values = tnp[~np.isnan(tnp)]
-
         # Check for duplicate timestamps
-        if len(valid_values) != len(set(valid_values)):
+        if diagnostics.duplicates:
             log.info("Duplicate timestamps")
-            report_list.append("duplicate timestamps")
+            report_list.append(f"duplicate timestamps {diagnostics.duplicates}")
             return " ".join(report_list)
 
         # Check if the timestamps are in ascending order
-        # This will check if each timestamp is less than the next one
-        # Ensure the array is of datetime64 type
-        if valid_values.dtype != "datetime64[s]":
-            valid_values = valid_values.astype("datetime64[s]")
-
-        if np.any(np.diff(valid_values) <= np.timedelta64(0, "s")):
+        if diagnostics.inversions:
             log.info("Not in Ascending Order")
-            report_list.append("timestamps out of order")
+            report_list.append(f"timestamps out of order {diagnostics.inversions}")
             return " ".join(report_list)
 
         return " ".join(report_list)
 
 
+def fill_masked(data, out=None):
+    """
+    Returns the values of a masked array as float64 with the masked values
+    set to NaN, without going through Python objects. A float64 input is
+    filled in its own buffer; other types are cast once into out, or a new
+    array.
+
+    :param data: numpy masked array (or plain numpy array)
+    :param out: float64 numpy array to write the values into (optional)
+    :return: numpy float64 array
+    """
+    values = np.ma.getdata(data)
+    mask = np.ma.getmask(data)
+    if out is None:
+        out = values.astype(np.float64, copy=False)
+    else:
+        np.copyto(out, values, casting="unsafe")
+    if mask is not np.ma.nomask:
+        out[mask] = np.nan
+    return out
+
+
 # the main function
-def run_qc(config, ncfile, ncfile_path):
+def run_qc(config, ncfile, ncfile_path, timings=None):
     """
     Runs IOOS QARTOD tests on a netCDF file
 
     :param config: string defining path to the configuration file
     :param ncfile_path: string defining path to the netCDF file
     :param ncfile: netCDF4._netCDF4.Dataset
+    :param timings: instrumentation.JobTimings of the job (optional)
     """
     report_list = []
-    xyz = GliderQC(ncfile, config)
+    xyz = GliderQC(ncfile, config, timings)
+    timings = xyz.timings
+    qc_engine = engine.get_qc_engine()
     deployment_name = ncfile_path.split('/')[-2]
     file_name = ncfile_path.split('/')[-1]
 
-    times = ncfile.variables["time"]
     # Check Time
     try:
-        dt_high = np.datetime64(int(times[:] * 1_000_000), 'us')
-        inote = xyz.check_time(dt_high.astype('datetime64[s]'), ncfile_path)
+        with timings.stage("check_time"):
+            times = xyz.time_axis
+            inote = xyz.check_time(times.masked_datetimes, ncfile_path)
         report_list.append(inote)
     except Exception as e:
         time_err = "Could not check time."
@@ -886,7 +1493,8 @@ def run_qc(config, ncfile, ncfile_path):
         # Check Location (lat/lon)
         if "qartod_location_test_flag" not in ncfile.variables:
             try:
-                report_list.append(xyz.check_location())
+                with timings.stage("check_location"):
+                    report_list.append(xyz.check_location())
             except Exception as e:
                 location_err = "Could not check location."
                 log.exception(f"{location_err}: {str(e)}")
@@ -894,9 +1502,16 @@ def run_qc(config, ncfile, ncfile_path):
 
         # Find geophysical variables
         legacy_variables, note = xyz.find_geophysical_variables()
+        chunk_size = streaming.chunk_size(xyz.config, len(times))
         if not legacy_variables:
             log.info("No variables found.")
             report_list.append("No variables found.")
+        elif chunk_size:
+            # Large files are read, tested and written a chunk at a time
+            report_list.append(note)
+            report_list.append(
+                streaming.run_chunked_qc(xyz, legacy_variables, times, chunk_size)
+            )
         else:
             log.info(
                 "Found %s variables for QARTOD tests: %s",
@@ -906,103 +1521,331 @@ def run_qc(config, ncfile, ncfile_path):
             # Report legacy variables issues
             report_list.append(note)
 
-            # Loop through the legacy variables and apply QARTOD
-            for var_name in legacy_variables:
-                var_data = ncfile.variables[var_name]
-                values = [x if x != "--" else np.nan for x in var_data[:]]
-
-                # Create the QARTOD variables
-                qcvarname = xyz.create_qc_variables(var_data)
-                log.info(
-                    "Created %s QC Variables for %s", str(len(qcvarname)), var_name
-                )
-
-                # Check the Data Array
-                if xyz.check_geophysical_variables(var_name):  # cfile,
-                    report_list.append(xyz.check_geophysical_variables(var_name))
-                    continue
-
-                # Check the mapping of standard names with units
-                try:
-                    values, note = xyz.normalize_variable(
-                        np.array(values[:]), var_data.units, var_data.standard_name
+            # Loop through the legacy variables and normalize their data.
+            # Each variable is read once and ingested into its own row of a
+            # float64 block, which is then normalized, used for the threshold
+            # statistics and passed to the QARTOD tests without further copies.
+            # The first nctx columns hold the trailing samples of the previous
+            # file of the deployment, so that the tests see across the file
+            # boundary; flags are only written for the file's own samples.
+            context_window = xyz.config.get("context_window", 0)
+            deployment_dir = os.path.dirname(ncfile_path)
+            with context_lock(get_redis_connection(), deployment_dir, context_window) as usable:
+                if not usable:
+                    context_window = 0
+                    report_list.append(
+                        "QC context of the deployment locked by another job, not used."
                     )
-                    report_list.append(note)
-                    if values is None:
-                        continue
-                except Exception as e:
-                    unit_conversion_err = (
-                        "Could not normalize data: unit conversion failed."
+                ntimes = len(times)
+                stored_context = context = ContextWindow()
+                if context_window:
+                    with timings.stage("context"):
+                        stored_context = ContextWindow.load(deployment_dir)
+                        context = stored_context.preceding(times.seconds, context_window)
+                nctx = len(context)
+                qc_times = np.concatenate([context.datetimes, times.datetimes])
+                block = np.empty((len(legacy_variables), nctx + ntimes), dtype=np.float64)
+                normalized = {}
+                # Flag variables, attributes and flags are all written at the end
+                plan = FlagWritePlan(ncfile, xyz.flag_storage)
+                for var_name in legacy_variables:
+                    var_data = ncfile.variables[var_name]
+                    with timings.stage("read"):
+                        raw = var_data[:]
+                    timings.read(var_name, raw.nbytes, raw.size)
+
+                    # Create the QARTOD variables
+                    qcvarname = xyz.create_qc_variables(var_data, plan)
+                    log.info(
+                        "Planned %s QC Variables for %s", str(len(qcvarname)), var_name
                     )
-                    log.exception(f"{unit_conversion_err}: {str(e)}")
-                    report_list.append(f"{unit_conversion_err}: {str(e)}")
-                    continue
 
-                # Update variable config set
-                var_spec = xyz.config["contexts"][0]["streams"][var_name]["qartod"]
-                config_set, note = xyz.update_config(
-                    var_spec,
-                    var_name,
-                    times[:].astype("datetime64[s]"),
-                    values,
-                    times.units,
-                )
-                report_list.append(note)
-
-                # create a datafarame for the QARTOD process
-                df = pd.DataFrame(
-                    {
-                        "time": times[:].astype("datetime64[s]"),
-                        var_name: values,
-                    },
-                )
+                    # Check the Data Array
+                    note = xyz.check_geophysical_variables(var_name, raw)
+                    if note:
+                        report_list.append(note)
+                        continue
+                    if raw.shape != (ntimes,):
+                        log.info("%s is not a time series, skipping", var_name)
+                        report_list.append(f"{var_name} does not match the time dimension")
+                        continue
 
-                # Get the QARTOD results
-                try:
-                    results = xyz.apply_qc(df,var_name, config_set, ncfile_path)
-                    log.info("Generated QC test results for %s", var_name)
+                    # Check the mapping of standard names with units
+                    try:
+                        row = block[len(normalized)]
+                        with timings.stage("normalize_variable"):
+                            values = fill_masked(raw, out=row[nctx:])
+                            values, note = xyz.normalize_variable(
+                                values, var_data.units, var_data.standard_name, inplace=True
+                            )
+                        report_list.append(note)
+                        if values is None:
+                            continue
+                        row[:nctx] = context.row(var_name)
+                    except Exception as e:
+                        unit_conversion_err = (
+                            "Could not normalize data: unit conversion failed."
+                        )
+                        log.exception(f"{unit_conversion_err}: {str(e)}")
+                        report_list.append(f"{unit_conversion_err}: {str(e)}")
+                        continue
 
-                    for testname in results.columns:
-                        # create the qartod variable name and get the config specs
-                        if testname == "qartod_rollup_qc":
-                            qartodname = "qartod_" + var_name + "_primary_flag"
+                    normalized[var_name] = row
+
+                # Calculate the spike and rate of change threshold statistics of
+                # every variable at once, without the 1st and last data values
+                snapshots = {}
+                if normalized:
+                    with timings.stage("statistics"):
+                        stats = xyz.threshold_statistics(
+                            block[: len(normalized), nctx + 1:-1],
+                            times.datetimes,
+                        )
+                        if xyz.config.get("threshold_statistics") == "deployment":
+                            stats, snapshots = xyz.deployment_threshold_statistics(
+                                ncfile_path,
+                                list(normalized),
+                                block[: len(normalized), nctx + 1:-1],
+                                times.datetimes,
+                                stats,
+                            )
+
+                # Update the config sets of the normalized variables
+                config_sets = {}
+                for index, (var_name, values) in enumerate(normalized.items()):
+                    var_spec = xyz.config["contexts"][0]["streams"][var_name]["qartod"]
+                    with timings.stage("update_config"):
+                        config_set, note = xyz.update_config(
+                            var_spec,
+                            var_name,
+                            times.datetimes,
+                            values[nctx:],
+                            times.units,
+                            stats.variable(index),
+                        )
+                    report_list.append(note)
+                    config_sets[var_name] = config_set
+
+                # With single_pass, ioos_qc runs the tests of every variable in
+                # one stream evaluation over the shared time index.  Variables
+                # are run one at a time if that fails.
+                combined = {}
+                if config_sets and qc_engine != "numpy" and xyz.config.get("single_pass"):
+                    with timings.stage("apply_qc"):
+                        combined = xyz.apply_qc_combined(
+                            qc_times, normalized, config_sets, ncfile_path
+                        )
+
+                # Loop through the normalized variables and apply QARTOD
+                for var_name, config_set in config_sets.items():
+                    values = normalized[var_name]
+
+                    # Get the QARTOD results
+                    try:
+                        with timings.stage("apply_qc"):
+                            if var_name in combined:
+                                results = combined[var_name]
+                            elif qc_engine == "numpy":
+                                results = xyz.apply_qc_arrays(
+                                    qc_times,
+                                    values,
+                                    var_name,
+                                    config_set,
+                                )
+                            else:
+                                # create a datafarame for the QARTOD process
+                                df = pd.DataFrame(
+                                    {
+                                        "time": qc_times,
+                                        var_name: values,
+                                    },
+                                    copy=False,
+                                )
+                                results = xyz.apply_qc(df, var_name, config_set, ncfile_path)
+                        log.info("Generated QC test results for %s", var_name)
+
+                        for testname in results:
+                            # create the qartod variable name and get the config specs
+                            qartodname, qartod_test = engine.flag_variable_name(
+                                var_name, testname
+                            )
                             # Pass the config specs to a variable
                             testconfig = config_set["contexts"][0]["streams"][var_name][
                                 "qartod"
                             ]
-                        else:
-                            qartodname = (
-                                "qartod_"
-                                + var_name
-                                + "_"
-                                + testname.split("qartod_")[-1].split("_test")[0]
-                                + "_flag"
+                            if qartod_test is not None:
+                                testconfig = testconfig[qartod_test]
+                            if qartod_test in SNAPSHOT_TESTS and var_name in snapshots:
+                                testconfig = dict(
+                                    testconfig, **{STATISTICS_SNAPSHOT: snapshots[var_name]}
+                                )
+
+                            # Update the qartod variable
+                            log.info("Updating %s", qartodname)
+                            plan.set_data(qartodname, np.asarray(results[testname])[nctx:])
+                            plan.set_attributes(
+                                qartodname,
+                                {
+                                    "qartod_test": f"{testname.split('qartod_')[-1]}",
+                                    # Set the dictionary as a string attribute to the variable
+                                    "qartod_config": json.dumps(testconfig),
+                                },
                             )
-                            # Pass the config specs to a variable
-                            testconfig = config_set["contexts"][0]["streams"][var_name][
-                                "qartod"
-                            ][testname.split("qartod_")[-1]]
-
-                        # Update the qartod variable
-                        log.info("Updating %s", qartodname)
-                        qartod_var = ncfile.variables[qartodname]
-                        qartod_var[:] = np.array(results[testname].values)
-                        qartod_var.qartod_test = f"{testname.split('qartod_')[-1]}"
 
-                        # Set the dictionary as a string attribute to the variable
-                        qartod_var.setncattr("qartod_config", json.dumps(testconfig))
+                    except Exception as e:
+                        apply_qc_err = "apply_qc failed: could not calculate QC flags."
+                        log.exception(f"{apply_qc_err}: ")
+                        report_list.append(f"{apply_qc_err}: {str(e)}")
+                        continue
 
-                except Exception as e:
-                    apply_qc_err = "apply_qc failed: could not calculate QC flags."
-                    log.exception(f"{apply_qc_err}: ")
-                    report_list.append(f"{apply_qc_err}: {str(e)}")
-                    continue
+                # Check the submitted salinity and density against the ones derived
+                # from the normalized temperature, conductivity and pressure
+                if xyz.consistency["enabled"]:
+                    try:
+                        with timings.stage("consistency"):
+                            report_list.append(
+                                xyz.check_consistency(
+                                    {name: row[nctx:] for name, row in normalized.items()},
+                                    plan,
+                                )
+                            )
+                    except Exception as e:
+                        consistency_err = "Could not check salinity and density consistency."
+                        log.exception(f"{consistency_err}: {str(e)}")
+                        report_list.append(f"{consistency_err}: {str(e)}")
+
+                # Compare the variables with a climatology index with the
+                # climatology of their position, pressure bin and month
+                if xyz.climatology["indexes"]:
+                    try:
+                        with timings.stage("climatology"):
+                            report_list.append(
+                                xyz.check_climatology(
+                                    {name: row[nctx:] for name, row in normalized.items()},
+                                    times.datetimes,
+                                    plan,
+                                )
+                            )
+                    except Exception as e:
+                        climatology_err = "Could not run the regional climatology test."
+                        log.exception(f"{climatology_err}: {str(e)}")
+                        report_list.append(f"{climatology_err}: {str(e)}")
+
+                with timings.stage("write"):
+                    timings.written(plan.commit())
+
+                # Keep the trailing samples for the next file of the deployment,
+                # unless the stored context is already more recent than this file
+                if (
+                    context_window
+                    and normalized
+                    and not stored_context.end >= np.nanmax(times.seconds)
+                ):
+                    try:
+                        with timings.stage("context"):
+                            ContextWindow.trailing(
+                                np.concatenate([context.seconds, times.seconds]),
+                                normalized,
+                                context_window,
+                            ).save(deployment_dir)
+                    except OSError as e:
+                        log.warning("Could not save the QC context of %s: %s", deployment_dir, e)
     # log issues qc
     report = " ".join(report_list).strip()
     ncfile.dac_qc_comment = (
         str(deployment_name) + " (" + str(file_name) + ": " + str(report) + ")"
     )
 
+def run_cached_qc(config, ncfile, ncfile_path, timings=None):
+    """
+    Runs IOOS QARTOD tests on a netCDF file, unless a file with the same data
+    was QC'ed with the same configuration before, in which case its cached
+    flags are written instead.  The cache is only used when enabled in the
+    configuration, the flags of a file do not depend on the files QC'ed
+    before it (see result_cache.cacheable) and the file is not QC'ed a chunk
+    at a time.  QC runs without the cache if Redis is not available.
+
+    :param config: string defining path to the configuration file, or the
+                   loaded configuration dictionary
+    :param ncfile: netCDF4._netCDF4.Dataset
+    :param ncfile_path: string defining path to the netCDF file
+    :param timings: instrumentation.JobTimings of the job (optional)
+    :return: True if the cached flags were written, False if QC was run
+    """
+    if timings is None:
+        timings = instrumentation.JobTimings(ncfile_path)
+    xyz = GliderQC(None, config)
+    settings = xyz.result_cache
+    # the digest and the cached flags of a file QC'ed a chunk at a time
+    # would not fit in memory
+    if (
+        not settings["enabled"]
+        or not result_cache.cacheable(xyz.config)
+        or streaming.is_chunked(xyz.config, ncfile)
+    ):
+        run_qc(config, ncfile, ncfile_path, timings)
+        return False
+
+    with timings.stage("cache"):
+        cache = QCResultCache.for_file(
+            get_redis_connection(),
+            ncfile,
+            ncfile_path,
+            config,
+            max_bytes=settings["max_bytes"],
+            ttl=settings["ttl"],
+        )
+        try:
+            result = cache.get()
+        except redis.RedisError as e:
+            log.warning("Could not read the QC result cache: %s", e)
+            cache = result = None
+    if result is not None:
+        log.info("Writing cached QC results to %s", ncfile_path)
+        with timings.stage("write"):
+            timings.written(apply_flags(ncfile, result, xyz.flag_storage))
+        timings.cached = True
+        return True
+
+    run_qc(config, ncfile, ncfile_path, timings)
+    if cache is not None:
+        with timings.stage("cache"):
+            try:
+                cache.store(ncfile)
+            except redis.RedisError as e:
+                log.warning("Could not store the QC results of %s: %s", ncfile_path, e)
+    return False
+
+
+def qc_sidecar(config, nc_path, merge=True, timings=None):
+    """
+    Runs QC on a netCDF file opened read-only and writes the flags to its
+    sidecar.  With merge, the file is then replaced at once by a copy
+    including the flags (see sidecar.merge_sidecar).
+
+    :param config: string defining path to the configuration file, or the
+                   loaded configuration dictionary
+    :param nc_path: string defining path to the netCDF file
+    :param merge: boolean, merge the sidecar into the file
+    :param timings: instrumentation.JobTimings of the job (optional)
+    :return: False if the file changed while QC was run, else True
+    """
+    if timings is None:
+        timings = instrumentation.JobTimings(nc_path)
+    state = sidecar.file_state(nc_path)
+    with sidecar.open_sidecar(nc_path) as nc:
+        run_cached_qc(config, nc, nc_path, timings)
+    if not merge:
+        return True
+    try:
+        with timings.stage("sidecar_merge"):
+            sidecar.merge_sidecar(nc_path, state, GliderQC(None, config).flag_storage)
+    except sidecar.SourceChangedError as e:
+        log.info("%s, QC is left to the new file", e)
+        return False
+    return True
+
+
 def qc_task(nc_path, config):
     """
     Job wrapper around performing QC
@@ -1012,6 +1855,22 @@ def qc_task(nc_path, config):
     lock = lock_file(nc_path)
     if not lock.acquire():
         raise ProcessError("File lock already acquired by another process")
+    try:
+        return qc_locked_file(nc_path, config)
+    finally:
+        lock.release()
+
+
+def qc_locked_file(nc_path, config):
+    """
+    Runs QC on a file whose lock is held by the caller and records the
+    outcome in the user.qc_run extended attribute
+    :param nc_path: string defining path to the netcdf file
+    :param config: string defining path to the configuration file, or the
+                   loaded configuration dictionary
+    :return: True if QC was run on the file, False if it was skipped or
+             failed
+    """
     # Repeat xattr check.  Consider removing when inotify loop conditions
     # where file is repeatedly picked are addressed.
     try:
@@ -1019,20 +1878,119 @@ def qc_task(nc_path, config):
             return False
     except OSError:
         pass
-    try:
-        with Dataset(nc_path, "r+") as nc:
-            run_qc(config, nc, nc_path)
-        os.setxattr(nc_path, "user.qc_run", b"true")
-    # set user_qc xattr to error to prevent continuous inotify looping on
-    # partially modified netCDF files
-    except OSError:
-        log.exception(f"Exception occurred trying to save QC to file on {nc_path}:")
-        os.setxattr(nc_path, "user.qc_run", b"error")
-    except:
-        log.exception("Other unhandled error occurred during QC:")
-        os.setxattr(nc_path, "user.qc_run", b"error")
-    finally:
-        lock.release()
+    qc = GliderQC(None, config)
+    settings = qc.instrumentation
+    connection = get_redis_connection() if settings["redis_stream"] else None
+    with instrumentation.job_timings(
+        nc_path, connection, settings["stream_maxlen"]
+    ) as timings:
+        timings.outcome = status_index.ERROR
+        try:
+            use_sidecar = qc.qc_output["mode"] == "sidecar"
+            if use_sidecar:
+                # the flags of a file QC'ed a chunk at a time are written in
+                # place, merging them from a sidecar would load them whole
+                with Dataset(nc_path) as nc:
+                    use_sidecar = not streaming.is_chunked(qc.config, nc)
+            if use_sidecar:
+                if not qc_sidecar(config, nc_path, qc.qc_output["merge"], timings):
+                    timings.outcome = "source_changed"
+                    return False
+            else:
+                with Dataset(nc_path, "r+") as nc:
+                    run_cached_qc(config, nc, nc_path, timings)
+            os.setxattr(nc_path, "user.qc_run", b"true")
+            status_index.record_status(nc_path, status_index.DONE, config)
+            timings.outcome = status_index.DONE
+            return True
+        # set user_qc xattr to error to prevent continuous inotify looping on
+        # partially modified netCDF files
+        except OSError as e:
+            log.exception(f"Exception occurred trying to save QC to file on {nc_path}:")
+            os.setxattr(nc_path, "user.qc_run", b"error")
+            status_index.record_status(nc_path, status_index.ERROR, config, str(e))
+        except BaseException as e:
+            log.exception("Other unhandled error occurred during QC:")
+            os.setxattr(nc_path, "user.qc_run", b"error")
+            status_index.record_status(nc_path, status_index.ERROR, config, str(e))
+    return False
+
+
+def qc_deployment_batch(deployment_dir, file_names, config):
+    """
+    Job wrapper around performing QC on several files of one deployment.
+    The configuration is loaded once for the whole batch, then the files are
+    processed in order, each under its own lock.
+    :param deployment_dir: string defining path to the deployment directory
+    :param file_names: list of netCDF file names in the deployment directory
+    :param config: string defining path to the configuration file
+    :return: number of files QC was run on successfully
+    :raises ProcessError: if the configuration cannot be loaded
+    """
+    qc_config = getattr(GliderQC(None, config), "config", None)
+    if not isinstance(qc_config, dict):
+        raise ProcessError(f"Could not load the QC configuration {config}")
+
+    processed = 0
+    for file_name in file_names:
+        nc_path = os.path.join(deployment_dir, file_name)
+        lock = lock_file(nc_path)
+        if not lock.acquire():
+            log.info("File lock for %s already acquired by another process, skipping", nc_path)
+            continue
+        try:
+            if qc_locked_file(nc_path, qc_config):
+                processed += 1
+        finally:
+            lock.release()
+
+    log.info(
+        "QC batch processed %s of %s files in %s", processed, len(file_names), deployment_dir
+    )
+    return processed
+
+
+def group_by_deployment(file_paths):
+    """
+    Groups netCDF file paths by their deployment directory, keeping the order
+    in which the files and deployments were first seen
+    :param file_paths: iterable of netCDF file paths
+    :return: dict of deployment directory to list of file names
+    """
+    batches = {}
+    for nc_path in file_paths:
+        deployment_dir, file_name = os.path.split(nc_path)
+        file_names = batches.setdefault(deployment_dir, [])
+        if file_name not in file_names:
+            file_names.append(file_name)
+    return batches
+
+
+def enqueue_qc_batches(queue, file_paths, config, batch_size=QC_BATCH_SIZE):
+    """
+    Enqueues one qc_deployment_batch job per deployment for the given files.
+    Deployments with more than batch_size files are split into several jobs.
+    :param queue: rq.Queue to enqueue the jobs on
+    :param file_paths: iterable of netCDF file paths that need QC
+    :param config: string defining path to the configuration file
+    :param batch_size: maximum number of files per job
+    :return: list of enqueued rq jobs
+    """
+    jobs = []
+    for deployment_dir, file_names in group_by_deployment(file_paths).items():
+        for start in range(0, len(file_names), batch_size):
+            batch = file_names[start:start + batch_size]
+            log.info("Enqueueing QARTOD batch of %s files for %s", len(batch), deployment_dir)
+            jobs.append(
+                queue.enqueue(
+                    qc_deployment_batch,
+                    deployment_dir,
+                    batch,
+                    config,
+                    job_timeout=QC_BATCH_JOB_TIMEOUT,
+                )
+            )
+    return jobs
 
 
 def lock_file(path):
@@ -1064,22 +2022,37 @@ def get_redis_connection():
 
 def check_needs_qc(nc_path):
     """
-    Returns True if the netCDF file needs GliderQC
+    Returns True if the netCDF file needs GliderQC.  The QC status index is
+    consulted first, the file is only inspected if it is not indexed.
     param nc_path: string defining path to the netcdf file
     """
+    status = status_index.lookup_status(nc_path)
+    if status is not None:
+        return status.state == status_index.PENDING
+
     # quick check to see if QC has already been run on these files
     try:
-        if os.getxattr(nc_path, "user.qc_run"):
+        qc_run = os.getxattr(nc_path, "user.qc_run")
+        if qc_run:
+            status_index.record_status(
+                nc_path,
+                status_index.ERROR if qc_run == b"error" else status_index.DONE,
+            )
             return False
     except OSError:
         pass
+    if sidecar.has_current_sidecar(nc_path):
+        status_index.record_status(nc_path, status_index.DONE)
+        return False
     with Dataset(nc_path, "r") as nc:
         qc = GliderQC(nc, None)
         legacy_var, note = qc.find_geophysical_variables()
         for varname in legacy_var:
             ncvar = nc.variables[varname]
             if qc.needs_qc(ncvar):
+                status_index.record_status(nc_path, status_index.PENDING)
                 return True
+    status_index.record_status(nc_path, status_index.DONE)
     # if this section was reached, QC has been run, but xattr remains unset
     try:
         os.setxattr(nc_path, "user.qc_run", b"true")
@@ -0,0 +1,191 @@
+#!/usr/bin/env python
+"""
+Timings of the stages of a QC job, and the per-job performance records they
+are reported in
+glider_qc/instrumentation.py
+"""
+import datetime
+import json
+import logging
+import os
+import time
+from contextlib import contextmanager
+
+import numpy as np
+import redis
+
+log = logging.getLogger(__name__)
+
+# Prefix of the log message holding the JSON record of a job
+RECORD_MARKER = "QC job record"
+# Redis stream the records are optionally added to, trimmed to about
+# TIMINGS_STREAM_MAXLEN records
+TIMINGS_STREAM = "gliderdac:qc_timings"
+TIMINGS_STREAM_MAXLEN = 100000
+
+# Name of the whole job in the stage latencies
+TOTAL = "total"
+
+
+class JobTimings(object):
+    """
+    Wall clock time spent in each stage of a QC job, and the samples and
+    bytes read per variable and the bytes of flags written.  Stages entered
+    several times, e.g. once per variable or chunk, are summed.
+    """
+
+    def __init__(self, nc_path=None):
+        """
+        :param nc_path: string defining path to the netCDF file (optional)
+        """
+        self.nc_path = nc_path
+        self.start = time.perf_counter()
+        self.stages = {}
+        self.variables = {}
+        self.bytes_written = 0
+        self.outcome = None
+        self.cached = False
+
+    @contextmanager
+    def stage(self, name):
+        """
+        Context manager adding the time spent in its block to a stage
+        """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.stages[name] = self.stages.get(name, 0.0) + time.perf_counter() - start
+
+    def read(self, varname, nbytes, samples=0):
+        """
+        Counts bytes read from a variable and the samples it has
+        """
+        variable = self.variables.setdefault(varname, {"samples": 0, "bytes_read": 0})
+        variable["samples"] += int(samples)
+        variable["bytes_read"] += int(nbytes)
+
+    def written(self, nbytes):
+        """
+        Counts bytes of flags written
+        """
+        self.bytes_written += int(nbytes)
+
+    def record(self):
+        """
+        Returns the JSON serializable performance record of the job
+        """
+        deployment, file_name = None, None
+        if self.nc_path is not None:
+            deployment = os.path.basename(os.path.dirname(self.nc_path))
+            file_name = os.path.basename(self.nc_path)
+        return {
+            "deployment": deployment,
+            "file": file_name,
+            "time": datetime.datetime.now(datetime.timezone.utc).isoformat(),
+            "outcome": self.outcome,
+            "cached": self.cached,
+            TOTAL: time.perf_counter() - self.start,
+            "stages": dict(self.stages),
+            "variables": self.variables,
+            "bytes_read": sum(v["bytes_read"] for v in self.variables.values()),
+            "bytes_written": self.bytes_written,
+        }
+
+    def emit(self, connection=None, maxlen=TIMINGS_STREAM_MAXLEN):
+        """
+        Logs the record of the job and adds it to the Redis stream
+
+        :param connection: redis connection, None to only log the record
+        :param maxlen: integer approximate length the stream is trimmed to
+        :return: dict record
+        """
+        record = self.record()
+        message = json.dumps(record)
+        log.info("%s %s", RECORD_MARKER, message)
+        if connection is not None:
+            try:
+                connection.xadd(
+                    TIMINGS_STREAM, {"record": message}, maxlen=maxlen, approximate=True
+                )
+            except redis.RedisError as e:
+                log.warning("Could not add the QC job record to %s: %s", TIMINGS_STREAM, e)
+        return record
+
+
+@contextmanager
+def job_timings(nc_path, connection=None, maxlen=TIMINGS_STREAM_MAXLEN):
+    """
+    Context manager yielding the JobTimings of a QC job, whose record is
+    emitted when the job ends, however it ends
+
+    :param nc_path: string defining path to the netCDF file
+    :param connection: redis connection, None to only log the record
+    :param maxlen: integer approximate length the stream is trimmed to
+    """
+    timings = JobTimings(nc_path)
+    try:
+        yield timings
+    finally:
+        timings.emit(connection, maxlen)
+
+
+def read_stream(connection, count=None):
+    """
+    Returns the records of the Redis stream, oldest first
+
+    :param connection: redis connection
+    :param count: integer number of most recent records (optional)
+    """
+    if count is None:
+        entries = connection.xrange(TIMINGS_STREAM)
+    else:
+        entries = connection.xrevrange(TIMINGS_STREAM, count=count)[::-1]
+    return [json.loads(fields[b"record"]) for _, fields in entries]
+
+
+def read_log(lines):
+    """
+    Returns the records found in log lines
+
+    :param lines: iterable of log lines, e.g. an open log file
+    """
+    records = []
+    for line in lines:
+        _, marker, message = line.partition(RECORD_MARKER + " ")
+        if not marker:
+            continue
+        try:
+            records.append(json.loads(message))
+        except ValueError:
+            log.warning("Could not parse QC job record: %s", message.strip())
+    return records
+
+
+def stage_latencies(records):
+    """
+    Returns the median and 95th percentile latency of every stage per
+    deployment, over the jobs that went through the stage
+
+    :param records: iterable of job records
+    :return: dict of deployment to a dict of stage to a dict of jobs, p50
+             and p95 (seconds), the whole job being the TOTAL stage
+    """
+    durations = {}
+    for record in records:
+        stages = durations.setdefault(record.get("deployment"), {})
+        stages.setdefault(TOTAL, []).append(record[TOTAL])
+        for stage, seconds in record.get("stages", {}).items():
+            stages.setdefault(stage, []).append(seconds)
+
+    latencies = {}
+    for deployment, stages in durations.items():
+        latencies[deployment] = {}
+        for stage, seconds in stages.items():
+            p50, p95 = np.percentile(seconds, [50, 95])
+            latencies[deployment][stage] = {
+                "jobs": len(seconds),
+                "p50": float(p50),
+                "p95": float(p95),
+            }
+    return latencies
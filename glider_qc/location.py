@@ -0,0 +1,139 @@
+#!/usr/bin/env python
+"""
+Vectorized GDAC location test: profile positions are checked against a watch
+circle around the mean position of their glider track
+glider_qc/location.py
+"""
+import logging
+
+import numpy as np
+from netCDF4 import Dataset
+
+log = logging.getLogger(__name__)
+
+PASS = np.int8(1)
+FAIL = np.int8(4)
+MISSING = np.int8(9)
+
+# Radius of the watch circle around the track mean
+WATCH_CIRCLE_MILES = 2.0
+# 1 degree latitude is about 69.172 miles, which makes the great-circle
+# distance agree with the former degree-based watch circle
+MILES_PER_DEG_LAT = 69.172
+EARTH_RADIUS_MILES = MILES_PER_DEG_LAT * 180.0 / np.pi
+# Samples of the track read at a time, so that whole-deployment files are
+# not read at once
+TRACK_BLOCK = 100000
+
+
+def haversine_miles(lat1, lon1, lat2, lon2):
+    """
+    Returns the great-circle distance in miles between two sets of positions
+    in degrees, element-wise with numpy broadcasting
+    """
+    lat1, lon1, lat2, lon2 = (
+        np.radians(np.asarray(a, dtype=np.float64)) for a in (lat1, lon1, lat2, lon2)
+    )
+    a = (
+        np.sin((lat2 - lat1) / 2.0) ** 2
+        + np.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1) / 2.0) ** 2
+    )
+    return 2.0 * EARTH_RADIUS_MILES * np.arcsin(np.sqrt(np.clip(a, 0.0, 1.0)))
+
+
+def location_flags(
+    profile_lat, profile_lon, center_lat, center_lon, radius_miles=WATCH_CIRCLE_MILES
+):
+    """
+    Returns the location test flags of profile positions: MISSING if the
+    position is NaN or masked, PASS if it is strictly within radius_miles of
+    the track center, FAIL otherwise (including an undefined center)
+
+    :param profile_lat: array of profile latitudes
+    :param profile_lon: array of profile longitudes
+    :param center_lat: array of track mean latitudes, broadcast to profile_lat
+    :param center_lon: array of track mean longitudes, broadcast to profile_lon
+    :param radius_miles: float radius of the watch circle
+    :return: int8 array of flags
+    """
+    missing = (
+        np.ma.getmaskarray(profile_lat)
+        | np.ma.getmaskarray(profile_lon)
+        | np.isnan(np.ma.getdata(profile_lat))
+        | np.isnan(np.ma.getdata(profile_lon))
+    )
+    with np.errstate(invalid="ignore"):
+        distance = haversine_miles(
+            np.ma.filled(profile_lat, np.nan),
+            np.ma.filled(profile_lon, np.nan),
+            np.ma.filled(center_lat, np.nan),
+            np.ma.filled(center_lon, np.nan),
+        )
+        inside = distance < radius_miles
+    return np.where(missing, MISSING, np.where(inside, PASS, FAIL)).astype(np.int8)
+
+
+def track_mean(ncvariable):
+    """
+    Returns the mean of the valid values of a track variable, NaN if there
+    are none, reading TRACK_BLOCK samples at a time
+
+    :param ncvariable: netCDF4.Variable
+    """
+    if not ncvariable.dimensions:
+        blocks = [ncvariable[...]]
+    else:
+        size = len(ncvariable)
+        blocks = (ncvariable[start:start + TRACK_BLOCK] for start in range(0, size, TRACK_BLOCK))
+    total, count = 0.0, 0
+    for block in blocks:
+        values = np.ma.filled(np.ma.asarray(block, dtype=np.float64), np.nan)
+        valid = values[~np.isnan(values)]
+        total += valid.sum()
+        count += valid.size
+    return total / count if count else np.nan
+
+
+def read_track(ncfile):
+    """
+    Returns the profile positions of a file and the mean position of its
+    glider track
+
+    :param ncfile: netCDF4.Dataset
+    :return: tuple of profile_lat, profile_lon (at least 1-d masked arrays),
+             center_lat, center_lon
+    """
+    variables = ncfile.variables
+    profile_lat = np.ma.atleast_1d(variables["profile_lat"][...])
+    profile_lon = np.ma.atleast_1d(variables["profile_lon"][...])
+    # an entirely masked track has no center
+    center_lat = track_mean(variables["lat"])
+    center_lon = track_mean(variables["lon"])
+    return profile_lat, profile_lon, center_lat, center_lon
+
+
+def deployment_location_flags(nc_paths, radius_miles=WATCH_CIRCLE_MILES):
+    """
+    Runs the location test on every profile of several files, e.g. a whole
+    deployment or a batch of delayed mode files, in one array operation
+
+    :param nc_paths: list of netCDF file paths
+    :param radius_miles: float radius of the watch circle
+    :return: dict of path to the int8 flags of the file's profiles
+    """
+    tracks = []
+    for nc_path in nc_paths:
+        with Dataset(nc_path) as ncfile:
+            tracks.append(read_track(ncfile))
+    if not tracks:
+        return {}
+
+    sizes = [len(profile_lat) for profile_lat, _, _, _ in tracks]
+    flags = location_flags(
+        np.ma.concatenate([t[0] for t in tracks]),
+        np.ma.concatenate([t[1] for t in tracks]),
+        np.repeat([t[2] for t in tracks], sizes),
+        np.repeat([t[3] for t in tracks], sizes),
+        radius_miles,
+    )
+    return dict(zip(nc_paths, np.split(flags, np.cumsum(sizes)[:-1])))
@@ -0,0 +1,155 @@
+#!/usr/bin/env python
+"""
+Realtime and delayed mode QC queues, the worker draining them and their
+metrics
+glider_qc/queues.py
+"""
+import datetime
+import logging
+import os
+
+from rq import Queue, Worker
+
+from glider_qc.glider_qc import QC_BATCH_SIZE, get_redis_connection
+
+log = logging.getLogger(__name__)
+
+# QC queues in priority order.  Realtime QC keeps the original queue name.
+QC_REALTIME_QUEUE = "gliderdac"
+QC_DELAYED_QUEUE = "gliderdac-delayed"
+QC_QUEUES = (QC_REALTIME_QUEUE, QC_DELAYED_QUEUE)
+
+# Number of consecutive realtime jobs after which a worker takes one delayed
+# mode job, if there is one waiting
+QC_DELAYED_SHARE = 4
+# Number of files per delayed mode QC job.  A worker is busy with a delayed
+# mode job for as long as QC of its files takes, and delayed mode files often
+# hold a whole deployment, so realtime jobs wait for at most one such file.
+QC_DELAYED_BATCH_SIZE = 1
+
+# Number of recent wait times kept per queue for the metrics
+QC_METRICS_WINDOW = 1000
+METRICS_KEY = "gliderdac:qc_metrics"
+
+
+def is_delayed_mode(deployment_dir):
+    """
+    Returns True if the directory belongs to a delayed mode deployment.
+    Delayed mode deployments are named after their realtime deployment with
+    a -delayed suffix.
+
+    :param deployment_dir: string defining path to the deployment directory
+    """
+    return os.path.basename(os.path.normpath(deployment_dir)).endswith("-delayed")
+
+
+def batch_size(delayed_mode=False):
+    """
+    Returns the maximum number of files per QC job of a deployment
+
+    :param delayed_mode: boolean, True for delayed mode deployments
+    """
+    return QC_DELAYED_BATCH_SIZE if delayed_mode else QC_BATCH_SIZE
+
+
+def get_qc_queue(delayed_mode=False, connection=None):
+    """
+    Returns the rq queue QC jobs of a deployment are enqueued on
+
+    :param delayed_mode: boolean, True for delayed mode deployments
+    :param connection: redis connection (optional)
+    """
+    name = QC_DELAYED_QUEUE if delayed_mode else QC_REALTIME_QUEUE
+    return Queue(name, connection=connection or get_redis_connection())
+
+
+def _wait_seconds(job):
+    """
+    Returns the seconds a job waited in its queue
+    """
+    enqueued_at = job.enqueued_at
+    if enqueued_at is None:
+        return None
+    if enqueued_at.tzinfo is None:
+        enqueued_at = enqueued_at.replace(tzinfo=datetime.timezone.utc)
+    now = datetime.datetime.now(datetime.timezone.utc)
+    return max((now - enqueued_at).total_seconds(), 0.0)
+
+
+def record_wait(connection, queue_name, wait):
+    """
+    Records the time a job waited in a queue
+
+    :param connection: redis connection
+    :param queue_name: string defining the queue name
+    :param wait: float seconds
+    """
+    key = f"{METRICS_KEY}:{queue_name}:waits"
+    pipe = connection.pipeline()
+    pipe.lpush(key, wait)
+    pipe.ltrim(key, 0, QC_METRICS_WINDOW - 1)
+    pipe.execute()
+
+
+def queue_metrics(connection=None):
+    """
+    Returns the depth of every QC queue and the wait times of its last
+    QC_METRICS_WINDOW jobs
+
+    :param connection: redis connection (optional)
+    :return: dict of queue name to a dict of depth, jobs, mean_wait,
+             p95_wait and max_wait (seconds, None without jobs)
+    """
+    connection = connection or get_redis_connection()
+    metrics = {}
+    for name in QC_QUEUES:
+        waits = sorted(
+            float(w) for w in connection.lrange(f"{METRICS_KEY}:{name}:waits", 0, -1)
+        )
+        metrics[name] = {
+            "depth": len(Queue(name, connection=connection)),
+            "jobs": len(waits),
+            "mean_wait": sum(waits) / len(waits) if waits else None,
+            "p95_wait": waits[int(0.95 * (len(waits) - 1))] if waits else None,
+            "max_wait": waits[-1] if waits else None,
+        }
+    return metrics
+
+
+class QCWorker(Worker):
+    """
+    rq worker draining the QC queues in priority order, with a fair share for
+    the lower priority queues: after delayed_share consecutive jobs from the
+    first queue, the next queue is tried first for one job.  Realtime jobs
+    therefore wait for at most one delayed mode job, of QC_DELAYED_BATCH_SIZE
+    files, per delayed_share realtime jobs, however long the delayed mode
+    backlog is.  The wait time
+    of every job is recorded for queue_metrics.
+    """
+
+    def __init__(self, queues, *args, delayed_share=QC_DELAYED_SHARE, **kwargs):
+        super().__init__(queues, *args, **kwargs)
+        self.delayed_share = delayed_share
+        self.priority_streak = 0
+
+    def reorder_queues(self, reference_queue):
+        if reference_queue == self.queues[0]:
+            self.priority_streak += 1
+        else:
+            self.priority_streak = 0
+        if self.delayed_share and self.priority_streak >= self.delayed_share:
+            self._ordered_queues = self.queues[1:] + self.queues[:1]
+        else:
+            self._ordered_queues = self.queues[:]
+
+    def dequeue_job_and_maintain_ttl(self, *args, **kwargs):
+        result = super().dequeue_job_and_maintain_ttl(*args, **kwargs)
+        if result is not None:
+            job, queue = result
+            try:
+                wait = _wait_seconds(job)
+                if wait is not None:
+                    record_wait(self.connection, queue.name, wait)
+            except Exception:
+                log.exception("Could not record the wait time of job %s", job.id)
+        return result
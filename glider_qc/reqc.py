@@ -0,0 +1,422 @@
+#!/usr/bin/env python
+"""
+Selective re-QC of QC'ed files after a change of the QC configuration.  The
+configuration every test ran with is stored in the qartod_config attribute
+of its flag variable; only the tests whose configuration changed are run
+again, and only their flag variables and the primary rollup are rewritten.
+glider_qc/reqc.py
+"""
+import json
+import logging
+import os
+import sqlite3
+
+import numpy as np
+from netCDF4 import Dataset
+
+from glider_qc import engine, status_index
+from glider_qc.glider_qc import (
+    STATISTICS_SNAPSHOT, GliderQC, ProcessError, fill_masked, lock_file
+)
+from glider_qc.write_plan import FlagWritePlan, NOT_EVALUATED
+
+log = logging.getLogger(__name__)
+
+# Arguments of the tests derived from the data by GliderQC.update_config,
+# which a configuration change does not affect, and the snapshot of the
+# deployment statistics they were derived from
+DERIVED_ARGUMENTS = {
+    "spike_test": ("suspect_threshold", "fail_threshold", STATISTICS_SNAPSHOT),
+    "rate_of_change_test": ("threshold", STATISTICS_SNAPSHOT),
+}
+
+# Checkpoint states of a file
+PLANNED = "planned"
+ENQUEUED = "enqueued"
+UNCHANGED = "unchanged"
+DONE = status_index.DONE
+ERROR = status_index.ERROR
+
+
+def configured_arguments(testname, spec):
+    """
+    Returns the arguments of a test that come from the configuration, as
+    they compare once stored as JSON
+
+    :param testname: string defining the qartod test name
+    :param spec: dict of test arguments, or None if the test is not run
+    """
+    if spec is None:
+        return None
+    spec = json.loads(json.dumps(spec))
+    for argument in DERIVED_ARGUMENTS.get(testname, ()):
+        spec.pop(argument, None)
+    return spec
+
+
+def stored_config(ncfile, qartodname):
+    """
+    Returns the arguments a flag variable's test ran with, or None if it did
+    not run
+    """
+    ncvariable = ncfile.variables.get(qartodname)
+    qartod_config = getattr(ncvariable, "qartod_config", None)
+    if qartod_config is None:
+        return None
+    return json.loads(qartod_config)
+
+
+def stored_tests(ncfile, varname):
+    """
+    Returns the tests with a flag variable of a variable, by name
+    """
+    prefix = f"qartod_{varname}_"
+    tests = {}
+    for qartodname in ncfile.variables:
+        if not (qartodname.startswith(prefix) and qartodname.endswith("_flag")):
+            continue
+        testname = qartodname[len(prefix):-len("_flag")] + "_test"
+        if hasattr(engine.qartod, testname):
+            tests[testname] = qartodname
+    return tests
+
+
+def affected_tests(ncfile, config):
+    """
+    Returns the tests of a QC'ed file whose configuration changed: the tests
+    whose configured arguments differ from the stored ones, the tests added
+    to the configuration and the ones removed from it.  Variables without
+    QARTOD flags are left to the regular QC.
+
+    :param ncfile: netCDF4.Dataset
+    :param config: loaded QC configuration dictionary
+    :return: dict of variable name to the sorted list of affected test names
+    """
+    streams = config["contexts"][0]["streams"]
+    affected = {}
+    for varname, stream in streams.items():
+        primary = f"qartod_{varname}_primary_flag"
+        if varname not in ncfile.variables or primary not in ncfile.variables:
+            continue
+        varspec = stream.get("qartod") or {}
+        tests = []
+        for testname, qartodname in stored_tests(ncfile, varname).items():
+            new = None
+            if testname in varspec:
+                new = configured_arguments(testname, varspec[testname] or {})
+            old = configured_arguments(testname, stored_config(ncfile, qartodname))
+            if new != old:
+                tests.append(testname)
+        if tests:
+            affected[varname] = sorted(tests)
+    return affected
+
+
+def plan_file(nc_path, config):
+    """
+    Returns the affected tests of a file, see affected_tests
+    """
+    with Dataset(nc_path) as ncfile:
+        return affected_tests(ncfile, config)
+
+
+def requalify(ncfile, config, tests):
+    """
+    Runs the affected tests of a file again and rewrites their flag
+    variables and the primary rollup of their variables.  Removed tests are
+    NOT_EVALUATED.  The spike and rate of change thresholds the tests ran
+    with are kept; tests that did not run before derive them from the file.
+    The tests run on the samples of the file only, without the context of
+    the previous file of the deployment.
+
+    :param ncfile: netCDF4.Dataset opened for writing
+    :param config: loaded QC configuration dictionary
+    :param tests: dict of variable name to the test names to run again
+    :return: string report of encountered issues
+    """
+    qc = GliderQC(ncfile, config)
+    times = qc.time_axis
+    streams = qc.config["contexts"][0]["streams"]
+    plan = FlagWritePlan(ncfile, qc.flag_storage)
+    removed = []
+    report_list = []
+    for varname, testnames in tests.items():
+        ncvariable = ncfile.variables[varname]
+        varspec = streams[varname].get("qartod") or {}
+        flag_variables = stored_tests(ncfile, varname)
+        # effective arguments of every test of the variable after re-QC
+        effective = {}
+        for testname, qartodname in flag_variables.items():
+            if testname not in testnames:
+                spec = stored_config(ncfile, qartodname)
+                if spec is not None:
+                    effective[testname] = spec
+            elif testname in varspec:
+                spec = json.loads(json.dumps(varspec[testname] or {}))
+                stored = stored_config(ncfile, qartodname) or {}
+                for argument in DERIVED_ARGUMENTS.get(testname, ()):
+                    if argument in stored:
+                        spec[argument] = stored[argument]
+                effective[testname] = spec
+
+        rerun = [t for t in testnames if t in effective]
+        values = None
+        if rerun:
+            values = fill_masked(ncvariable[:])
+            values, note = qc.normalize_variable(
+                values, ncvariable.units, ncvariable.standard_name, inplace=True
+            )
+            report_list.append(note)
+        if values is None:
+            # the unit conversion failed, the tests are NOT_EVALUATED
+            for testname in rerun:
+                del effective[testname]
+        elif any(
+            argument not in effective[t]
+            for t in rerun
+            for argument in DERIVED_ARGUMENTS.get(t, ())
+            if argument != STATISTICS_SNAPSHOT
+        ):
+            # update_config derives the thresholds of both tests at once, from
+            # the file's statistics
+            derived = {
+                t: {
+                    k: v for k, v in (effective.get(t) or {}).items()
+                    if k != STATISTICS_SNAPSHOT
+                }
+                for t in DERIVED_ARGUMENTS
+            }
+            configset, note = qc.update_config(
+                derived, varname, times.datetimes, values, times.units
+            )
+            report_list.append(note)
+            derived = configset["contexts"][0]["streams"][varname]["qartod"]
+            for testname in DERIVED_ARGUMENTS:
+                if testname not in rerun:
+                    continue
+                if testname in derived:
+                    effective[testname] = json.loads(json.dumps(derived[testname]))
+                else:
+                    del effective[testname]
+
+        # in the order of the configuration, like run_qc stores them
+        order = list(varspec)
+        effective = {
+            t: effective[t]
+            for t in sorted(effective, key=lambda t: order.index(t) if t in order else len(order))
+        }
+
+        results = {}
+        if values is not None:
+            # the statistics snapshot is not a test argument
+            results = engine.run_qartod(
+                varname,
+                values,
+                times.datetimes,
+                {
+                    t: {k: v for k, v in effective[t].items() if k != STATISTICS_SNAPSHOT}
+                    for t in rerun
+                    if t in effective
+                },
+            )
+        flags = {}
+        for testname, qartodname in flag_variables.items():
+            column = engine.result_column(varname, testname)
+            if column in results:
+                flags[testname] = results[column]
+            elif testname in effective:
+                flags[testname] = ncfile.variables[qartodname][:]
+            if testname not in testnames:
+                continue
+            plan.add_variable(qartodname, ncvariable.dimensions, {}, parent=varname)
+            if testname in effective:
+                plan.set_data(qartodname, flags[testname])
+                plan.set_attributes(
+                    qartodname,
+                    {
+                        "qartod_test": testname,
+                        "qartod_config": json.dumps(effective[testname]),
+                    },
+                )
+            else:
+                plan.set_data(qartodname, np.full(ncvariable.shape, NOT_EVALUATED))
+                removed.append(qartodname)
+
+        primary = f"qartod_{varname}_primary_flag"
+        plan.add_variable(primary, ncvariable.dimensions, {}, parent=varname)
+        plan.set_attributes(
+            primary, {"qartod_test": "rollup_qc", "qartod_config": json.dumps(effective)}
+        )
+        if flags:
+            plan.set_data(primary, engine.rollup(list(flags.values())))
+        log.info("Re-QC'ed %s of %s", testnames, varname)
+
+    plan.commit()
+    for qartodname in removed:
+        for attribute in ("qartod_test", "qartod_config"):
+            if attribute in ncfile.variables[qartodname].ncattrs():
+                ncfile.variables[qartodname].delncattr(attribute)
+    return " ".join(r for r in report_list if r)
+
+
+class ReQCCheckpoint(object):
+    """
+    SQLite record of the files of a re-QC, keyed by path and configuration
+    hash, so that an interrupted re-QC resumes where it stopped: files that
+    were planned, enqueued or done with a configuration are not looked at
+    again for it.
+    """
+
+    def __init__(self, path):
+        """
+        :param path: string defining path to the SQLite database
+        """
+        self.path = path
+        self.connection = sqlite3.connect(path, timeout=30, isolation_level=None)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute(
+            "CREATE TABLE IF NOT EXISTS reqc ("
+            " path TEXT, config_hash TEXT, tests TEXT, state TEXT, error TEXT,"
+            " PRIMARY KEY (path, config_hash))"
+        )
+
+    def state(self, nc_path, config_hash):
+        """
+        Returns the state of a file, or None if it was not planned
+        """
+        row = self.connection.execute(
+            "SELECT state FROM reqc WHERE path = ? AND config_hash = ?",
+            (os.path.abspath(nc_path), config_hash),
+        ).fetchone()
+        return row[0] if row else None
+
+    def record(self, nc_path, config_hash, state, tests=None, error=None):
+        """
+        Records the state of a file, and its affected tests once planned
+        """
+        self.connection.execute(
+            "INSERT INTO reqc (path, config_hash, tests, state, error)"
+            " VALUES (?, ?, ?, ?, ?)"
+            " ON CONFLICT (path, config_hash) DO UPDATE SET"
+            " tests = COALESCE(excluded.tests, tests), state = excluded.state,"
+            " error = excluded.error",
+            (
+                os.path.abspath(nc_path),
+                config_hash,
+                None if tests is None else json.dumps(tests),
+                state,
+                error,
+            ),
+        )
+
+    def pending(self, config_hash):
+        """
+        Returns the (path, tests) of the planned files not enqueued yet, and
+        of the failed ones
+        """
+        rows = self.connection.execute(
+            "SELECT path, tests FROM reqc WHERE config_hash = ? AND state IN (?, ?)"
+            " ORDER BY path",
+            (config_hash, PLANNED, ERROR),
+        )
+        return [(path, json.loads(tests)) for path, tests in rows]
+
+    def counts(self, config_hash):
+        """
+        Returns the number of files in each state
+        """
+        rows = self.connection.execute(
+            "SELECT state, COUNT(*) FROM reqc WHERE config_hash = ? GROUP BY state",
+            (config_hash,),
+        )
+        return dict(rows.fetchall())
+
+
+def plan_archive(nc_paths, config, checkpoint):
+    """
+    Plans the re-QC of files, skipping the ones already in the checkpoint
+
+    :param nc_paths: iterable of netCDF file paths
+    :param config: string defining path to the configuration file
+    :param checkpoint: ReQCCheckpoint
+    :return: list of (path, tests) of the files to re-QC, including the ones
+             planned before but not enqueued yet
+    """
+    qc_config = GliderQC(None, config).config
+    config_hash = status_index.config_hash(config)
+    for nc_path in nc_paths:
+        if checkpoint.state(nc_path, config_hash) is not None:
+            continue
+        try:
+            tests = plan_file(nc_path, qc_config)
+        except Exception as e:
+            log.exception("Could not plan the re-QC of %s", nc_path)
+            checkpoint.record(nc_path, config_hash, ERROR, {}, str(e))
+            continue
+        checkpoint.record(nc_path, config_hash, PLANNED if tests else UNCHANGED, tests)
+    return checkpoint.pending(config_hash)
+
+
+def enqueue_reqc(queue, planned, config, checkpoint_path):
+    """
+    Enqueues one reqc_task job per file, with the affected tests of all of
+    its variables, so that every file is locked and rewritten once
+
+    :param queue: rq.Queue to enqueue the jobs on
+    :param planned: list of (path, tests) returned by plan_archive
+    :param config: string defining path to the configuration file
+    :param checkpoint_path: string defining path to the checkpoint database
+    :return: list of enqueued rq jobs
+    """
+    checkpoint = ReQCCheckpoint(checkpoint_path)
+    config_hash = status_index.config_hash(config)
+    jobs = []
+    for nc_path, tests in planned:
+        log.info("Enqueueing re-QC of %s for %s", tests, nc_path)
+        jobs.append(queue.enqueue(reqc_task, nc_path, config, tests, checkpoint_path))
+        checkpoint.record(nc_path, config_hash, ENQUEUED)
+    return jobs
+
+
+def reqc_task(nc_path, config, tests, checkpoint_path=None):
+    """
+    Job wrapper around the re-QC of a file.  The affected tests are planned
+    again under the file lock, only the planned ones that are still affected
+    are run.
+
+    :param nc_path: string defining path to the netcdf file
+    :param config: string defining path to the configuration file
+    :param tests: dict of variable name to the planned test names
+    :param checkpoint_path: string defining path to the checkpoint database
+                            (optional)
+    :return: dict of variable name to the test names run again
+    """
+    checkpoint = ReQCCheckpoint(checkpoint_path) if checkpoint_path else None
+    config_hash = status_index.config_hash(config)
+    qc_config = GliderQC(None, config).config
+    lock = lock_file(nc_path)
+    if not lock.acquire():
+        raise ProcessError("File lock already acquired by another process")
+    try:
+        with Dataset(nc_path, "r+") as ncfile:
+            current = affected_tests(ncfile, qc_config)
+            tests = {
+                varname: [t for t in testnames if t in current.get(varname, ())]
+                for varname, testnames in tests.items()
+            }
+            tests = {varname: testnames for varname, testnames in tests.items() if testnames}
+            if tests:
+                report = requalify(ncfile, qc_config, tests)
+                if report:
+                    log.info("Re-QC of %s: %s", nc_path, report)
+        status_index.record_status(nc_path, status_index.DONE, config)
+        if checkpoint is not None:
+            checkpoint.record(nc_path, config_hash, DONE)
+        return tests
+    except Exception as e:
+        log.exception("Re-QC failed for %s", nc_path)
+        if checkpoint is not None:
+            checkpoint.record(nc_path, config_hash, ERROR, error=str(e))
+        raise
+    finally:
+        lock.release()
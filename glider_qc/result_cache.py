@@ -0,0 +1,195 @@
+#!/usr/bin/env python
+"""
+Cache of QARTOD results keyed by the content of a file, so that files
+uploaded again with the same data get their flags without running QC
+glider_qc/result_cache.py
+"""
+import hashlib
+import io
+import json
+import logging
+import os
+import zipfile
+
+import numpy as np
+
+from glider_qc.status_index import config_hash
+from glider_qc.write_plan import collect_flags
+
+log = logging.getLogger(__name__)
+
+KEY_PREFIX = "gliderdac:qc_cache"
+# Seconds a cached result is kept
+CACHE_TTL = 7 * 24 * 3600
+# Results whose serialized flags are larger are not cached
+MAX_BYTES = 1024 * 1024
+# Number of values of a variable hashed at a time
+DIGEST_BLOCK = 1024 * 1024
+
+
+def cacheable(config):
+    """
+    Returns whether the flags of a file only depend on its data and the QC
+    configuration.  With deployment threshold statistics or a cross-file
+    context they also depend on the files QC'ed before it, and QC has to run
+    to update the statistics and the context.
+
+    :param config: loaded configuration dictionary
+    """
+    return (
+        config.get("threshold_statistics", "file") != "deployment"
+        and not config.get("context_window", 0)
+    )
+
+
+def _blocks(ncvariable):
+    """
+    Yields the data of a variable in blocks of at most about DIGEST_BLOCK
+    values along its first dimension
+    """
+    shape = ncvariable.shape
+    if not shape or not shape[0]:
+        yield ncvariable[...]
+        return
+    rows = max(1, DIGEST_BLOCK // max(1, int(np.prod(shape[1:]))))
+    for start in range(0, shape[0], rows):
+        yield ncvariable[start:start + rows]
+
+
+def content_digest(ncfile, ncfile_path):
+    """
+    Returns a digest of the data of every variable of a file except the
+    QARTOD flags, and of the file's path in its deployment.  Attributes are
+    not part of the digest since they do not change the flags.  Variables
+    are read a block at a time.
+
+    :param ncfile: netCDF4.Dataset
+    :param ncfile_path: string defining path to the netCDF file
+    """
+    digest = hashlib.blake2b(digest_size=20)
+    deployment_name = os.path.basename(os.path.dirname(ncfile_path))
+    digest.update(f"{deployment_name}/{os.path.basename(ncfile_path)}".encode("utf-8"))
+    for name in sorted(ncfile.variables):
+        if name.startswith("qartod_"):
+            continue
+        ncvariable = ncfile.variables[name]
+        digest.update(f"\0{name}:{ncvariable.dtype}:{ncvariable.shape}\0".encode("utf-8"))
+        for values in _blocks(ncvariable):
+            data = np.ma.getdata(values)
+            if data.dtype.kind == "O":
+                digest.update(repr(data.tolist()).encode("utf-8"))
+            else:
+                digest.update(np.ascontiguousarray(data).tobytes())
+    return digest.hexdigest()
+
+
+def _encode_attribute(value):
+    if isinstance(value, (np.ndarray, np.generic)):
+        return {"dtype": value.dtype.str, "data": value.tolist()}
+    return value
+
+
+def _decode_attribute(value):
+    if isinstance(value, dict):
+        return np.asarray(value["data"], dtype=value["dtype"])
+    return value
+
+
+def dumps(flags):
+    """
+    Serializes flags returned by glider_qc.write_plan.collect_flags to a
+    compressed .npz: the flag arrays and a JSON header with the comment and
+    the names, dimensions, attributes and parents of the variables
+    """
+    header = {
+        "comment": flags["comment"],
+        "variables": [
+            {
+                "name": name,
+                "dimensions": list(dimensions),
+                "attributes": {k: _encode_attribute(v) for k, v in attributes.items()},
+                "parents": parents,
+            }
+            for name, dimensions, attributes, parents, _ in flags["variables"]
+        ],
+    }
+    arrays = {
+        f"flags_{i}": np.asarray(data) for i, (*_, data) in enumerate(flags["variables"])
+    }
+    buffer = io.BytesIO()
+    np.savez_compressed(buffer, header=np.array(json.dumps(header)), **arrays)
+    return buffer.getvalue()
+
+
+def loads(blob):
+    """
+    Returns the flags serialized by dumps.  Nothing is unpickled.
+    """
+    with np.load(io.BytesIO(blob), allow_pickle=False) as npz:
+        header = json.loads(str(npz["header"]))
+        variables = [
+            (
+                variable["name"],
+                tuple(variable["dimensions"]),
+                {k: _decode_attribute(v) for k, v in variable["attributes"].items()},
+                variable["parents"],
+                npz[f"flags_{i}"],
+            )
+            for i, variable in enumerate(header["variables"])
+        ]
+    return {"comment": header["comment"], "variables": variables}
+
+
+class QCResultCache(object):
+    """
+    QARTOD flag variables and QC comment of a file, stored in Redis under the
+    content digest of the file and the hash of the QC configuration
+    """
+
+    def __init__(self, connection, digest, config, max_bytes=MAX_BYTES, ttl=CACHE_TTL):
+        """
+        :param connection: redis connection
+        :param digest: string returned by content_digest
+        :param config: QC configuration path or dictionary
+        :param max_bytes: integer size of the largest result stored
+        :param ttl: integer seconds a result is kept
+        """
+        self.connection = connection
+        self.key = f"{KEY_PREFIX}:{digest}:{config_hash(config)}"
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+
+    @classmethod
+    def for_file(cls, connection, ncfile, ncfile_path, config, **kwargs):
+        """
+        Returns the cache entry of a file, before QC is run on it
+        """
+        return cls(connection, content_digest(ncfile, ncfile_path), config, **kwargs)
+
+    def get(self):
+        """
+        Returns the cached flags, as returned by
+        glider_qc.write_plan.collect_flags, or None
+        """
+        blob = self.connection.get(self.key)
+        if blob is None:
+            return None
+        try:
+            return loads(blob)
+        except (ValueError, KeyError, OSError, zipfile.BadZipFile) as e:
+            log.warning("Ignoring unreadable QC result cache entry %s: %s", self.key, e)
+            return None
+
+    def store(self, ncfile):
+        """
+        Stores the QARTOD flag variables and QC comment of a file QC was
+        just run on, unless they are larger than max_bytes
+
+        :return: True if the result was stored
+        """
+        blob = dumps(collect_flags(ncfile))
+        if len(blob) > self.max_bytes:
+            log.info("Not caching %s bytes of QC results under %s", len(blob), self.key)
+            return False
+        self.connection.set(self.key, blob, ex=self.ttl)
+        return True
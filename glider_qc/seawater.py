@@ -0,0 +1,121 @@
+#!/usr/bin/env python
+"""
+Vectorized seawater equations used to check the consistency of submitted
+salinity and density with the measured temperature, conductivity and
+pressure: the Practical Salinity Scale 1978 (PSS-78) and the International
+Equation of State of Seawater 1980 (EOS-80), see UNESCO Technical Papers in
+Marine Science 44 (1983)
+glider_qc/seawater.py
+"""
+import numpy as np
+
+PASS = np.int8(1)
+SUSPECT = np.int8(3)
+MISSING = np.int8(9)
+
+# Differences between the submitted and derived practical salinity and
+# density (kg m-3) above which the submitted values are suspect
+SALINITY_TOLERANCE = 0.05
+DENSITY_TOLERANCE = 0.05
+
+# Conductivity of standard seawater (S = 35, T68 = 15 degC, P = 0) in S m-1
+STANDARD_CONDUCTIVITY = 4.2914
+
+# PSS-78 coefficients
+_A = (0.0080, -0.1692, 25.3851, 14.0941, -7.0261, 2.7081)
+_B = (0.0005, -0.0056, -0.0066, -0.0375, 0.0636, -0.0144)
+_K = 0.0162
+_C = (0.6766097, 2.00564e-2, 1.104259e-4, -6.9698e-7, 1.0031e-9)
+_D = (3.426e-2, 4.464e-4, 4.215e-1, -3.107e-3)
+_E = (2.070e-5, -6.370e-10, 3.989e-15)
+
+
+def _t68(temperature):
+    """
+    Converts ITS-90 temperatures to the IPTS-68 scale both equations use
+    """
+    return np.asarray(temperature, dtype=np.float64) * 1.00024
+
+
+def practical_salinity(conductivity, temperature, pressure):
+    """
+    Returns the PSS-78 practical salinity, element-wise
+
+    :param conductivity: array of conductivity in S m-1
+    :param temperature: array of ITS-90 temperature in degC
+    :param pressure: array of sea pressure in dbar
+    :return: numpy float64 array, NaN where an input is NaN
+    """
+    t = _t68(temperature)
+    p = np.asarray(pressure, dtype=np.float64)
+    ratio = np.asarray(conductivity, dtype=np.float64) / STANDARD_CONDUCTIVITY
+    with np.errstate(invalid="ignore", divide="ignore"):
+        rt = _C[0] + t * (_C[1] + t * (_C[2] + t * (_C[3] + t * _C[4])))
+        rp = 1.0 + p * (_E[0] + p * (_E[1] + p * _E[2])) / (
+            1.0 + t * (_D[0] + t * _D[1]) + (_D[2] + _D[3] * t) * ratio
+        )
+        root = np.sqrt(np.abs(ratio / (rp * rt)))
+        salinity = np.zeros_like(root)
+        correction = np.zeros_like(root)
+        for a, b in zip(reversed(_A), reversed(_B)):
+            salinity = salinity * root + a
+            correction = correction * root + b
+        return salinity + (t - 15.0) / (1.0 + _K * (t - 15.0)) * correction
+
+
+def density(salinity, temperature, pressure):
+    """
+    Returns the EOS-80 in-situ density, element-wise
+
+    :param salinity: array of practical salinity
+    :param temperature: array of ITS-90 temperature in degC
+    :param pressure: array of sea pressure in dbar
+    :return: numpy float64 array in kg m-3, NaN where an input is NaN
+    """
+    s = np.asarray(salinity, dtype=np.float64)
+    t = _t68(temperature)
+    # the secant bulk modulus is in bar
+    p = np.asarray(pressure, dtype=np.float64) / 10.0
+    with np.errstate(invalid="ignore"):
+        s15 = s * np.sqrt(np.abs(s))
+        rho_w = 999.842594 + t * (
+            6.793952e-2
+            + t * (-9.095290e-3 + t * (1.001685e-4 + t * (-1.120083e-6 + t * 6.536332e-9)))
+        )
+        rho_0 = (
+            rho_w
+            + s * (8.24493e-1 + t * (-4.0899e-3 + t * (7.6438e-5 + t * (-8.2467e-7 + t * 5.3875e-9))))
+            + s15 * (-5.72466e-3 + t * (1.0227e-4 - t * 1.6546e-6))
+            + 4.8314e-4 * s * s
+        )
+        k_w = 19652.21 + t * (148.4206 + t * (-2.327105 + t * (1.360477e-2 - t * 5.155288e-5)))
+        a_w = 3.239908 + t * (1.43713e-3 + t * (1.16092e-4 - t * 5.77905e-7))
+        b_w = 8.50935e-5 + t * (-6.12293e-6 + t * 5.2787e-8)
+        k_0 = (
+            k_w
+            + s * (54.6746 + t * (-0.603459 + t * (1.09987e-2 - t * 6.1670e-5)))
+            + s15 * (7.944e-2 + t * (1.6483e-2 - t * 5.3009e-4))
+        )
+        a = a_w + s * (2.2838e-3 + t * (-1.0981e-5 - t * 1.6078e-6)) + 1.91075e-4 * s15
+        b = b_w + s * (-9.9348e-7 + t * (2.0816e-8 + t * 9.1697e-10))
+        k = k_0 + p * (a + p * b)
+        return rho_0 / (1.0 - p / k)
+
+
+def consistency_flags(derived, submitted, tolerance):
+    """
+    Returns the consistency flags of submitted values: MISSING if either
+    value is NaN, SUSPECT if they differ by more than tolerance, PASS
+    otherwise
+
+    :param derived: array of values derived from the measurements
+    :param submitted: array of submitted values, in the same units
+    :param tolerance: float largest difference that passes
+    :return: int8 array of flags
+    """
+    derived = np.asarray(derived, dtype=np.float64)
+    submitted = np.asarray(submitted, dtype=np.float64)
+    missing = np.isnan(derived) | np.isnan(submitted)
+    with np.errstate(invalid="ignore"):
+        suspect = np.abs(derived - submitted) > tolerance
+    return np.where(missing, MISSING, np.where(suspect, SUSPECT, PASS)).astype(np.int8)
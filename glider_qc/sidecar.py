@@ -0,0 +1,308 @@
+#!/usr/bin/env python
+"""
+Sidecar files holding the QARTOD flags of a provider netCDF file, and their
+merge into the provider file
+glider_qc/sidecar.py
+"""
+import json
+import logging
+import os
+import shutil
+import tempfile
+from collections.abc import Mapping
+from contextlib import contextmanager
+
+import numpy as np
+from netCDF4 import Dataset
+
+from glider_qc.write_plan import apply_flags
+
+log = logging.getLogger(__name__)
+
+SIDECAR_SUFFIX = ".qc"
+
+
+class SourceChangedError(RuntimeError):
+    """
+    Raised when a provider file changed while its flags were being merged
+    """
+
+
+def sidecar_path(nc_path):
+    """
+    Returns the path of the sidecar of a netCDF file: a hidden file next to
+    it, which the watchdog, the deployment checksum and ERDDAP ignore
+
+    :param nc_path: string defining path to the netCDF file
+    """
+    deployment_dir, file_name = os.path.split(nc_path)
+    return os.path.join(deployment_dir, f".{file_name}{SIDECAR_SUFFIX}")
+
+
+def file_state(path):
+    """
+    Returns the (inode, size, mtime_ns) of a file, which change whenever the
+    file is modified or replaced
+    """
+    st = os.stat(path)
+    return st.st_ino, st.st_size, st.st_mtime_ns
+
+
+def has_current_sidecar(nc_path):
+    """
+    Returns True if the netCDF file has a sidecar written after its last
+    modification
+    """
+    try:
+        return os.stat(sidecar_path(nc_path)).st_mtime_ns >= os.stat(nc_path).st_mtime_ns
+    except OSError:
+        return False
+
+
+def _temporary_path(path):
+    """
+    Returns the path of a new, hidden temporary file next to path
+    """
+    fd, tmp_path = tempfile.mkstemp(
+        dir=os.path.dirname(path), prefix=f".{os.path.basename(path)}.", suffix=".tmp"
+    )
+    os.close(fd)
+    return tmp_path
+
+
+class _SourceVariable(object):
+    """
+    Variable of a provider file opened read-only, whose attribute changes
+    (the ancillary_variables of the flags' parents) are kept in memory
+    """
+
+    def __init__(self, variable):
+        self._variable = variable
+        self._attributes = {}
+
+    def __getattr__(self, name):
+        if name in self._attributes:
+            return self._attributes[name]
+        return getattr(self._variable, name)
+
+    def __setattr__(self, name, value):
+        if name.startswith("_"):
+            object.__setattr__(self, name, value)
+        else:
+            self._attributes[name] = value
+
+    def __getitem__(self, key):
+        return self._variable[key]
+
+    def __len__(self):
+        return len(self._variable)
+
+    def ncattrs(self):
+        return list(dict.fromkeys(self._variable.ncattrs() + list(self._attributes)))
+
+    def getncattr(self, name):
+        if name in self._attributes:
+            return self._attributes[name]
+        return self._variable.getncattr(name)
+
+    def setncatts(self, attributes):
+        self._attributes.update(attributes)
+
+
+class _Variables(Mapping):
+    """
+    Live mapping of the variables of a SidecarDataset, the sidecar's first
+    """
+
+    def __init__(self, source_variables, target_variables):
+        self.source_variables = source_variables
+        self.target_variables = target_variables
+
+    def __getitem__(self, name):
+        if name in self.target_variables:
+            return self.target_variables[name]
+        return self.source_variables[name]
+
+    def __iter__(self):
+        yield from self.source_variables
+        for name in self.target_variables:
+            if name not in self.source_variables:
+                yield name
+
+    def __len__(self):
+        return len(set(self.source_variables).union(self.target_variables))
+
+
+class SidecarDataset(object):
+    """
+    Dataset-like view of a provider file opened read-only and of its
+    sidecar: variables and attributes are read from the provider file, the
+    QARTOD flag variables and global attributes QC writes go to the sidecar.
+    The provider's own QARTOD variables are hidden, so that every flag is
+    computed again into the sidecar.
+    """
+
+    def __init__(self, source, target):
+        """
+        :param source: netCDF4.Dataset of the provider file, opened with "r"
+        :param target: netCDF4.Dataset of the sidecar, opened with "w"
+        """
+        self.__dict__.update(
+            source=source,
+            target=target,
+            source_variables={
+                name: _SourceVariable(ncvariable)
+                for name, ncvariable in source.variables.items()
+                if not name.startswith("qartod_")
+            },
+        )
+
+    @property
+    def variables(self):
+        return _Variables(self.source_variables, self.target.variables)
+
+    @property
+    def data_model(self):
+        return self.target.data_model
+
+    def __getattr__(self, name):
+        if name in self.target.ncattrs():
+            return self.target.getncattr(name)
+        return getattr(self.source, name)
+
+    def __setattr__(self, name, value):
+        self.target.setncattr(name, value)
+
+    def createVariable(self, name, datatype, dimensions=(), **kwargs):
+        """
+        Creates a variable in the sidecar, and the dimensions it needs with
+        the lengths they have in the provider file
+        """
+        for dim in dimensions:
+            if dim not in self.target.dimensions:
+                self.target.createDimension(dim, len(self.source.dimensions[dim]))
+        return self.target.createVariable(name, datatype, dimensions, **kwargs)
+
+    def parents(self):
+        """
+        Returns a dict of the sidecar's flag variable names to the list of
+        the provider variables they are ancillary variables of
+        """
+        parents = {}
+        for name, ncvariable in self.source_variables.items():
+            for child in str(ncvariable._attributes.get("ancillary_variables", "")).split():
+                if child in self.target.variables:
+                    parents.setdefault(child, []).append(name)
+        return parents
+
+
+@contextmanager
+def open_sidecar(nc_path):
+    """
+    Opens a provider file read-only with a new sidecar and yields their
+    SidecarDataset.  The sidecar is written under a temporary name and
+    renamed when the block exits without an error, so that a sidecar is
+    either complete or absent.
+
+    :param nc_path: string defining path to the netCDF file
+    """
+    path = sidecar_path(nc_path)
+    tmp_path = _temporary_path(path)
+    try:
+        with Dataset(nc_path, "r") as source, Dataset(tmp_path, "w", format="NETCDF4") as target:
+            view = SidecarDataset(source, target)
+            yield view
+            target.qc_parent_variables = json.dumps(view.parents())
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.remove(tmp_path)
+        raise
+
+
+def read_sidecar(path):
+    """
+    Returns the flags of a sidecar, as returned by
+    glider_qc.write_plan.collect_flags
+    """
+    with Dataset(path) as sidecar:
+        parents = json.loads(getattr(sidecar, "qc_parent_variables", "{}"))
+        # sidecars written before flags could have several parents
+        parents = {
+            name: [parent] if isinstance(parent, str) else parent
+            for name, parent in parents.items()
+        }
+        variables = []
+        for name, ncvariable in sidecar.variables.items():
+            attributes = {k: v for k, v in ncvariable.__dict__.items() if k != "_FillValue"}
+            variables.append(
+                (
+                    name,
+                    ncvariable.dimensions,
+                    attributes,
+                    parents.get(name, []),
+                    np.ma.getdata(ncvariable[...]),
+                )
+            )
+        return {
+            "comment": getattr(sidecar, "dac_qc_comment", None),
+            "variables": variables,
+        }
+
+
+def _copy_metadata(src, dst):
+    """
+    Gives dst the mode, extended attributes (including ACLs) and ownership
+    of src
+    """
+    st = os.stat(src)
+    shutil.copystat(src, dst)
+    # the merged file is a new version of the file, with a new mtime
+    os.utime(dst)
+    if (st.st_uid, st.st_gid) != (os.stat(dst).st_uid, os.stat(dst).st_gid):
+        try:
+            os.chown(dst, st.st_uid, st.st_gid)
+        except PermissionError as e:
+            log.warning("Could not keep the ownership of %s: %s", src, e)
+
+
+def _fsync(path):
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+def merge_sidecar(nc_path, state, storage=None):
+    """
+    Replaces a provider file with a copy including the flags of its sidecar,
+    in a single rename, then removes the sidecar.  The copy is synced to
+    disk before the rename and keeps the mode, extended attributes and
+    ownership of the file, so readers see either the file without flags or
+    the complete file with them.  The provider file is left untouched if it
+    is not in the given state anymore, i.e. if it changed since its flags
+    were computed.
+
+    :param nc_path: string defining path to the netCDF file
+    :param state: file_state of the file when its flags were computed
+    :param storage: dict with the flag_storage policy (optional)
+    :raises SourceChangedError: if the file changed
+    """
+    path = sidecar_path(nc_path)
+    if file_state(nc_path) != state:
+        raise SourceChangedError(f"{nc_path} changed since QC was run")
+    tmp_path = _temporary_path(nc_path)
+    try:
+        shutil.copyfile(nc_path, tmp_path)
+        with Dataset(tmp_path, "r+") as nc:
+            apply_flags(nc, read_sidecar(path), storage)
+        _copy_metadata(nc_path, tmp_path)
+        _fsync(tmp_path)
+        if file_state(nc_path) != state:
+            raise SourceChangedError(f"{nc_path} changed since QC was run")
+        os.replace(tmp_path, nc_path)
+    except BaseException:
+        os.remove(tmp_path)
+        raise
+    _fsync(os.path.dirname(os.path.abspath(nc_path)))
+    os.remove(path)
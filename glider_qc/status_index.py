@@ -0,0 +1,312 @@
+#!/usr/bin/env python
+"""
+Persistent index of the QC status of netCDF files, so that a file whose QC
+status is known does not need to be opened again.
+glider_qc/status_index.py
+"""
+import atexit
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from collections import namedtuple
+from functools import lru_cache
+
+import yaml
+
+log = logging.getLogger(__name__)
+
+# Name of the index file under the data root
+STATUS_INDEX_FILE = ".qc_status.sqlite"
+
+# Filesystem types the index is kept on in rollback journal mode, WAL relies
+# on shared memory that network filesystems do not provide
+NETWORK_FILESYSTEMS = (
+    "nfs", "nfs4", "cifs", "smb3", "smbfs", "ceph", "glusterfs", "lustre", "gpfs",
+    "9p", "afs", "fuse.sshfs", "fuse.s3fs",
+)
+
+# QC states
+PENDING = "pending"
+DONE = "done"
+ERROR = "error"
+
+# QCStatusIndex of each path opened by a thread, closed at its exit
+_LOCAL = threading.local()
+
+
+class QCStatus(namedtuple("QCStatus", "state config_hash error")):
+    """
+    QC status of a file
+
+        - state: PENDING (needs QC), DONE or ERROR
+        - config_hash: hash of the QC configuration the file was QC'ed with
+        - error: error message of the last failed QC run
+    """
+
+
+def config_hash(config):
+    """
+    Returns a hash of a QC configuration: of the canonical JSON of the
+    configuration dictionary, loaded from the YAML file when given its path,
+    so that a file and the dictionary loaded from it hash the same
+
+    :param config: string defining path to the configuration file, or the
+                   loaded configuration dictionary
+    """
+    if not isinstance(config, dict):
+        st = os.stat(config)
+        return _file_config_hash(os.path.abspath(config), st.st_size, st.st_mtime_ns)
+    content = json.dumps(config, sort_keys=True, default=str).encode("utf-8")
+    return hashlib.sha1(content).hexdigest()
+
+
+@lru_cache(maxsize=16)
+def _file_config_hash(path, size, mtime_ns):
+    """
+    Returns the config_hash of a configuration file, loaded once per version
+    of the file
+    """
+    with open(path, "r") as f:
+        return config_hash(yaml.safe_load(f.read()))
+
+
+def filesystem_type(path):
+    """
+    Returns the type of the filesystem a path is on, from the longest
+    matching mount point of /proc/mounts, or None if it is not known
+    """
+    path = os.path.realpath(path)
+    best = None
+    try:
+        with open("/proc/mounts") as f:
+            for line in f:
+                fields = line.split()
+                if len(fields) < 3:
+                    continue
+                # spaces in mount points are escaped as \040
+                mount_point = fields[1].replace("\\040", " ")
+                if os.path.commonpath([path, mount_point]) != mount_point:
+                    continue
+                if best is None or len(mount_point) > len(best[0]):
+                    best = (mount_point, fields[2])
+    except (OSError, ValueError):
+        return None
+    return best[1] if best else None
+
+
+def journal_mode(path):
+    """
+    Returns the SQLite journal mode of an index: WAL on local disk, DELETE
+    on network filesystems or when the filesystem is not known
+    """
+    fs_type = filesystem_type(os.path.dirname(os.path.abspath(path)))
+    if fs_type is None or fs_type.startswith(NETWORK_FILESYSTEMS):
+        return "DELETE"
+    return "WAL"
+
+
+class QCStatusIndex(object):
+    """
+    SQLite index of the QC status of files, keyed by path.  A record is only
+    valid while the inode, size and modification time of the file match the
+    ones it was recorded with, so replaced or modified files are looked at
+    again.
+    """
+
+    def __init__(self, path):
+        """
+        :param path: string defining path to the SQLite database
+        """
+        self.path = path
+        self.connection = sqlite3.connect(path, timeout=30, isolation_level=None)
+        self.connection.execute(f"PRAGMA journal_mode={journal_mode(path)}")
+        self.connection.execute(
+            "CREATE TABLE IF NOT EXISTS qc_status ("
+            " path TEXT PRIMARY KEY,"
+            " inode INTEGER, size INTEGER, mtime_ns INTEGER,"
+            " state TEXT, config_hash TEXT, error TEXT, updated REAL)"
+        )
+        self.connection.execute(
+            "CREATE TABLE IF NOT EXISTS scan_watermark ("
+            " path TEXT PRIMARY KEY, mtime_ns INTEGER)"
+        )
+
+    def close(self):
+        """
+        Closes the connection to the database
+        """
+        self.connection.close()
+
+    def lookup(self, nc_path):
+        """
+        Returns the QCStatus of a file, or None if it is not known or the
+        file changed since it was recorded
+
+        :param nc_path: string defining path to the netCDF file
+        """
+        try:
+            st = os.stat(nc_path)
+        except OSError:
+            return None
+        row = self.connection.execute(
+            "SELECT inode, size, mtime_ns, state, config_hash, error"
+            " FROM qc_status WHERE path = ?",
+            (os.path.abspath(nc_path),),
+        ).fetchone()
+        if row is None or tuple(row[:3]) != (st.st_ino, st.st_size, st.st_mtime_ns):
+            return None
+        return QCStatus(*row[3:])
+
+    def file_states(self, directory):
+        """
+        Returns a dict of the paths of the files recorded under a directory
+        to the (inode, size, mtime_ns) they were recorded with, in one query
+
+        :param directory: string defining path to the directory
+        """
+        prefix = os.path.join(os.path.abspath(directory), "")
+        rows = self.connection.execute(
+            "SELECT path, inode, size, mtime_ns FROM qc_status"
+            " WHERE substr(path, 1, ?) = ?",
+            (len(prefix), prefix),
+        )
+        return {row[0]: tuple(row[1:]) for row in rows}
+
+    def record(self, nc_path, state, config_hash=None, error=None):
+        """
+        Records the QC status of a file as it is now on disk
+
+        :param nc_path: string defining path to the netCDF file
+        :param state: PENDING, DONE or ERROR
+        :param config_hash: hash of the QC configuration (optional)
+        :param error: error message (optional)
+        """
+        st = os.stat(nc_path)
+        self.connection.execute(
+            "INSERT OR REPLACE INTO qc_status"
+            " (path, inode, size, mtime_ns, state, config_hash, error, updated)"
+            " VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+            (
+                os.path.abspath(nc_path),
+                st.st_ino,
+                st.st_size,
+                st.st_mtime_ns,
+                state,
+                config_hash,
+                error,
+                time.time(),
+            ),
+        )
+
+    def get_watermark(self, directory):
+        """
+        Returns the modification time (in ns) a directory had when it was
+        last scanned, or None
+
+        :param directory: string defining path to the directory
+        """
+        row = self.connection.execute(
+            "SELECT mtime_ns FROM scan_watermark WHERE path = ?",
+            (os.path.abspath(directory),),
+        ).fetchone()
+        return row[0] if row else None
+
+    def set_watermark(self, directory, mtime_ns):
+        """
+        Records the modification time of a scanned directory
+
+        :param directory: string defining path to the directory
+        :param mtime_ns: modification time in ns the directory had when
+                         the scan started
+        """
+        self.connection.execute(
+            "INSERT OR REPLACE INTO scan_watermark (path, mtime_ns) VALUES (?, ?)",
+            (os.path.abspath(directory), mtime_ns),
+        )
+
+
+def get_status_index():
+    """
+    Returns the QC status index of this thread, or None if there is none.
+    The index is the QC_STATUS_INDEX environment variable if set, else
+    STATUS_INDEX_FILE under the DATA_ROOT environment variable.  As DATA_ROOT
+    is usually on network storage, QC_STATUS_INDEX should point to local
+    disk, where the index is kept in WAL mode.
+    """
+    path = os.environ.get("QC_STATUS_INDEX")
+    if not path and os.environ.get("DATA_ROOT"):
+        path = os.path.join(os.environ["DATA_ROOT"], STATUS_INDEX_FILE)
+    if not path:
+        return None
+    # SQLite connections cannot be shared with forked processes or threads
+    indexes = getattr(_LOCAL, "indexes", None)
+    if indexes is None:
+        indexes = _LOCAL.indexes = {}
+    key = (path, os.getpid())
+    if key not in indexes:
+        try:
+            indexes[key] = QCStatusIndex(path)
+        except sqlite3.Error as e:
+            log.warning("Could not open the QC status index %s: %s", path, e)
+            return None
+    return indexes[key]
+
+
+def close_status_index():
+    """
+    Closes the QC status indexes this thread opened, to be called before a
+    thread using the index exits
+    """
+    indexes = getattr(_LOCAL, "indexes", None) or {}
+    for (path, pid), index in list(indexes.items()):
+        if pid == os.getpid():
+            try:
+                index.close()
+            except sqlite3.Error as e:
+                log.warning("Could not close the QC status index %s: %s", path, e)
+    indexes.clear()
+
+
+atexit.register(close_status_index)
+
+
+def lookup_status(nc_path):
+    """
+    Returns the indexed QCStatus of a file, None if there is no index, the
+    file is not indexed or the index cannot be read
+    """
+    index = get_status_index()
+    if index is None:
+        return None
+    try:
+        return index.lookup(nc_path)
+    except sqlite3.Error as e:
+        log.warning("Could not look up %s in the QC status index: %s", nc_path, e)
+        return None
+
+
+def record_status(nc_path, state, config=None, error=None):
+    """
+    Records the QC status of a file in the index, if there is one
+
+    :param nc_path: string defining path to the netCDF file
+    :param state: PENDING, DONE or ERROR
+    :param config: QC configuration path or dictionary (optional)
+    :param error: error message (optional)
+    """
+    index = get_status_index()
+    if index is None:
+        return
+    try:
+        index.record(
+            nc_path,
+            state,
+            config_hash(config) if config is not None else None,
+            error,
+        )
+    except (sqlite3.Error, OSError) as e:
+        log.warning("Could not record %s in the QC status index: %s", nc_path, e)
@@ -0,0 +1,370 @@
+#!/usr/bin/env python
+"""
+Chunked QC of files too large to be QC'ed in memory, e.g. delayed mode
+files holding a whole deployment.  Variables are read, tested and their flags
+written a chunk of the time dimension at a time, so that the memory used does
+not grow with the size of the file beyond its time axis.
+glider_qc/streaming.py
+"""
+import json
+import logging
+
+import numpy as np
+from ioos_qc.utils import mapdates
+
+from glider_qc import engine
+from glider_qc.deployment_stats import RunningStats
+from glider_qc.write_plan import FlagWritePlan, NOT_EVALUATED
+
+log = logging.getLogger(__name__)
+
+# Files with at least STREAM_MIN_SAMPLES times are QC'ed in chunks of
+# STREAM_CHUNK_SIZE samples, unless the streaming settings of the
+# configuration say otherwise.  qartod.flat_line_test builds a samples by
+# window matrix, so its memory grows with the chunk size times the window.
+STREAM_MIN_SAMPLES = 1000000
+STREAM_CHUNK_SIZE = 20000
+
+# Samples before and after a chunk that a test looks at to flag the samples
+# of the chunk like it would on the whole array.  Tests that are not listed
+# flag every sample on its own.  The flat line test window is in time, see
+# flat_line_overlap.
+TEST_OVERLAP = {
+    "spike_test": (1, 1),
+    "rate_of_change_test": (1, 0),
+}
+
+
+def chunk_size(config, size):
+    """
+    Returns the number of samples per chunk a file is QC'ed with, or None if
+    it is QC'ed in memory
+
+    :param config: QC configuration dictionary
+    :param size: integer length of the file's time dimension
+    """
+    streaming = config.get("streaming") or {}
+    if size < streaming.get("min_samples", STREAM_MIN_SAMPLES):
+        return None
+    return int(streaming.get("chunk_size", STREAM_CHUNK_SIZE))
+
+
+def is_chunked(config, ncfile):
+    """
+    Returns True if a file is QC'ed a chunk at a time, from the length of its
+    time variable
+
+    :param config: QC configuration dictionary
+    :param ncfile: netCDF4.Dataset
+    """
+    time = ncfile.variables.get("time")
+    if time is None or not time.dimensions:
+        return False
+    return chunk_size(config, len(time)) is not None
+
+
+def chunks(size, chunk):
+    """
+    Yields the (start, stop) bounds of the chunks of a dimension
+    """
+    for start in range(0, size, chunk):
+        yield start, min(start + chunk, size)
+
+
+def median_interval(datetimes):
+    """
+    Returns the median time step the flat line test derives its window from,
+    as numpy timedelta64[ns]
+    """
+    return np.median(np.diff(mapdates(datetimes)))
+
+
+def flat_line_overlap(spec, interval):
+    """
+    Returns the number of preceding samples the flat line test looks at,
+    computed like qartod.flat_line_test does from its thresholds
+
+    :param spec: dict of flat_line_test arguments
+    :param interval: numpy timedelta64 returned by median_interval
+    """
+    seconds = interval.astype("timedelta64[s]").astype(float)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        counts = [
+            (int(spec[key]) / seconds).astype(int)
+            for key in ("suspect_threshold", "fail_threshold")
+            if spec.get(key) is not None
+        ]
+    return max([0] + counts)
+
+
+def overlap(varspec, interval):
+    """
+    Returns the (before, after) samples all of the tests of a variable look at
+    """
+    before, after = 0, 0
+    for testname, spec in varspec.items():
+        if testname == "flat_line_test":
+            before = max(before, flat_line_overlap(spec or {}, interval))
+        else:
+            test_before, test_after = TEST_OVERLAP.get(testname, (0, 0))
+            before, after = max(before, test_before), max(after, test_after)
+    return before, after
+
+
+class ChunkReader(object):
+    """
+    Reads slices of a variable normalized to float64 in standard units
+    """
+
+    def __init__(self, qc, ncvariable):
+        self.qc = qc
+        self.ncvariable = ncvariable
+
+    def raw(self, start, stop):
+        with self.qc.timings.stage("read"):
+            raw = self.ncvariable[start:stop]
+        self.qc.timings.read(self.ncvariable.name, raw.nbytes)
+        return raw
+
+    def values(self, start, stop, raw=None):
+        """
+        Returns the normalized values of a slice, or None with a note if the
+        units cannot be converted
+        """
+        if raw is None:
+            raw = self.raw(start, stop)
+        with self.qc.timings.stage("normalize_variable"):
+            values = np.ma.filled(np.ma.asarray(raw, dtype=np.float64), np.nan)
+            return self.qc.normalize_variable(
+                values,
+                self.ncvariable.units,
+                self.ncvariable.standard_name,
+                inplace=True,
+            )
+
+
+def _summary_values(summary, raw):
+    """
+    Merges the distinct values of a slice into the (at most two) distinct
+    values seen so far, which is all GliderQC.check_geophysical_variables
+    needs to classify the whole variable
+    """
+    distinct = np.unique(raw)
+    if summary is not None:
+        distinct = np.unique(np.ma.concatenate([summary, distinct]))
+    return distinct[:2]
+
+
+def _statistics(qc, readers, times, chunk, report_list):
+    """
+    Computes the threshold statistics of the variables over the whole file,
+    a chunk at a time: the mean and std in a first pass, then the maximum
+    in-band rate of change, which depends on them, in a second pass.  Like in
+    run_qc, the first and last samples are left out and value i is paired
+    with time i - 1.
+
+    :return: dict of variable name to engine.ThresholdStats
+    """
+    size = len(times)
+    running = {name: RunningStats.empty() for name in readers}
+    summaries = dict.fromkeys(readers)
+    for start, stop in chunks(size, chunk):
+        for name in list(running):
+            raw = readers[name].raw(start, stop)
+            summaries[name] = _summary_values(summaries[name], raw)
+            values, note = readers[name].values(start, stop, raw)
+            if values is None:
+                report_list.append(note)
+                del running[name]
+                continue
+            first, last = max(start, 1), min(stop, size - 1)
+            sample = values[first - start:last - start]
+            with qc.timings.stage("statistics"):
+                count = int(np.count_nonzero(~np.isnan(sample)))
+                if count:
+                    part = RunningStats(
+                        count, float(np.nanmean(sample)), float(np.nanvar(sample)) * count
+                    )
+                    running[name] = running[name].merge(part)
+
+    for name in list(running):
+        note = qc.check_geophysical_variables(name, summaries[name])
+        if note:
+            report_list.append(note)
+            del running[name]
+
+    # maximum rate of change between consecutive in-band values, carrying the
+    # last in-band value and time of each variable over to the next chunk
+    carry = {name: (np.nan, np.nan) for name in running}
+    max_rate = {name: np.nan for name in running}
+    for start, stop in chunks(size, chunk):
+        for name, stats in running.items():
+            first, last = max(start, 1), min(stop, size - 1)
+            if first >= last:
+                continue
+            values, _ = readers[name].values(first, last)
+            with qc.timings.stage("statistics"):
+                values = np.concatenate([[carry[name][0]], values])
+                seconds = np.concatenate([[carry[name][1]], times.seconds[first - 1:last - 1]])
+                in_band, rate = engine.band_max_rate(values, seconds, stats.mean, stats.std)
+                max_rate[name] = np.fmax(max_rate[name], rate[0])
+                band = np.flatnonzero(in_band[0])
+                if band.size:
+                    carry[name] = (values[band[-1]], seconds[band[-1]])
+
+    return {
+        name: engine.ThresholdStats(
+            max(size - 2, 0), stats.count, stats.mean, stats.std, None, max_rate[name]
+        )
+        for name, stats in running.items()
+    }
+
+
+def run_chunked_qc(qc, variables, times, chunk):
+    """
+    Runs the QARTOD tests on variables of a file a chunk of the time
+    dimension at a time, with the numpy engine, and writes the flags of each
+    chunk as they are computed.  Every test sees the samples it needs around
+    the chunk, so that the flags are the same as if the whole file had been
+    tested at once.  The threshold statistics are those of the file, the
+    deployment statistics and context of run_qc are not used.
+
+    :param qc: GliderQC of the file, opened for writing
+    :param variables: list of the geophysical variable names
+    :param times: TimeAxis of the file
+    :param chunk: integer number of samples per chunk
+    :return: string report of encountered issues
+    """
+    report_list = []
+    ncfile = qc.ncfile
+    size = len(times)
+    plan = FlagWritePlan(ncfile, qc.flag_storage)
+    readers = {}
+    for name in variables:
+        ncvariable = ncfile.variables[name]
+        qc.create_qc_variables(ncvariable, plan)
+        if ncvariable.shape != (size,):
+            log.info("%s is not a time series, skipping", name)
+            report_list.append(f"{name} does not match the time dimension")
+            continue
+        readers[name] = ChunkReader(qc, ncvariable)
+
+    log.info("Running chunked QC on %s samples, %s per chunk", size, chunk)
+    timings = qc.timings
+    for name in readers:
+        timings.read(name, 0, size)
+    statistics = _statistics(qc, readers, times, chunk, report_list)
+
+    # update the test configurations, and define every flag variable with its
+    # attributes before any flags are written
+    varspecs = {}
+    for name, stats in statistics.items():
+        varspec = qc.config["contexts"][0]["streams"][name]["qartod"]
+        # update_config only uses the length of the values when the
+        # statistics are provided
+        with timings.stage("update_config"):
+            config_set, note = qc.update_config(
+                varspec, name, times.datetimes, np.broadcast_to(np.nan, (size,)), times.units, stats
+            )
+        report_list.append(note)
+        varspecs[name] = varspec = config_set["contexts"][0]["streams"][name]["qartod"]
+        tests = [t for t in varspec if hasattr(engine.qartod, t)]
+        columns = [engine.result_column(name, t) for t in tests]
+        if columns:
+            columns.append(engine.ROLLUP_COLUMN)
+        for column in columns:
+            qartodname, testname = engine.flag_variable_name(name, column)
+            plan.set_attributes(
+                qartodname,
+                {
+                    "qartod_test": testname or "rollup_qc",
+                    "qartod_config": json.dumps(
+                        varspec if testname is None else varspec[testname]
+                    ),
+                },
+            )
+    # the submitted salinity and density are checked a chunk at a time too
+    consistency = qc.consistency["enabled"] and qc.consistency_variables(list(statistics))
+    if consistency:
+        qc.create_consistency_variables(consistency[1], plan)
+    climatology = qc.climatology["indexes"] and qc.climatology_variables(list(statistics))
+    if climatology:
+        qc.create_climatology_variables(climatology[1], plan)
+    with timings.stage("write"):
+        plan.commit_definitions()
+
+    interval = median_interval(times.datetimes) if size > 1 else np.timedelta64(0, "ns")
+    written = set()
+    for start, stop in chunks(size, chunk):
+        for name, varspec in varspecs.items():
+            before, after = overlap(varspec, interval)
+            lo, hi = max(start - before, 0), min(stop + after, size)
+            # qartod.flat_line_test passes arrays of less than 3 samples
+            lo = max(min(lo, hi - 3), 0)
+            values, _ = readers[name].values(lo, hi)
+            # evenly spaced times with the file's median step give the flat
+            # line test the window it has on the whole file
+            flat_line_times = np.datetime64(0, "ns") + np.arange(hi - lo) * interval
+            try:
+                with timings.stage("apply_qc"):
+                    results = engine.run_qartod(
+                        name,
+                        values,
+                        times.datetimes[lo:hi],
+                        varspec,
+                        test_times={"flat_line_test": flat_line_times},
+                    )
+            except Exception as e:
+                log.exception(f"Error running QC tests on {name}: ")
+                report_list.append(f"apply_qc failed: could not calculate QC flags.: {str(e)}")
+                continue
+            with timings.stage("write"):
+                for column, flags in results.items():
+                    qartodname, _ = engine.flag_variable_name(name, column)
+                    ncfile.variables[qartodname][start:stop] = flags[start - lo:stop - lo]
+                    timings.written(stop - start)
+                    written.add(qartodname)
+        if consistency:
+            inputs, targets = consistency
+            values = {
+                name: readers[name].values(start, stop)[0] for name in (*inputs, *targets)
+            }
+            with timings.stage("consistency"):
+                flags = qc.consistency_flags(inputs, targets, values)
+            with timings.stage("write"):
+                for name, qartodname in targets.items():
+                    ncfile.variables[qartodname][start:stop] = flags[name]
+                    timings.written(stop - start)
+                    written.add(qartodname)
+        if climatology:
+            pressure, targets = climatology
+            values = {
+                name: readers[name].values(start, stop)[0] for name in (pressure, *targets)
+            }
+            positions = qc.sample_positions(start, stop)
+            with timings.stage("climatology"):
+                flags = qc.climatology_flags(
+                    pressure, targets, values, times.datetimes[start:stop], positions
+                )
+            with timings.stage("write"):
+                for name, qartodname in targets.items():
+                    ncfile.variables[qartodname][start:stop] = flags[name]
+                    timings.written(stop - start)
+                    written.add(qartodname)
+
+    # variables without results are not evaluated
+    for qartodname in plan.dimensions:
+        if qartodname in written:
+            continue
+        shape = plan.shape(qartodname)
+        with timings.stage("write"):
+            if not shape:
+                ncfile.variables[qartodname][...] = NOT_EVALUATED
+                timings.written(1)
+                continue
+            for start, stop in chunks(shape[0], chunk):
+                ncfile.variables[qartodname][start:stop] = NOT_EVALUATED
+            timings.written(shape[0])
+
+    return " ".join(report_list)
+
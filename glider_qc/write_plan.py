@@ -0,0 +1,279 @@
+#!/usr/bin/env python
+"""
+Write planner for the QARTOD flag variables of a netCDF file
+glider_qc/write_plan.py
+"""
+import logging
+
+import numpy as np
+
+log = logging.getLogger(__name__)
+
+FILL_VALUE = np.int8(-128)
+NOT_EVALUATED = np.int8(2)
+# Data models whose variables can be chunked and compressed
+HDF5_DATA_MODELS = ("NETCDF4", "NETCDF4_CLASSIC")
+
+
+def storage_options(ncfile, parent, policy):
+    """
+    Returns the createVariable keyword arguments that lay out a flag variable
+    according to the flag_storage policy of the QC configuration:
+
+        - mode: "none" (uncompressed), "compress" (zlib, complevel and
+          shuffle below) or "match_parent" (the parent's zlib/shuffle
+          settings)
+        - zlib, complevel, shuffle: compression used by "compress"
+
+    Chunks are aligned with the parent variable.  Classic model files cannot
+    be chunked or compressed and always get no options.
+
+    :param ncfile: netCDF4.Dataset
+    :param parent: string defining the name of the variable the flags
+                   describe, or None
+    :param policy: dict with the flag_storage policy, or None
+    :return: dict of createVariable keyword arguments
+    """
+    policy = policy or {}
+    mode = policy.get("mode", "none")
+    if mode == "none" or ncfile.data_model not in HDF5_DATA_MODELS:
+        return {}
+    if mode not in ("compress", "match_parent"):
+        log.warning('Unknown flag_storage mode "%s", flags are not compressed', mode)
+        return {}
+
+    parent_var = ncfile.variables.get(parent) if parent else None
+    if parent_var is not None and not parent_var.dimensions:
+        # scalars cannot be chunked or compressed
+        return {}
+
+    options = {}
+    if parent_var is not None:
+        chunking = parent_var.chunking()
+        if chunking != "contiguous":
+            options["chunksizes"] = chunking
+        if mode == "match_parent":
+            filters = parent_var.filters()
+            options.update(
+                zlib=filters["zlib"],
+                complevel=filters["complevel"],
+                shuffle=filters["shuffle"],
+            )
+            return options
+    options.update(
+        zlib=policy.get("zlib", True),
+        complevel=policy.get("complevel", 4),
+        shuffle=policy.get("shuffle", True),
+    )
+    return options
+
+
+def set_changed_attributes(ncvariable, attributes):
+    """
+    Sets the attributes of a variable whose value differs from the one in
+    the file, all in one call.  netCDF4 enters and leaves define mode once
+    per call on classic model files, instead of once per attribute.
+
+    :param ncvariable: netCDF4.Variable
+    :param attributes: dict of attribute name to value
+    """
+    current = {name: ncvariable.getncattr(name) for name in ncvariable.ncattrs()}
+    changed = {
+        name: value
+        for name, value in attributes.items()
+        if name not in current or not np.array_equal(current[name], value)
+    }
+    if changed:
+        ncvariable.setncatts(changed)
+    return changed
+
+
+class FlagWritePlan(object):
+    """
+    Collects the flag variables, attributes and flag arrays of a file in
+    memory and writes them with commit(): first every definition (variables,
+    then attributes grouped per variable), then every flag array, each exactly
+    once.  Variables without a flag array get NOT_EVALUATED flags.
+    """
+
+    def __init__(self, ncfile, storage=None):
+        """
+        :param ncfile: netCDF4.Dataset opened for writing
+        :param storage: dict with the flag_storage policy of new variables
+                        (optional), see storage_options
+        """
+        self.ncfile = ncfile
+        self.storage = storage
+        self.dimensions = {}
+        self.parents = {}
+        self.attributes = {}
+        self.data = {}
+        self.ancillary = {}
+
+    def __contains__(self, name):
+        return name in self.dimensions
+
+    def add_variable(self, name, dimensions, attributes, parent=None):
+        """
+        Plans an int8 flag variable, created if it does not exist yet
+
+        :param name: string defining the flag variable name
+        :param dimensions: tuple of dimension names
+        :param attributes: dict of attribute name to value
+        :param parent: string defining the name of the variable the flags
+                       are ancillary variables of (optional)
+        """
+        self.dimensions[name] = tuple(dimensions)
+        self.attributes.setdefault(name, {}).update(attributes)
+        self.parents[name] = parent
+        if parent is not None:
+            self.add_ancillary(parent, name)
+
+    def add_ancillary(self, parent, name):
+        """
+        Plans a flag variable as an ancillary variable of another variable,
+        in addition to the parent it was added with
+
+        :param parent: string defining the name of the variable
+        :param name: string defining the flag variable name
+        """
+        children = self.ancillary.setdefault(parent, [])
+        if name not in children:
+            children.append(name)
+
+    def set_attributes(self, name, attributes):
+        """
+        Adds attributes to a planned variable
+
+        :param name: string defining the flag variable name
+        :param attributes: dict of attribute name to value
+        """
+        if name not in self:
+            raise KeyError(name)
+        self.attributes[name].update(attributes)
+
+    def set_data(self, name, flags):
+        """
+        Sets the flag array of a planned variable
+
+        :param name: string defining the flag variable name
+        :param flags: numpy array of flags
+        """
+        if name not in self:
+            raise KeyError(name)
+        self.data[name] = flags
+
+    def shape(self, name):
+        """
+        Returns the shape of a planned variable, from its dimensions
+        """
+        return tuple(len(self.ncfile.dimensions[dim]) for dim in self.dimensions[name])
+
+    def commit_definitions(self):
+        """
+        Writes the planned variables and attributes, without the flag arrays
+        """
+        variables = self.ncfile.variables
+        for name, dimensions in self.dimensions.items():
+            if name not in variables:
+                self.ncfile.createVariable(
+                    name,
+                    np.int8,
+                    dimensions,
+                    fill_value=FILL_VALUE,
+                    **storage_options(self.ncfile, self.parents[name], self.storage),
+                )
+        for name, attributes in self.attributes.items():
+            set_changed_attributes(variables[name], attributes)
+        for parent, children in self.ancillary.items():
+            ncvariable = variables[parent]
+            ancillary_variables = getattr(ncvariable, "ancillary_variables", "")
+            if isinstance(ancillary_variables, str):
+                ancillary_variables = ancillary_variables.split()
+            else:
+                ancillary_variables = []
+            ancillary_variables.extend(
+                child for child in children if child not in ancillary_variables
+            )
+            set_changed_attributes(
+                ncvariable, {"ancillary_variables": " ".join(ancillary_variables)}
+            )
+
+    def commit(self):
+        """
+        Writes the planned definitions, then the flag arrays
+
+        :return: integer number of bytes of flags written
+        """
+        self.commit_definitions()
+        variables = self.ncfile.variables
+        nbytes = 0
+        for name in self.dimensions:
+            flags = self.data.get(name)
+            if flags is None:
+                flags = np.full(self.shape(name), NOT_EVALUATED)
+            variables[name][:] = flags
+            # int8 flags
+            nbytes += np.size(flags)
+
+        log.info("Wrote %s QC flag variables", len(self.dimensions))
+        self.dimensions, self.parents = {}, {}
+        self.attributes, self.data, self.ancillary = {}, {}, {}
+        return nbytes
+
+
+def collect_flags(ncfile):
+    """
+    Returns the QARTOD flag variables and QC comment of a file QC was run
+    on, as a dict with:
+
+        - comment: the dac_qc_comment global attribute, or None
+        - variables: list of (name, dimensions, attributes, parents, flags)
+          tuples, parents being the list of the variables the flags are
+          ancillary variables of
+
+    :param ncfile: netCDF4.Dataset
+    """
+    parents = {}
+    for name, ncvariable in ncfile.variables.items():
+        for child in str(getattr(ncvariable, "ancillary_variables", "")).split():
+            parents.setdefault(child, []).append(name)
+    variables = []
+    for name, ncvariable in ncfile.variables.items():
+        if not name.startswith("qartod_"):
+            continue
+        attributes = {k: v for k, v in ncvariable.__dict__.items() if k != "_FillValue"}
+        variables.append(
+            (
+                name,
+                ncvariable.dimensions,
+                attributes,
+                parents.get(name, []),
+                np.ma.getdata(ncvariable[...]),
+            )
+        )
+    return {
+        "comment": getattr(ncfile, "dac_qc_comment", None),
+        "variables": variables,
+    }
+
+
+def apply_flags(ncfile, flags, storage=None):
+    """
+    Writes flag variables returned by collect_flags to a file
+
+    :param ncfile: netCDF4.Dataset opened for writing
+    :param flags: dict returned by collect_flags
+    :param storage: dict with the flag_storage policy (optional)
+    :return: integer number of bytes of flags written
+    """
+    plan = FlagWritePlan(ncfile, storage)
+    for name, dimensions, attributes, parents, data in flags["variables"]:
+        plan.add_variable(name, dimensions, attributes, parents[0] if parents else None)
+        for parent in parents[1:]:
+            plan.add_ancillary(parent, name)
+        plan.set_data(name, data)
+    nbytes = plan.commit()
+    if flags["comment"] is not None:
+        ncfile.dac_qc_comment = flags["comment"]
+    return nbytes
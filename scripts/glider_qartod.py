@@ -3,16 +3,22 @@
 scripts/glider_qartod.py
 '''
 from argparse import ArgumentParser
-from glider_qc import glider_qc
-from rq import Queue, Worker
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from glider_qc import climatology, glider_qc, instrumentation, queues, reqc, sidecar, status_index
 import logging
 import os
+import queue
+import threading
 import time
 
 from glider_dac import log_format_str
 
 APP = 'gliderdac'
 QC_KEY = APP + ':glider_qartod'
+# Number of scanned directories waiting to be checked, and of threads
+# checking their files
+SCAN_QUEUE_SIZE = 64
+SCAN_THREADS = 4
 
 def acquire_master_lock():
     '''
@@ -52,8 +58,23 @@ def main():
     if args.clear:
         clear_master_lock()
 
+    if args.metrics:
+        print_queue_metrics()
+        return
+
+    if args.timings is not None:
+        print_stage_latencies(args.timings)
+        return
+
     if args.worker:
-        worker = Worker([APP], connection=glider_qc.get_redis_connection())
+        if args.config is not None:
+            # the work horses forked per job inherit the memory maps
+            climatology.preload(glider_qc.GliderQC(None, args.config).config)
+        worker = queues.QCWorker(
+            [queues.get_qc_queue(delayed_mode) for delayed_mode in (False, True)],
+            connection=glider_qc.get_redis_connection(),
+            delayed_share=args.delayed_share,
+        )
         worker.work()
 
     lock = acquire_master_lock()
@@ -62,30 +83,113 @@ def main():
         raise glider_qc.ProcessError("Master lock already held by another process")
 
     try:
-        file_paths = []
-
         if args.verbose:
             setup_logging()
 
-        if args.recursive:
-            file_paths = get_files(args.netcdf_files)
-        else:
-            file_paths = args.netcdf_files
-
         if args.config is None:
             raise ValueError("No configuration found, please set using -c")
 
-        process(file_paths, args.config, sync=args.sync)
+        if args.reqc:
+            process_reqc(args.netcdf_files, args.config, args.reqc, sync=args.sync)
+        elif args.recursive:
+            process_tree(args.netcdf_files, args.config, sync=args.sync, jobs=args.jobs)
+        else:
+            process(args.netcdf_files, args.config, sync=args.sync, jobs=args.jobs)
 
     finally:
         lock.release()
 
-def process(file_paths, config, sync=False):
-    queue = Queue(APP, connection=glider_qc.get_redis_connection())
+def process(file_paths, config, sync=False, jobs=None):
+    '''
+    Applies QC to the files that need it
 
-    for nc_path in file_paths:
+    :param list file_paths: Paths of the netCDF files
+    :param str config: Path to the QC configuration
+    :param bool sync: Run the QC in this process
+    :param int jobs: Run the QC in a pool of jobs local processes
+    '''
+    dispatcher = QCDispatcher(config, sync=sync, jobs=jobs)
+    try:
         sync_lock()
+        dispatcher.submit(check_files(file_paths))
+    finally:
+        dispatcher.finish()
+
+
+def process_tree(netcdf_dirs, config, sync=False, jobs=None):
+    '''
+    Applies QC to the files of the directories that need it.  The files of
+    each deployment are dispatched as soon as they were checked, while the
+    rest of the tree is still being scanned.
+
+    :param list netcdf_dirs: Directories to scan recursively
+    :param str config: Path to the QC configuration
+    :param bool sync: Run the QC in this process
+    :param int jobs: Run the QC in a pool of jobs local processes
+    '''
+    index = status_index.get_status_index()
+    dispatcher = QCDispatcher(config, sync=sync, jobs=jobs)
+    try:
+        for directory, mtime_ns, qc_paths in check_scan(netcdf_dirs):
+            dispatcher.submit(qc_paths)
+            # directories with files to QC are scanned again next time, like
+            # before, until all of their files are QC'ed
+            if index is not None and mtime_ns is not None and not qc_paths:
+                index.set_watermark(directory, mtime_ns)
+    finally:
+        dispatcher.finish()
+
 
+def process_reqc(netcdf_dirs, config, checkpoint_path, sync=False):
+    '''
+    Re-QCs the files of the directories whose QC configuration changed: only
+    the affected tests of each file are run again, on the delayed mode queue
+    or in this process (sync).  Progress is kept in the checkpoint, an
+    interrupted re-QC resumes where it stopped when run again.
+
+    :param list netcdf_dirs: Directories to scan recursively
+    :param str config: Path to the new QC configuration
+    :param str checkpoint_path: Path to the re-QC checkpoint database
+    :param bool sync: Run the re-QC in this process
+    '''
+    checkpoint = reqc.ReQCCheckpoint(checkpoint_path)
+    nc_paths = (
+        os.path.join(root, name)
+        for netcdf_dir in netcdf_dirs
+        for root, dirs, names in sorted_walk(netcdf_dir)
+        for name in names
+        if name.endswith('.nc')
+    )
+    planned = reqc.plan_archive(nc_paths, config, checkpoint)
+    glider_qc.log.info("%s files to re-QC", len(planned))
+    if not sync:
+        reqc.enqueue_reqc(queues.get_qc_queue(delayed_mode=True), planned, config,
+                          checkpoint_path)
+        return
+    for nc_path, tests in planned:
+        try:
+            reqc.reqc_task(nc_path, config, tests, checkpoint_path)
+        except Exception:
+            glider_qc.log.exception("Failed to re-QC %s", nc_path)
+
+
+def sorted_walk(directory):
+    '''
+    os.walk in name order, so that a re-QC plans files in a stable order
+    '''
+    for root, dirs, names in os.walk(directory):
+        dirs.sort()
+        yield root, dirs, sorted(names)
+
+
+def check_files(file_paths):
+    '''
+    Returns the paths of the files that need QC
+
+    :param list file_paths: Paths of the netCDF files
+    '''
+    qc_paths = []
+    for nc_path in file_paths:
         try:
             glider_qc.log.info("Inspecting %s", nc_path)
 
@@ -93,19 +197,262 @@ def process(file_paths, config, sync=False):
                 continue
 
             glider_qc.log.info("Applying QC to dataset %s", nc_path)
-
-            if sync:
-                glider_qc.qc_task(nc_path, config)
-            else:
-                queue.enqueue(glider_qc.qc_task, nc_path, config)
+            qc_paths.append(nc_path)
 
         except Exception:
             glider_qc.log.exception("Failed to check %s for QC", nc_path)
+    return qc_paths
+
+
+def check_scan(netcdf_dirs, threads=SCAN_THREADS):
+    '''
+    Scans the directories in a background thread and checks the files of
+    each directory found in a pool of threads.  Directories are handed over
+    through a bounded queue, so the scan stays at most SCAN_QUEUE_SIZE
+    directories ahead of the checks.
+
+    :param list netcdf_dirs: Directories to scan recursively
+    :param int threads: Number of threads checking files
+    :return: Generator of (directory, mtime_ns, paths of the files that need QC)
+    '''
+    directories = queue.Queue(maxsize=SCAN_QUEUE_SIZE)
+    results = queue.Queue()
+
+    def scan():
+        try:
+            for item in scan_deployments(netcdf_dirs):
+                directories.put(item)
+        except Exception:
+            glider_qc.log.exception("Failed to scan %s", netcdf_dirs)
+        finally:
+            status_index.close_status_index()
+            for _ in range(threads):
+                directories.put(None)
+
+    def check():
+        try:
+            while True:
+                item = directories.get()
+                if item is None:
+                    break
+                directory, mtime_ns, nc_paths = item
+                sync_lock()
+                results.put((directory, mtime_ns, check_files(nc_paths)))
+        finally:
+            status_index.close_status_index()
+            results.put(None)
+
+    workers = [threading.Thread(target=scan, daemon=True)]
+    workers.extend(threading.Thread(target=check, daemon=True) for _ in range(threads))
+    for worker in workers:
+        worker.start()
+
+    running = threads
+    while running:
+        item = results.get()
+        if item is None:
+            running -= 1
+        else:
+            yield item
+
+
+def scan_deployments(netcdf_dirs):
+    '''
+    Walks the directories with os.scandir and yields the netCDF files of
+    each directory, sorted by name.  The modification time of a directory
+    without subdirectories that did not change since its last scan (the
+    watermark kept in the QC status index) only means that no file was added,
+    removed or renamed: files rewritten in place with their old modification
+    time (e.g. by rsync -t) do not change it.  Of such a directory, only the
+    files whose (inode, size, mtime_ns) differ from their record in the index
+    are yielded, and the directory is skipped if there are none.
+
+    :param list netcdf_dirs: Directories to scan recursively, the ones
+                             ending in -delayed are ignored
+    :return: Generator of (directory, mtime_ns, netCDF file paths)
+    '''
+    index = status_index.get_status_index()
+    stack = [d for d in reversed(netcdf_dirs) if not d.endswith("-delayed")]
+    while stack:
+        directory = stack.pop()
+        try:
+            mtime_ns = os.stat(directory).st_mtime_ns
+            unchanged = index is not None and index.get_watermark(directory) == mtime_ns
+
+            subdirs = []
+            nc_entries = []
+            with os.scandir(directory) as entries:
+                for entry in entries:
+                    if entry.is_dir(follow_symlinks=False):
+                        subdirs.append(entry.path)
+                    elif entry.name.endswith('.nc'):
+                        nc_entries.append(entry)
+
+            if unchanged:
+                states = index.file_states(directory)
+                nc_entries = [
+                    entry for entry in nc_entries
+                    if states.get(os.path.abspath(entry.path)) != sidecar.file_state(entry)
+                ]
+                if not nc_entries:
+                    continue
+            nc_paths = [entry.path for entry in nc_entries]
+        except OSError:
+            glider_qc.log.exception("Failed to scan %s", directory)
+            continue
+
+        stack.extend(sorted(subdirs, reverse=True))
+        if nc_paths or not subdirs:
+            # only directories without subdirectories get a watermark, so
+            # that unchanged parents are still descended into
+            yield directory, None if subdirs else mtime_ns, sorted(nc_paths)
+
+
+class QCDispatcher(object):
+    '''
+    Dispatches the files that need QC in one batch per deployment, either to
+    the realtime or delayed mode rq queue, to a pool of local processes (jobs) or to this process
+    (sync).  The throughput of local QC is printed by finish().
+    '''
+
+    def __init__(self, config, sync=False, jobs=None):
+        self.config = config
+        self.sync = sync
+        self.jobs = jobs
+        self.qc_paths = []
+        self.processed = 0
+        self.futures = {}
+        self.start = time.perf_counter()
+        self.executor = ProcessPoolExecutor(max_workers=jobs) if jobs else None
+        self.rq_queues = None
+        if not (sync or jobs):
+            self.rq_queues = {
+                delayed_mode: queues.get_qc_queue(delayed_mode)
+                for delayed_mode in (False, True)
+            }
+
+    def submit(self, qc_paths):
+        '''
+        Dispatches files that need QC
+
+        :param list qc_paths: Paths of the netCDF files that need QC
+        '''
+        if not qc_paths:
+            return
+        if self.rq_queues is None:
+            self.qc_paths.extend(qc_paths)
+        batches = glider_qc.group_by_deployment(qc_paths)
+        for deployment_dir, file_names in batches.items():
+            delayed_mode = queues.is_delayed_mode(deployment_dir)
+            # queued delayed mode jobs are kept small, so that realtime jobs
+            # do not wait for long behind them
+            size = glider_qc.QC_BATCH_SIZE
+            if self.rq_queues is not None:
+                size = queues.batch_size(delayed_mode)
+            for start in range(0, len(file_names), size):
+                batch = file_names[start:start + size]
+                # a deployment sync may have started since the files were
+                # checked, wait for it before every batch is dispatched
+                sync_lock()
+                if self.rq_queues is not None:
+                    glider_qc.enqueue_qc_batches(
+                        self.rq_queues[delayed_mode],
+                        [os.path.join(deployment_dir, name) for name in batch],
+                        self.config,
+                        batch_size=size,
+                    )
+                elif self.executor is None:
+                    self.processed += glider_qc.qc_deployment_batch(
+                        deployment_dir, batch, self.config)
+                else:
+                    future = self.executor.submit(glider_qc.qc_deployment_batch,
+                                                  deployment_dir, batch, self.config)
+                    self.futures[future] = deployment_dir
+
+    def finish(self):
+        '''
+        Waits for the local QC to finish and reports its throughput
+        '''
+        if self.executor is not None:
+            for future in as_completed(self.futures):
+                try:
+                    self.processed += future.result()
+                except Exception:
+                    glider_qc.log.exception("QC batch failed for %s", self.futures[future])
+            self.executor.shutdown()
+        if self.rq_queues is None:
+            report_throughput(self.qc_paths, self.processed,
+                              time.perf_counter() - self.start)
+
+
+def report_throughput(qc_paths, processed, elapsed):
+    '''
+    Prints how fast the files were QC'ed
+
+    :param list qc_paths: Paths of the netCDF files QC was requested for
+    :param int processed: Number of files QC was run on
+    :param float elapsed: Seconds it took
+    '''
+    size_mb = 0
+    for nc_path in qc_paths:
+        try:
+            size_mb += os.path.getsize(nc_path) / 1e6
+        except OSError:
+            pass
+    elapsed = max(elapsed, 1e-9)
+    print(f"QC ran on {processed} of {len(qc_paths)} files ({size_mb:.1f} MB) "
+          f"in {elapsed:.1f} s: {processed / elapsed:.2f} files/s, "
+          f"{size_mb / elapsed:.2f} MB/s")
+
+
+def print_queue_metrics():
+    '''
+    Prints the depth and recent wait times of the QC queues
+    '''
+    def seconds(value):
+        return "-" if value is None else f"{value:.1f}"
+
+    print(f"{'queue':<20}{'depth':>8}{'jobs':>8}{'mean wait':>12}{'p95 wait':>12}{'max wait':>12}")
+    for name, metrics in queues.queue_metrics().items():
+        print(f"{name:<20}{metrics['depth']:>8}{metrics['jobs']:>8}"
+              f"{seconds(metrics['mean_wait']):>12}{seconds(metrics['p95_wait']):>12}"
+              f"{seconds(metrics['max_wait']):>12}")
+
+
+def print_stage_latencies(log_paths):
+    '''
+    Prints the median and 95th percentile latency of the QC stages per
+    deployment, from the job records of log files or of the Redis stream
+
+    :param list log_paths: Paths of QC log files, empty to read the stream
+    '''
+    if log_paths:
+        records = []
+        for log_path in log_paths:
+            with open(log_path) as f:
+                records.extend(instrumentation.read_log(f))
+    else:
+        records = instrumentation.read_stream(glider_qc.get_redis_connection())
+
+    print(f"{'deployment':<40}{'stage':<20}{'jobs':>8}{'p50 (s)':>12}{'p95 (s)':>12}")
+    latencies = instrumentation.stage_latencies(records)
+    for deployment in sorted(latencies, key=str):
+        for stage, metrics in sorted(latencies[deployment].items()):
+            print(f"{str(deployment):<40}{stage:<20}{metrics['jobs']:>8}"
+                  f"{metrics['p50']:>12.3f}{metrics['p95']:>12.3f}")
 
 
 def get_args():
     parser = ArgumentParser(description=main.__doc__)
     parser.add_argument('-w', '--worker', action='store_true', help='Launch a worker')
+    parser.add_argument('--delayed-share', type=int, default=queues.QC_DELAYED_SHARE,
+        help='Realtime jobs a worker runs in a row before taking a delayed mode job '
+             '(0 drains the realtime queue first)')
+    parser.add_argument('--metrics', action='store_true',
+        help='Print the depth and wait times of the QC queues')
+    parser.add_argument('--timings', nargs='*', metavar='LOG',
+        help='Print the p50/p95 latencies of the QC stages per deployment, from the '
+             'job records of the LOG files or, without any, of the Redis stream')
 
     parser.add_argument('-r', '--recursive',
         action='store_true', help='Iterate through the directory contents recursively')
@@ -114,7 +461,12 @@ def get_args():
     parser.add_argument('-v', '--verbose', action='store_true', help='Turn on logging')
 
     parser.add_argument('--sync', action='store_true', help='Run the jobs synchronously')
+    parser.add_argument('-j', '--jobs', type=int,
+        help='Run the jobs in a pool of JOBS local processes')
     parser.add_argument('--clear', action='store_true', help='Clear all locks')
+    parser.add_argument('--reqc', metavar='CHECKPOINT',
+        help='Re-QC the tests whose configuration changed in the files of the '
+             'directories, keeping progress in the CHECKPOINT database')
 
     parser.add_argument('netcdf_files', nargs='*', help='NetCDF file to apply QC to')
     args = parser.parse_args()
@@ -122,26 +474,6 @@ def get_args():
     return args
 
 
-def get_files(netcdf_files):
-    '''
-    Returns all of the netCDF files found in the directory recursively
-
-    :param str netcdf_files: Directory of the netCDF files
-    '''
-    file_paths = []
-    for netcdf_dir in netcdf_files:
-
-        if netcdf_dir.endswith("-delayed"):
-            continue
-
-        for (path, _, files) in os.walk(netcdf_dir):
-            for filename in files:
-
-                if filename.endswith('.nc'):
-                    file_paths.append(os.path.join(path, filename))
-
-    return file_paths
-
 def setup_logging(
     default_path=None,
     default_level=logging.INFO,
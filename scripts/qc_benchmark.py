@@ -0,0 +1,318 @@
+#!/usr/bin/env python
+'''
+scripts/qc_benchmark.py
+
+Measures the throughput (files/s) and peak resident memory of the QC
+pipeline on synthetic glider profile files, and compares them to a stored
+baseline so that performance regressions are caught:
+
+    - check_needs_qc: inspection of files that were never QC'ed
+    - create_qc_variables: creation of the QARTOD flag variables
+    - run_qc: the QARTOD tests, from reading the file to writing the flags
+    - qc_task: the rq job, including the file lock and the result cache
+      (needs Redis, skipped if it cannot be reached)
+
+The profile files are modelled on the Murphy test file: same global
+attributes, variables and attributes, with a configurable number of samples
+and set of geophysical variables.  Each benchmark runs in its own process,
+so that its peak RSS is its own.  A baseline is only comparable with runs on
+the same host with the same file parameters; store one with --save-baseline.
+'''
+from argparse import ArgumentParser
+from concurrent.futures import ProcessPoolExecutor
+from glider_qc import glider_qc
+from glider_qc.write_plan import FlagWritePlan
+from netCDF4 import Dataset
+import json
+import logging
+import multiprocessing
+import numpy as np
+import os
+import redis
+import resource
+import shutil
+import sys
+import tempfile
+import time
+import yaml
+
+TEMPLATE = os.path.join(os.path.dirname(__file__), '..', 'glider_dac', 'tests', 'data',
+                        'Murphy-20150809T135508Z', 'Murphy-20150809T135508Z_rt.nc')
+DEFAULT_BASELINE = os.path.join(os.path.dirname(__file__), 'qc_benchmark_baseline.json')
+
+# Geophysical variables of the template, which the QARTOD tests run on
+GEOPHYSICAL_VARIABLES = ('temperature', 'conductivity', 'salinity', 'density', 'pressure')
+
+# Seconds between samples and vertical speed (dbar/s) of the synthetic
+# glider, which yos between the surface and MAX_PRESSURE dbar
+SAMPLE_INTERVAL = 10.0
+VERTICAL_SPEED = 0.15
+MAX_PRESSURE = 200.0
+
+BENCHMARKS = ('check_needs_qc', 'create_qc_variables', 'run_qc', 'qc_task')
+
+# Relative loss of throughput or growth of peak RSS reported as a regression
+DEFAULT_TOLERANCE = 0.2
+
+
+def synthetic_profile(samples, start, rng):
+    '''
+    Returns the synthetic time series of a profile, by variable name
+
+    :param int samples: Number of samples
+    :param float start: Seconds since the epoch of the first sample
+    :param rng: numpy random Generator
+    '''
+    seconds = start + np.arange(samples) * SAMPLE_INTERVAL
+    # triangle wave between the surface and MAX_PRESSURE
+    travel = (seconds - start) * VERTICAL_SPEED % (2 * MAX_PRESSURE)
+    pressure = 1.0 + np.minimum(travel, 2 * MAX_PRESSURE - travel)
+    thermocline = np.exp(-pressure / 100.0)
+    temperature = 10.0 + 20.0 * thermocline + rng.normal(0, 0.01, samples)
+    salinity = 35.0 + 1.4 * thermocline + rng.normal(0, 0.005, samples)
+    return {
+        'time': seconds,
+        'lat': 27.0608 + 1e-6 * np.arange(samples),
+        'lon': -88.9925 + 1e-6 * np.arange(samples),
+        'pressure': pressure,
+        'depth': pressure * 0.993,
+        'temperature': temperature,
+        'salinity': salinity,
+        'conductivity': 3.4 + 0.088 * temperature + rng.normal(0, 0.001, samples),
+        'density': 1027.0 + 0.0045 * pressure - 0.2 * (temperature - 10.0),
+    }
+
+
+def write_profile(nc_path, samples, variables=GEOPHYSICAL_VARIABLES, seed=0, start=None,
+                  template=TEMPLATE):
+    '''
+    Writes a synthetic glider profile file modelled on a template file
+
+    :param str nc_path: Path of the file to write
+    :param int samples: Length of the time dimension
+    :param variables: Geophysical variables to include, the others of the
+                      template and their status flags are left out
+    :param int seed: Seed of the random noise added to the data
+    :param float start: Seconds since the epoch of the first sample,
+                        defaults to the template's
+    :param str template: Path of the template file
+    '''
+    rng = np.random.default_rng(seed)
+    excluded = set(GEOPHYSICAL_VARIABLES) - set(variables)
+    excluded |= {f'{name}_qc' for name in excluded}
+    with Dataset(template) as src, Dataset(nc_path, 'w', format=src.data_model) as dst:
+        if start is None:
+            start = float(src.variables['time'][0])
+        profile = synthetic_profile(samples, start, rng)
+        dst.setncatts(src.__dict__)
+        for name, dimension in src.dimensions.items():
+            dst.createDimension(name, samples if name == 'time' else len(dimension))
+        for name, variable in src.variables.items():
+            if name in excluded:
+                continue
+            attrs = variable.__dict__.copy()
+            fill_value = attrs.pop('_FillValue', None)
+            out = dst.createVariable(name, variable.dtype, variable.dimensions,
+                                     fill_value=fill_value)
+            out.setncatts(attrs)
+            if name in profile:
+                out[:] = profile[name]
+            elif variable.dimensions == ('time',):
+                # status flags
+                out[:] = np.zeros(samples, dtype=variable.dtype)
+            elif name in ('profile_time', 'time_uv'):
+                out[...] = profile['time'].mean()
+            elif name in ('profile_lat', 'lat_uv'):
+                out[...] = profile['lat'].mean()
+            elif name in ('profile_lon', 'lon_uv'):
+                out[...] = profile['lon'].mean()
+            else:
+                out[...] = variable[...]
+    return nc_path
+
+
+def generate_files(deployment_dir, count, samples, variables, seed):
+    '''
+    Writes consecutive synthetic profile files of a deployment
+
+    :return: list of the file paths
+    '''
+    os.makedirs(deployment_dir)
+    with Dataset(TEMPLATE) as src:
+        start = float(src.variables['time'][0])
+    paths = []
+    for i in range(count):
+        nc_path = os.path.join(deployment_dir, f'{i:05d}.nc')
+        write_profile(nc_path, samples, variables, seed + i,
+                      start + i * samples * SAMPLE_INTERVAL)
+        paths.append(nc_path)
+    return paths
+
+
+def bench_check_needs_qc(paths, config):
+    for nc_path in paths:
+        glider_qc.check_needs_qc(nc_path)
+
+
+def bench_create_qc_variables(paths, config):
+    for nc_path in paths:
+        with Dataset(nc_path, 'r+') as nc:
+            qc = glider_qc.GliderQC(nc, config)
+            plan = FlagWritePlan(nc, qc.flag_storage)
+            variables, _ = qc.find_geophysical_variables()
+            for name in variables:
+                qc.create_qc_variables(nc.variables[name], plan)
+            plan.commit()
+
+
+def bench_run_qc(paths, config):
+    for nc_path in paths:
+        with Dataset(nc_path, 'r+') as nc:
+            glider_qc.run_qc(config, nc, nc_path)
+
+
+def bench_qc_task(paths, config):
+    for nc_path in paths:
+        glider_qc.qc_task(nc_path, config)
+
+
+def run_benchmark(name, paths, config, status_index_path):
+    '''
+    Runs a benchmark on files, in a process of its own
+
+    :return: dict of files, seconds, files_per_s and peak_rss_mb
+    '''
+    logging.disable(logging.INFO)
+    # a fresh status index, so that every file is inspected
+    os.environ['QC_STATUS_INDEX'] = status_index_path
+    start = time.perf_counter()
+    globals()[f'bench_{name}'](paths, config)
+    seconds = max(time.perf_counter() - start, 1e-9)
+    return {
+        'files': len(paths),
+        'seconds': seconds,
+        'files_per_s': len(paths) / seconds,
+        # kilobytes on Linux
+        'peak_rss_mb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+    }
+
+
+def redis_available():
+    '''
+    Returns True if the Redis server QC jobs use can be reached
+    '''
+    try:
+        return glider_qc.get_redis_connection().ping()
+    except redis.RedisError:
+        return False
+
+
+def compare(results, baseline, parameters, tolerance):
+    '''
+    Returns the regressions of results against a baseline
+
+    :param dict results: Benchmark name to its results
+    :param dict baseline: Stored parameters and results
+    :param dict parameters: Parameters of the synthetic files
+    :param float tolerance: Relative change reported as a regression
+    :return: list of regression messages
+    '''
+    regressions = []
+    if baseline.get('parameters') != parameters:
+        print(f'Baseline parameters {baseline.get("parameters")} differ, not compared')
+        return regressions
+    for name, result in results.items():
+        reference = baseline['results'].get(name)
+        if reference is None:
+            continue
+        if result['files_per_s'] < reference['files_per_s'] * (1 - tolerance):
+            regressions.append(f'{name}: {result["files_per_s"]:.2f} files/s, '
+                               f'baseline {reference["files_per_s"]:.2f}')
+        if result['peak_rss_mb'] > reference['peak_rss_mb'] * (1 + tolerance):
+            regressions.append(f'{name}: peak RSS {result["peak_rss_mb"]:.1f} MB, '
+                               f'baseline {reference["peak_rss_mb"]:.1f}')
+    return regressions
+
+
+def main(args):
+    with open(args.config) as f:
+        config = yaml.safe_load(f)
+    # deployment-wide statistics would need Redis, which is not part of
+    # what is measured here
+    config['threshold_statistics'] = 'file'
+    parameters = {'files': args.files, 'samples': args.samples,
+                  'variables': sorted(args.variables)}
+
+    benchmarks = args.benchmarks
+    if 'qc_task' in benchmarks and not redis_available():
+        print('Redis cannot be reached, skipping qc_task')
+        benchmarks = [name for name in benchmarks if name != 'qc_task']
+
+    results = {}
+    workdir = tempfile.mkdtemp(dir=args.workdir)
+    # spawned processes start without the memory of this one
+    context = multiprocessing.get_context('spawn')
+    try:
+        print(f'{"benchmark":<22}{"files":>8}{"time (s)":>12}{"files/s":>10}{"peak RSS (MB)":>16}')
+        for name in benchmarks:
+            paths = generate_files(
+                os.path.join(workdir, name, 'Murphy-20150809T135508Z'),
+                args.files, args.samples, args.variables, args.seed,
+            )
+            with ProcessPoolExecutor(max_workers=1, mp_context=context) as executor:
+                result = executor.submit(run_benchmark, name, paths, config,
+                                         os.path.join(workdir, name, 'index.sqlite')).result()
+            results[name] = result
+            print(f'{name:<22}{result["files"]:>8}{result["seconds"]:>12.3f}'
+                  f'{result["files_per_s"]:>10.2f}{result["peak_rss_mb"]:>16.1f}')
+    finally:
+        shutil.rmtree(workdir)
+
+    if args.save_baseline:
+        with open(args.baseline, 'w') as f:
+            json.dump({'parameters': parameters, 'results': results}, f, indent=2)
+        print(f'Baseline saved to {args.baseline}')
+        return 0
+
+    if not os.path.exists(args.baseline):
+        print(f'No baseline at {args.baseline}, store one with --save-baseline')
+        return 0
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+    regressions = compare(results, baseline, parameters, args.tolerance)
+    for regression in regressions:
+        print(f'REGRESSION {regression}')
+    return 1 if regressions else 0
+
+
+def get_args():
+    default_config = os.path.join(os.path.dirname(glider_qc.__file__), 'qc_config.yml')
+    parser = ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('-c', '--config', default=default_config,
+                        help='Path to the QC configuration')
+    parser.add_argument('-n', '--files', type=int, default=50,
+                        help='Number of profile files per benchmark')
+    parser.add_argument('-s', '--samples', type=int, default=500,
+                        help='Number of samples per profile file')
+    parser.add_argument('--variables', nargs='+', default=list(GEOPHYSICAL_VARIABLES),
+                        choices=GEOPHYSICAL_VARIABLES,
+                        help='Geophysical variables of the profile files')
+    parser.add_argument('-b', '--benchmarks', nargs='+', default=list(BENCHMARKS),
+                        choices=BENCHMARKS, help='Benchmarks to run')
+    parser.add_argument('--seed', type=int, default=int(time.time()),
+                        help='Seed of the synthetic data, different per run by default so '
+                             'that qc_task does not hit the QC result cache')
+    parser.add_argument('--baseline', default=DEFAULT_BASELINE,
+                        help='Path to the baseline JSON file')
+    parser.add_argument('--save-baseline', action='store_true',
+                        help='Store the results as the baseline instead of comparing them')
+    parser.add_argument('--tolerance', type=float, default=DEFAULT_TOLERANCE,
+                        help='Relative throughput loss or memory growth reported as a regression')
+    parser.add_argument('--workdir', help='Directory the files are written to, defaults to '
+                                          'the system temporary directory')
+    return parser.parse_args()
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.WARNING)
+    sys.exit(main(get_args()))
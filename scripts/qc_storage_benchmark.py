@@ -0,0 +1,106 @@
+#!/usr/bin/env python
+'''
+scripts/qc_storage_benchmark.py
+
+Compares the size and QC write time of a profile file for each QARTOD flag
+storage policy.  Classic format files are converted to netCDF-4 first, with
+compressed science variables, since classic files cannot be compressed.
+'''
+from argparse import ArgumentParser
+from glider_qc import glider_qc
+from netCDF4 import Dataset
+import logging
+import os
+import shutil
+import tempfile
+import time
+import yaml
+
+POLICIES = {
+    'none': {'mode': 'none'},
+    'compress': {'mode': 'compress', 'zlib': True, 'complevel': 4, 'shuffle': True},
+    'match_parent': {'mode': 'match_parent'},
+}
+
+
+def to_netcdf4(src_path, dst_path):
+    '''
+    Copies a netCDF file to the netCDF-4 format, compressing its variables
+    '''
+    with Dataset(src_path) as src, Dataset(dst_path, 'w', format='NETCDF4') as dst:
+        dst.setncatts(src.__dict__)
+        for name, dimension in src.dimensions.items():
+            dst.createDimension(name, None if dimension.isunlimited() else len(dimension))
+        for name, variable in src.variables.items():
+            attrs = variable.__dict__.copy()
+            fill_value = attrs.pop('_FillValue', None)
+            compress = bool(variable.dimensions) and variable.dtype.kind != 'S'
+            out = dst.createVariable(name, variable.dtype, variable.dimensions,
+                                     fill_value=fill_value, zlib=compress, shuffle=compress)
+            out.setncatts(attrs)
+            out.set_auto_maskandscale(False)
+            variable.set_auto_maskandscale(False)
+            out[...] = variable[...]
+
+
+def run(nc_path, config, copies, policy, workdir):
+    '''
+    Runs QC on copies of a file with a flag storage policy and returns the
+    total time and the size of a QC'ed file
+    '''
+    config = dict(config, flag_storage=POLICIES[policy], context_window=0)
+    deployment_dir = os.path.join(workdir, policy, os.path.basename(os.path.dirname(nc_path)))
+    os.makedirs(deployment_dir)
+    paths = []
+    for i in range(copies):
+        paths.append(shutil.copy(nc_path, os.path.join(deployment_dir, f'{i:05d}.nc')))
+
+    start = time.perf_counter()
+    for path in paths:
+        with Dataset(path, 'r+') as nc:
+            glider_qc.run_qc(config, nc, path)
+    elapsed = time.perf_counter() - start
+    return elapsed, os.path.getsize(paths[0])
+
+
+def main(args):
+    with open(args.config) as f:
+        config = yaml.safe_load(f)
+    # deployment-wide statistics would need Redis, which is not part of
+    # what is measured here
+    config['threshold_statistics'] = 'file'
+
+    workdir = tempfile.mkdtemp()
+    try:
+        nc_path = os.path.join(workdir, os.path.basename(os.path.dirname(args.file)),
+                               os.path.basename(args.file))
+        os.makedirs(os.path.dirname(nc_path))
+        to_netcdf4(args.file, nc_path)
+        print(f'{"policy":<14}{"file size (B)":>16}{"write time (s)":>16}{"files/s":>10}')
+        print(f'{"(no QC)":<14}{os.path.getsize(nc_path):>16}{"":>16}{"":>10}')
+        for policy in POLICIES:
+            elapsed, size = run(nc_path, config, args.copies, policy, workdir)
+            print(f'{policy:<14}{size:>16}{elapsed:>16.3f}{args.copies / elapsed:>10.1f}')
+    finally:
+        shutil.rmtree(workdir)
+    return 0
+
+
+def get_args():
+    default_file = os.path.join(os.path.dirname(__file__), '..', 'glider_dac', 'tests', 'data',
+                                'Murphy-20150809T135508Z', 'Murphy-20150809T135508Z_rt.nc')
+    default_config = os.path.join(os.path.dirname(glider_qc.__file__), 'qc_config.yml')
+    parser = ArgumentParser(description=__doc__)
+    parser.add_argument('-f', '--file', default=default_file,
+                        help='Profile file to benchmark, defaults to the Murphy test file')
+    parser.add_argument('-c', '--config', default=default_config,
+                        help='Path to the QC configuration')
+    parser.add_argument('-n', '--copies', type=int, default=50,
+                        help='Number of copies of the file QC is run on per policy')
+    return parser.parse_args()
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.WARNING)
+    import sys
+    sys.exit(main(get_args()))